@@ -251,7 +251,10 @@ def main(args_):
         sip_manifest = os.path.join(
             accession_path, uuid
             ) + '_manifest.md5'
-        sha512_log = manifest.main([new_uuid_path, '-sha512', '-s'])
+        sha512_log = manifest.main(
+            [new_uuid_path, '-sha512', '-s'],
+            ififuncs.get_objects_sha512(new_uuid_path)
+        )
         sha512_manifest = os.path.join(
             os.path.dirname(new_uuid_path), uuid + '_manifest-sha512.txt'
         )
@@ -274,6 +277,12 @@ def main(args_):
         # this is inefficient. The script should not have to ask for filmographic
         # number twice if someone wants to insert the filmographic but do not
         # want to make the pbcore csv, perhaps because the latter already exists.
+        # The manifests are read once here and every new entry is hashed and
+        # written in a single update once the log is complete.
+        package_manifests = [
+            ififuncs.Manifest(sip_manifest, 'md5'),
+            ififuncs.Manifest(sha512_manifest, 'sha512')
+        ]
         if args.filmo_csv:
             metadata_dir = os.path.join(new_uuid_path, 'metadata')
             if '+' in filmo_number:
@@ -287,18 +296,18 @@ def main(args_):
                     sipcreator_log,
                     'EVENT = Metadata extraction - eventDetail=Filmographic descriptive metadata added to metadata folder, eventOutcome=%s, agentName=aipcreator.py' % (package_filmographic)
                 )
-                ififuncs.manifest_update(sip_manifest, package_filmographic)
-                ififuncs.sha512_update(sha512_manifest, package_filmographic)
+                for package_manifest in package_manifests:
+                    package_manifest.add(package_filmographic)
                 print('Filmographic descriptive metadata added to metadata folder')
         ififuncs.generate_log(
             sipcreator_log,
             'EVENT = aipcreator.py finished'
         )
-        ififuncs.checksum_replace(sip_manifest, sipcreator_log, 'md5')
-        ififuncs.checksum_replace(sha512_manifest, sipcreator_log, 'sha512')
-        if dfxml_check is True:
-            ififuncs.manifest_update(sip_manifest, dfxml)
-            ififuncs.sha512_update(sha512_manifest, dfxml)
+        for package_manifest in package_manifests:
+            package_manifest.rehash(sipcreator_log)
+            if dfxml_check is True:
+                package_manifest.add(dfxml)
+        ififuncs.save_manifests(package_manifests, sort=True, normalise=True)
         if args.pbcore:
             for filmo in filmo_list:
                 makepbcore_cmd = [accession_path, '-p', '-user', user, '-filmo_number', filmo]
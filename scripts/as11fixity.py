@@ -34,11 +34,8 @@ def digest_with_progress(filename, chunk_size):
     last_percent_done = 0
     digest = hashlib.md5()
     total_size = os.path.getsize(filename)
-    data = True
-    f = open(filename, 'rb', encoding= 'utf-8')
-    while data:
+    for data in ififuncs.read_blocks(filename, block_size=chunk_size):
         # Read and update digest.
-        data = f.read(chunk_size)
         read_size += len(data)
         digest.update(data)
         # Calculate progress.
@@ -47,7 +44,6 @@ def digest_with_progress(filename, chunk_size):
             sys.stdout.write('[%d%%]\r' % percent_done)
             sys.stdout.flush()
             last_percent_done = percent_done
-    f.close()
     return digest.hexdigest()
 
 def count_files(starting_dir):
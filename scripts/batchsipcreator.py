@@ -6,9 +6,18 @@ Allow sipcreator to batch process multiple folders in a directory
 import argparse
 import os
 import sys
+import time
+import traceback
+import tempfile
+import shutil
+import multiprocessing
+import concurrent.futures
 import ififuncs
 import sipcreator
-from masscopy import analyze_log
+from masscopy import analyze_log, get_device
+
+# Semaphores for each drive, shared with a worker process by init_worker()
+_device_semaphores = {}
 
 
 def parse_args(args_):
@@ -69,6 +78,18 @@ def parse_args(args_):
         action='store_true',
         help='Answers YES to the question: Do you want to proceed? useful for unattended batches but not recommended without running -dryrun first'
     )
+    parser.add_argument(
+        '-jobs', type=int, default=1,
+        help='Create up to this many SIPs at the same time, each in its own process. Default is 1, which creates them one after another.'
+    )
+    parser.add_argument(
+        '-io_jobs', type=int, default=1,
+        help='When -jobs is used, the maximum number of SIPs that copy or hash files on the same drive at the same time. Default is 1.'
+    )
+    parser.add_argument(
+        '-tool_jobs', type=int, default=2,
+        help='When -jobs is used, the maximum number of SIPs that run mediainfo, siegfried or exiftool at the same time. Default is 2.'
+    )
     parser.add_argument(
         '-dryrun', action='store_true',
         help='The script will reveal which identifiers will be assigned but will not actually perform any actions.'
@@ -76,6 +97,101 @@ def parse_args(args_):
     parsed_args = parser.parse_args(args_)
     return parsed_args
 
+def init_worker(device_semaphores, tool_semaphore):
+    '''
+    Shares the stage limits with a worker process.
+    '''
+    _device_semaphores.update(device_semaphores)
+    ififuncs.set_stage_limits({'tools': tool_semaphore})
+
+
+def run_sipcreator(sipcreator_cmd, output_file, devices):
+    '''
+    Runs sipcreator.py in a worker process. Everything that it and the
+    tools that it launches print is written to output_file, so that the
+    output of several SIPs is not mixed up on the terminal.
+    Copying and hashing waits for the semaphores of devices, the drives
+    that this SIP reads from and writes to.
+    Returns the SIP log, or None and the error if sipcreator.py failed.
+    '''
+    ififuncs.set_stage_limits({
+        'io': [_device_semaphores[device] for device in sorted(set(devices))]
+    })
+    cwd = os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    stdout_fd = os.dup(1)
+    stderr_fd = os.dup(2)
+    with open(output_file, 'w') as output_object:
+        os.dup2(output_object.fileno(), 1)
+        os.dup2(output_object.fileno(), 2)
+        try:
+            sipcreator_log, _ = sipcreator.main(sipcreator_cmd)
+            error = None
+        except (Exception, SystemExit):
+            sipcreator_log = None
+            error = traceback.format_exc()
+            print(error)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(stdout_fd, 1)
+            os.dup2(stderr_fd, 2)
+            os.close(stdout_fd)
+            os.close(stderr_fd)
+            # copyit.py changes the working directory.
+            os.chdir(cwd)
+    return sipcreator_log, error
+
+
+def run_jobs(sipcreator_cmds, jobs, io_jobs, tool_jobs, job_devices):
+    '''
+    Runs sipcreator.py for every command in a pool of jobs processes.
+    job_devices lists the drives (st_dev) that each SIP reads from and
+    writes to. Copying and hashing is limited to io_jobs SIPs at once on
+    each drive, so that SIPs from different shuttle drives are copied in
+    parallel. Metadata extraction with mediainfo, siegfried and exiftool is
+    limited to tool_jobs SIPs at once, so that one SIP can extract metadata
+    while another copies.
+    Returns a dictionary of {object entry: sipcreator.py log}.
+    '''
+    context = multiprocessing.get_context('spawn')
+    device_semaphores = {}
+    for devices in job_devices.values():
+        for device in devices:
+            if device not in device_semaphores:
+                device_semaphores[device] = context.BoundedSemaphore(io_jobs)
+    tool_semaphore = context.BoundedSemaphore(tool_jobs)
+    temp_dir = tempfile.mkdtemp(prefix='batchsipcreator_')
+    logs = {}
+    started = time.time()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, mp_context=context,
+            initializer=init_worker, initargs=(device_semaphores, tool_semaphore)
+        ) as executor:
+        futures = {}
+        for sips in sorted(sipcreator_cmds):
+            output_file = os.path.join(temp_dir, sips + '.txt')
+            future = executor.submit(run_sipcreator, sipcreator_cmds[sips], output_file, job_devices[sips])
+            futures[future] = (sips, output_file)
+        for future in concurrent.futures.as_completed(futures):
+            sips, output_file = futures[future]
+            try:
+                sipcreator_log, error = future.result()
+            except Exception:
+                sipcreator_log, error = None, traceback.format_exc()
+            logs[sips] = sipcreator_log
+            if error is None:
+                print(' - %s finished after %s' % (sips, ififuncs.format_seconds(time.time() - started)))
+            else:
+                print(' - %s FAILED after %s:' % (sips, ififuncs.format_seconds(time.time() - started)))
+                with open(output_file, 'r') as fo:
+                    for line in fo.readlines()[-10:]:
+                        print('   %s' % line.rstrip())
+    shutil.rmtree(temp_dir)
+    return logs
+
+
 def main(args_):
     ''''
     Launch all the functions for creating an IFI SIP.
@@ -133,6 +249,8 @@ def main(args_):
             'Do you want to proceed?'
         )
     if proceed == 'Y':
+        sipcreator_cmds = {}
+        job_devices = {}
         for sips in sorted(oe_dict):
             sipcreator_cmd = ['-i',]
             for sipcreator_inputs in oe_dict[sips][0]:
@@ -153,11 +271,23 @@ def main(args_):
             if args.l:
                 sipcreator_cmd.append('-l')
             print(sipcreator_cmd)
+            if args.jobs > 1:
+                sipcreator_cmds[sips] = sipcreator_cmd
+                job_devices[sips] = [get_device(oe_dict[sips][2]), get_device(args.o)]
+                continue
             sipcreator_log, _ = sipcreator.main(sipcreator_cmd)
             logs.append(sipcreator_log)
             for i in logs:
                 if os.path.isfile(i):
                     print(("%-*s   : copyit job was a %s" % (50, os.path.basename(i), analyze_log(i))))
+        if sipcreator_cmds:
+            sip_logs = run_jobs(sipcreator_cmds, args.jobs, args.io_jobs, args.tool_jobs, job_devices)
+            print(' - SUMMARY REPORT')
+            for sips in sorted(sip_logs):
+                if sip_logs[sips] and os.path.isfile(sip_logs[sips]):
+                    print(("%-*s   : copyit job was a %s" % (50, sips + ' - ' + os.path.basename(sip_logs[sips]), analyze_log(sip_logs[sips]))))
+                else:
+                    print(("%-*s   : sipcreator.py failed" % (50, sips)))
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -4,6 +4,7 @@ import os
 import argparse
 import time
 import shutil
+import concurrent.futures
 import validate
 import ififuncs
 
@@ -15,6 +16,19 @@ def parse_args():
     parser.add_argument('input', help='full path to the parent folder including packages')
     parser.add_argument('-sip', help='only looks for manifests at the root of the SIP/AIP for whole package validation - $uuid_manifest.md5', action='store_true')
     parser.add_argument('-y', help ='invokes -y option in validate.py, answers Y to manifest issues', action='store_true')
+    parser.add_argument(
+        '-packages', type=int, default=1,
+        help='Number of packages to validate at the same time. Default is 1. Using more than one package invokes -y, as questions from several packages can not be answered at once.'
+    )
+    parser.add_argument(
+        '-workers', type=int, default=ififuncs.HASH_WORKERS,
+        help='Number of files to hash at the same time within each package. Default is %s.' % ififuncs.HASH_WORKERS
+    )
+    parser.add_argument(
+        '-device_workers', type=int, default=ififuncs.HASH_WORKERS_PER_DEVICE,
+        help='Maximum number of files that are read at the same time from any one storage device, shared by all packages. Default is %s.' % ififuncs.HASH_WORKERS_PER_DEVICE
+    )
+    parser.add_argument('-fail_fast', help='invokes -fail_fast option in validate.py, stopping each validation at the first missing or mismatched file', action='store_true')
     parsed_args = parser.parse_args()
     return parsed_args
 
@@ -32,9 +46,9 @@ def main():
         dir_list = os.listdir(args.input)
         for dir in dir_list:
             sources.append(os.path.join(args.input, dir))
+    manifests = []
     for source in sources:
         for root, _, files in os.walk(source):
-            error_counter = 0
             for file in files:
                 if file.endswith('_manifest.md5'):
                     if  os.path.basename(root) != 'logs' and not args.sip:
@@ -45,19 +59,31 @@ def main():
                         print(manifest)
                     else:
                         continue
-                    if manifest:
-                        if args.y:
-                            error_counter = validate.main([manifest, '-y'])
-                        else:
-                            error_counter = validate.main([manifest])
-                        if error_counter == 0:
-                            print('Validation succeed.\n---\n')
-                            results.append([manifest, 'success'])
-                            ififuncs.generate_txt('', txt_name_source, 'SUCCESS - ' + manifest)
-                        else:
-                            print('Validation failed.\n---\n')
-                            results.append([manifest, 'failure'])
-                            ififuncs.generate_txt('', txt_name_source, 'FAILURE - ' + manifest)
+                    manifests.append(manifest)
+    validate_args = ['-workers', str(args.workers)]
+    if args.y or args.packages > 1:
+        validate_args.append('-y')
+    if args.fail_fast:
+        validate_args.append('-fail_fast')
+    # All packages share one limiter, so that the number of files being read
+    # from any one device stays the same however many packages run at once.
+    device_limiter = ififuncs.DeviceLimiter(args.device_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(args.packages, 1)) as executor:
+        futures = [
+            executor.submit(validate.main, [manifest] + validate_args, device_limiter)
+            for manifest in manifests
+        ]
+        # Results are reported in the order that the manifests were found.
+        for manifest, future in zip(manifests, futures):
+            error_counter = future.result()
+            if error_counter == 0:
+                print('Validation succeed.\n---\n')
+                results.append([manifest, 'success'])
+                ififuncs.generate_txt('', txt_name_source, 'SUCCESS - ' + manifest)
+            else:
+                print('Validation failed.\n---\n')
+                results.append([manifest, 'failure'])
+                ififuncs.generate_txt('', txt_name_source, 'FAILURE - ' + manifest)
     print('---\nValidation Summary:')
     for result in results:
         print(result)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+'''
+Times the main fixity and packaging workflows against a synthetic corpus
+created by fakecorpus.py and writes the results to JSON, so that runs before
+and after a change can be compared.
+Usage: benchmark.py -o path/to/working_dir
+Run benchmark.py -h for help.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import multiprocessing
+from queue import Empty
+try:
+    import resource
+except ImportError:
+    resource = None
+import ififuncs
+import fakecorpus
+
+FLOWS = ('manifest', 'validate', 'copyit', 'sipcreator')
+# Stand-ins for the external tools that sipcreator.py calls, so that the
+# benchmark measures the scripts rather than mediainfo, exiftool or siegfried.
+STUB_TOOLS = {
+    'mediainfo': '''#!/bin/sh
+if [ "$1" = "--Version" ]; then
+    printf 'MediaInfo Command line,\\nMediaInfoLib - v0.0 benchmark stub\\n'
+else
+    printf '<?xml version="1.0" encoding="UTF-8"?>\\n<Mediainfo version="0.0"/>\\n'
+fi
+''',
+    'exiftool': '''#!/bin/sh
+if [ "$1" = "-ver" ]; then
+    printf '0.00\\n'
+elif [ "$1" = "-stay_open" ]; then
+    while read -r line; do
+        case "$line" in
+            -execute*) printf '[{}]\\n0\\n{ready%s}\\n' "${line#-execute}" ;;
+            False) exit 0 ;;
+        esac
+    done
+else
+    printf '[{}]\\n'
+fi
+''',
+    'sf': '''#!/bin/sh
+if [ "$1" = "-version" ]; then
+    printf 'siegfried 0.0.0 benchmark stub\\n'
+elif [ "$2" = "-nr" ]; then
+    printf '{"files": ['
+    separator=''
+    for f in "$3"/*; do
+        if [ -f "$f" ]; then
+            printf '%s{"filename": "%s"}' "$separator" "$f"
+            separator=', '
+        fi
+    done
+    printf ']}\\n'
+else
+    printf '{"files": []}\\n'
+fi
+'''
+}
+
+
+def parse_args(args_):
+    '''
+    Parse command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Benchmarks manifest generation, validation, copying and'
+        ' SIP creation against a synthetic corpus and writes the results to JSON.'
+    )
+    parser.add_argument(
+        '-o', '-output',
+        help='full path of a working directory. The corpus and all copies are created here.', required=True
+    )
+    parser.add_argument(
+        '-corpus',
+        help='full path of an existing corpus to use instead of creating one with fakecorpus.py'
+    )
+    parser.add_argument(
+        '-flows', nargs='+', choices=FLOWS, default=list(FLOWS),
+        help='Which workflows to time. Default is all of them.'
+    )
+    parser.add_argument(
+        '-repeat', type=int, default=3,
+        help='Number of times to run each workflow. Default is 3.'
+    )
+    parser.add_argument(
+        '-results',
+        help='full path of the JSON results file. Defaults to a timestamped file in the working directory.'
+    )
+    parser.add_argument(
+        '-compare',
+        help='full path of a previous JSON results file to compare this run against.'
+    )
+    parser.add_argument(
+        '-verbose', action='store_true',
+        help='Show the output of the workflows instead of hiding it.'
+    )
+    parser.add_argument(
+        '-profile', nargs='+', choices=fakecorpus.PROFILES,
+        help='Passed on to fakecorpus.py'
+    )
+    parser.add_argument('-frames', help='Passed on to fakecorpus.py')
+    parser.add_argument('-frame_size', help='Passed on to fakecorpus.py')
+    parser.add_argument('-blob_size', help='Passed on to fakecorpus.py')
+    parser.add_argument('-files', help='Passed on to fakecorpus.py')
+    parser.add_argument('-seed', help='Passed on to fakecorpus.py')
+    parsed_args = parser.parse_args(args_)
+    return parsed_args
+
+
+def get_corpus(args, working_dir):
+    '''
+    Returns the corpus directory, creating it with fakecorpus.py if needed.
+    An existing corpus in the working directory is reused when it was made
+    with the same options.
+    '''
+    if args.corpus:
+        return os.path.abspath(args.corpus)
+    corpus_args = ['-o', working_dir]
+    if args.profile:
+        corpus_args += ['-profile'] + args.profile
+    for option in ['frames', 'frame_size', 'blob_size', 'files', 'seed']:
+        if getattr(args, option) is not None:
+            corpus_args += ['-' + option, getattr(args, option)]
+    corpus_dir = os.path.join(working_dir, 'corpus')
+    corpus_json = os.path.join(working_dir, 'corpus.json')
+    if os.path.isdir(corpus_dir) and os.path.isfile(corpus_json):
+        with open(corpus_json, 'r') as fo:
+            existing = json.load(fo)
+        wanted = vars(fakecorpus.parse_args(corpus_args))
+        wanted['mixed_files'] = wanted.pop('files')
+        del wanted['o']
+        if all(existing.get(key) == value for key, value in wanted.items()):
+            print(' - Reusing the existing corpus in %s' % corpus_dir)
+            return corpus_dir
+        print(' - Replacing the existing corpus as it was made with other options')
+        shutil.rmtree(corpus_dir)
+    return fakecorpus.main(corpus_args)
+
+
+def make_stub_tools(working_dir):
+    '''
+    Writes the stub mediainfo, exiftool and sf executables and returns
+    the directory that contains them.
+    '''
+    stub_dir = os.path.join(working_dir, 'stub_tools')
+    if not os.path.isdir(stub_dir):
+        os.makedirs(stub_dir)
+    for tool, script in STUB_TOOLS.items():
+        stub = os.path.join(stub_dir, tool)
+        with open(stub, 'w') as fo:
+            fo.write(script)
+        os.chmod(stub, 0o755)
+    return stub_dir
+
+
+def peak_rss(who):
+    '''
+    Returns the peak resident set size in MiB, or None if the platform
+    cannot report it. ru_maxrss is in bytes on macOS and KiB elsewhere.
+    '''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        return round(maxrss / 2**20, 1)
+    return round(maxrss / 2**10, 1)
+
+
+def run_flow(flow, corpus_dir, run_dir, stub_dir, verbose, queue):
+    '''
+    Runs a single workflow in a fresh process and puts its timing and peak
+    memory use on the queue. HOME is pointed at the run directory so that
+    desktop manifests, logs and journals from earlier runs are not reused.
+    '''
+    os.environ['HOME'] = os.path.join(run_dir, 'home')
+    if stub_dir:
+        os.environ['PATH'] = stub_dir + os.pathsep + os.environ['PATH']
+    if not verbose:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+    output_dir = os.path.join(run_dir, 'output')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    result = {'error': None}
+    try:
+        if flow == 'sidecar':
+            # Creates the manifest that the validate flow checks. Not timed.
+            import manifest
+            start = time.perf_counter()
+            result['log'] = manifest.main([corpus_dir, '-s'])
+        elif flow == 'manifest':
+            import manifest
+            start = time.perf_counter()
+            manifest.main([corpus_dir])
+        elif flow == 'validate':
+            import validate
+            start = time.perf_counter()
+            if validate.main([get_sidecar(corpus_dir)]):
+                result['error'] = 'validate.py reported errors'
+        elif flow == 'copyit':
+            import copyit
+            start = time.perf_counter()
+            copyit.main([corpus_dir, output_dir])
+        elif flow == 'sipcreator':
+            import sipcreator
+            start = time.perf_counter()
+            sipcreator.main([
+                '-i', corpus_dir, '-o', output_dir,
+                '-user', 'benchmark', '-oe', 'oe9999', '-quiet'
+            ])
+        result['seconds'] = time.perf_counter() - start
+    except SystemExit:
+        result['error'] = '%s.py exited early' % flow
+    except Exception as e:
+        result['error'] = repr(e)
+    result['peak_rss_mb'] = peak_rss(resource.RUSAGE_SELF) if resource else None
+    result['children_peak_rss_mb'] = peak_rss(resource.RUSAGE_CHILDREN) if resource else None
+    queue.put(result)
+
+
+def get_sidecar(corpus_dir):
+    '''
+    Returns the path of the sidecar manifest that validate.py checks.
+    '''
+    return os.path.join(
+        os.path.dirname(corpus_dir), os.path.basename(corpus_dir) + '_manifest.md5'
+    )
+
+
+def time_flow(flow, corpus_dir, run_dir, stub_dir, verbose):
+    '''
+    Times one run of a workflow in a separate process, so that peak memory
+    use is measured per workflow rather than for the whole benchmark.
+    '''
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(
+        target=run_flow,
+        args=(flow, corpus_dir, run_dir, stub_dir, verbose, queue)
+    )
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            if not process.is_alive():
+                result = {'error': '%s exited with code %s' % (flow, process.exitcode)}
+                break
+    process.join()
+    return result
+
+
+def summarise(runs, corpus_files, corpus_bytes):
+    '''
+    Adds throughput to each run and returns the median and best figures.
+    '''
+    for run in runs:
+        if run.get('seconds'):
+            run['mb_per_s'] = round(corpus_bytes / 2**20 / run['seconds'], 1)
+            run['files_per_s'] = round(corpus_files / run['seconds'], 1)
+    finished = [run for run in runs if not run['error'] and run.get('seconds')]
+    if not finished:
+        return {'runs': runs}
+    seconds = [run['seconds'] for run in finished]
+    rss = [run['peak_rss_mb'] for run in finished if run['peak_rss_mb'] is not None]
+    return {
+        'runs': runs,
+        'median_seconds': round(statistics.median(seconds), 3),
+        'best_seconds': round(min(seconds), 3),
+        'median_mb_per_s': round(corpus_bytes / 2**20 / statistics.median(seconds), 1),
+        'median_files_per_s': round(corpus_files / statistics.median(seconds), 1),
+        'peak_rss_mb': max(rss) if rss else None
+    }
+
+
+def compare_results(results, previous_results):
+    '''
+    Prints the change in median throughput and peak memory for each workflow.
+    '''
+    print('\nComparison with %s' % previous_results)
+    with open(previous_results, 'r') as fo:
+        previous = json.load(fo)
+    if previous['corpus']['bytes'] != results['corpus']['bytes']:
+        print('WARNING - the corpora are not the same size, so the results may not be comparable')
+    for flow, summary in sorted(results['flows'].items()):
+        old_summary = previous['flows'].get(flow, {})
+        if 'median_mb_per_s' not in summary or 'median_mb_per_s' not in old_summary:
+            print(' - %s: no comparable results' % flow)
+            continue
+        change = 100 * (summary['median_mb_per_s'] / old_summary['median_mb_per_s'] - 1)
+        print(' - %s: %s MB/s -> %s MB/s (%+.1f%%), peak RSS %s MiB -> %s MiB' % (
+            flow, old_summary['median_mb_per_s'], summary['median_mb_per_s'],
+            change, old_summary.get('peak_rss_mb'), summary.get('peak_rss_mb')
+        ))
+
+
+def main(args_):
+    '''
+    Creates or reuses a corpus, times each workflow and writes the results.
+    '''
+    args = parse_args(args_)
+    working_dir = os.path.abspath(args.o)
+    if not os.path.isdir(working_dir):
+        os.makedirs(working_dir)
+    corpus_dir = get_corpus(args, working_dir)
+    inventory = ififuncs.make_inventory(corpus_dir)
+    corpus_files = len(inventory)
+    corpus_bytes = sum(entry.size for entry in inventory)
+    stub_dir = None
+    if 'sipcreator' in args.flows:
+        if sys.platform == 'win32':
+            print('The sipcreator flow needs POSIX shell stubs and is skipped on Windows')
+            args.flows.remove('sipcreator')
+        else:
+            stub_dir = make_stub_tools(working_dir)
+    results = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count()
+        },
+        'settings': {
+            'hash_workers': ififuncs.HASH_WORKERS,
+            'hash_workers_per_device': ififuncs.HASH_WORKERS_PER_DEVICE,
+            'read_options': ififuncs.READ_OPTIONS
+        },
+        'corpus': {
+            'path': corpus_dir,
+            'files': corpus_files,
+            'bytes': corpus_bytes
+        },
+        'flows': {}
+    }
+    for flow in args.flows:
+        runs = []
+        for iteration in range(args.repeat):
+            print(' - %s run %s of %s' % (flow, iteration + 1, args.repeat))
+            run_dir = os.path.join(working_dir, 'runs', '%s_%s' % (flow, iteration))
+            if os.path.isdir(run_dir):
+                shutil.rmtree(run_dir)
+            os.makedirs(os.path.join(run_dir, 'home'))
+            sidecar_log = None
+            if flow == 'validate':
+                sidecar_log = time_flow('sidecar', corpus_dir, run_dir, None, args.verbose).get('log')
+            result = time_flow(flow, corpus_dir, run_dir, stub_dir, args.verbose)
+            if sidecar_log:
+                os.remove(sidecar_log)
+                os.remove(get_sidecar(corpus_dir))
+            shutil.rmtree(run_dir)
+            if result['error']:
+                print('   %s failed: %s' % (flow, result['error']))
+            else:
+                print('   %.2f seconds' % result['seconds'])
+            runs.append(result)
+        results['flows'][flow] = summarise(runs, corpus_files, corpus_bytes)
+    shutil.rmtree(os.path.join(working_dir, 'runs'), ignore_errors=True)
+    results_file = args.results or os.path.join(
+        working_dir, 'benchmark' + time.strftime('_%Y_%m_%dT%H_%M_%S') + '.json'
+    )
+    with open(results_file, 'w') as fo:
+        json.dump(results, fo, indent=4, sort_keys=True)
+    for flow, summary in results['flows'].items():
+        if 'median_mb_per_s' in summary:
+            print('%s: %s MB/s, %s files/s, peak RSS %s MiB' % (
+                flow, summary['median_mb_per_s'], summary['median_files_per_s'], summary['peak_rss_mb']
+            ))
+    print('Results written to %s' % results_file)
+    if args.compare:
+        compare_results(results, args.compare)
+    return results_file
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
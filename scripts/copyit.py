@@ -11,9 +11,10 @@ import filecmp
 import tempfile
 import time
 import argparse
-import hashlib
 import shutil
 import unicodedata
+import collections
+import concurrent.futures
 from builtins import input
 import ififuncs
 from ififuncs import make_desktop_logs_dir, make_desktop_manifest_dir, generate_log
@@ -21,25 +22,9 @@ from ififuncs import make_desktop_logs_dir, make_desktop_manifest_dir, generate_
 
 def hashlib_md5(filename):
     '''
-    Create an md5 checksum. This should use the ififuncs function instead.
-    '''
-    read_size = 0
-    last_percent_done = 0
-    md5_object = hashlib.md5()
-    total_size = os.path.getsize(filename)
-    with open(str(filename), 'rb') as file_object:
-        while True:
-            buf = file_object.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            md5_object.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    md5_output = md5_object.hexdigest()
+    Create an md5 checksum line with the absolute path of filename.
+    '''
+    md5_output = ififuncs.hashlib_md5(filename)
     return md5_output + '  ' + os.path.abspath(filename) +  '\n'
 
 
@@ -94,69 +79,85 @@ def remove_bad_files(root_dir, log_name_source):
 
 def make_manifest(
         manifest_dir,
-        manifest_textfile, path_to_remove
+        manifest_textfile, path_to_remove,
+        sha512_textfile=None, log_name_source=None, trust_cache=False,
+        inventory=None, chunk_size=None, journal=None, journal_algorithms=(),
+        reused=None
     ):
     '''
     Generates a checksum text manifest.
+    If sha512_textfile is supplied, a sha512 manifest is also written, with
+    both checksums calculated from a single read of each file.
+    trust_cache allows md5 values from the fixity cache to be reused. This
+    should only be used for source manifests, never for the destination.
+    An inventory from ififuncs.make_inventory() can be passed in to avoid
+    walking manifest_dir again.
+    If chunk_size is set, a chunk checksum sidecar is written next to
+    manifest_textfile, calculated in the same pass.
+    If an ififuncs.HashJournal is passed, every hashed file is journaled and
+    files that were journaled by an interrupted run are not read again.
+    journal_algorithms are also calculated and journaled, but not written
+    to a manifest, eg: sha512 checksums that a move carries across to the
+    destination manifest.
+    If a collections.Counter is passed as reused, the number of checksums
+    that were not calculated is added to it, keyed by where they came from.
     '''
-    checksum_list = []
-    manifest_generator = ''
-    source_counter = 0
-    print('Counting the amount of files to be processed.')
-    for root, directories, filenames in os.walk(manifest_dir):
-        directories[:] = [
-            d for d in directories if d[0] != '.'
-        ]
-        directories[:] = [
-            d for d in directories if d != 'System Volume Information'
-        ]
-        directories[:] = [
-                d for d in directories if d != '$RECYCLE.BIN'
-        ]
-        directories[:] = [
-                d for d in directories if d != 'Seagate'
-        ]
-        filenames = [
-            f for f in filenames if os.path.basename(root) != 'System Volume Information'
-        ]
-        filenames = [
-            f for f in filenames if f[0] != '.'
-        ]
-        for files in filenames:
-            source_counter += 1
-    counter2 = 1
+    # Lines are streamed to sorted writers rather than built up in memory.
+    manifest_writer = ififuncs.ManifestWriter(manifest_textfile, normalise=False)
+    algorithms = ['md5']
+    if sha512_textfile:
+        sha512_writer = ififuncs.ManifestWriter(sha512_textfile, normalise=False)
+        algorithms.append('sha512')
+    if inventory is None:
+        print('Counting the amount of files to be processed.')
+        inventory = ififuncs.make_inventory(manifest_dir, ififuncs.EXCLUDED_DIRECTORIES)
     if os.path.isdir(manifest_dir):
         os.chdir(manifest_dir)
-        for root, directories, filenames in os.walk(manifest_dir):
-            directories[:] = [
-                d for d in directories if d[0] != '.'
-            ]
-            directories[:] = [
-                d for d in directories if d != 'System Volume Information'
-            ]
-            directories[:] = [
-                d for d in directories if d != '$RECYCLE.BIN'
-            ]
-            directories[:] = [
-                d for d in directories if d != 'Seagate'
-            ]
-            filenames = [
-                f for f in filenames if os.path.basename(root) != 'System Volume Information'
-            ]
-            filenames = [
-                f for f in filenames if f[0] != '.'
-            ]
-            for files in filenames:
-                checksum_list.append([root, files])
-    elif os.path.isfile(manifest_dir):
-        checksum_list = [[os.path.dirname(manifest_dir), os.path.basename(manifest_dir)]]
-    if len(checksum_list) == 1:
-        source_counter = 1
+    checksum_list = [list(os.path.split(entry.path)) for entry in inventory]
+    progress = ififuncs.Progress(
+        'Generating MD5 manifest', len(checksum_list),
+        sum(entry.size for entry in inventory)
+    )
+    if reused is None:
+        reused = collections.Counter()
+    chunk_records = {}
+    for algorithm in journal_algorithms:
+        if algorithm not in algorithms:
+            algorithms.append(algorithm)
+    journal_keys = list(algorithms)
+    if chunk_size:
+        journal_keys.append('chunks')
     for files in checksum_list:
-        print(('Generating MD5 for %s - %d of %d' % (
-            os.path.join(files[0], files[1]), counter2, source_counter)
-            ))
-        md5 = hashlib_md5(os.path.join(files[0], files[1]))
+        cached_md5 = None
+        journaled_checksums = None
+        if journal is not None:
+            journaled_checksums = journal.lookup(os.path.join(files[0], files[1]), journal_keys)
+        if trust_cache and len(algorithms) == 1 and not chunk_size:
+            cached_md5 = ififuncs.fixity_cache_lookup(
+                os.path.join(files[0], files[1]), 'md5'
+            )
+        if journaled_checksums is not None:
+            reused[journal.reuse_detail] += 1
+            progress.file_done(os.path.getsize(os.path.join(files[0], files[1])), read=False)
+            checksums = journaled_checksums
+        elif cached_md5 is not None:
+            reused['from the fixity cache'] += 1
+            progress.file_done(os.path.getsize(os.path.join(files[0], files[1])), read=False)
+            if log_name_source:
+                generate_log(
+                    log_name_source,
+                    'EVENT = message digest calculation - eventDetail=md5 checksum taken from fixity cache, file unchanged since it was last hashed, eventOutcome=%s %s' % (cached_md5, os.path.join(files[0], files[1]))
+                )
+            checksums = {'md5': cached_md5}
+        else:
+            checksums = ififuncs.hashlib_multi(
+                os.path.join(files[0], files[1]), algorithms,
+                progress=progress, chunk_size=chunk_size
+            )
+            progress.file_done()
+            if journal is not None:
+                journal.record(os.path.join(files[0], files[1]), checksums)
+        md5 = checksums['md5']
         root2 = files[0].replace(path_to_remove, '')
         try:
             if root2[0] == '/':
@@ -164,17 +165,25 @@ def make_manifest(
             if root2[0] == '\\':
                 root2 = root2[1:]
         except: IndexError
-        manifest_generator += md5[:32] + '  ' + os.path.join(
+        manifest_writer.add(md5[:32] + '  ' + os.path.join(
             root2, files[1]
-            ).replace("\\", "/") + '\n'
-        counter2 += 1
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "w", encoding='utf-8') as text:
-        for i in manifest_list:
-            text.write(i + '\n')
+            ).replace("\\", "/"))
+        if sha512_textfile:
+            sha512_writer.add(checksums['sha512'] + '  ' + os.path.join(
+                root2, files[1]
+                ).replace("\\", "/"))
+        if chunk_size and len(checksums['chunks']) > 1:
+            chunk_records[unicodedata.normalize('NFC', os.path.join(root2, files[1]).replace("\\", "/"))] = ififuncs.make_chunk_record(
+                os.path.getsize(os.path.join(files[0], files[1])), checksums['chunks']
+            )
+    progress.close()
+    for source, count in sorted(reused.items()):
+        print(' - Reused %s checksums %s' % (count, source))
+    files_in_manifest = manifest_writer.close()
+    if sha512_textfile:
+        sha512_writer.close()
+    if chunk_size:
+        ififuncs.write_chunk_sidecar(manifest_textfile, chunk_records, chunk_size)
     return files_in_manifest
 
 
@@ -255,61 +264,353 @@ def copy_dir(
                 'EVENT = File Transfer, status=completed'
             )
 
+def get_os_name():
+    '''
+    Returns the operating system name that is used as an agentName in logs.
+    '''
+    if sys.platform == 'win32':
+        return 'Windows'
+    elif sys.platform == 'darwin':
+        return 'OSX'
+    return 'Linux'
+
+
+def use_copy_engine(args, rootpos, source, destination_final_path):
+    '''
+    Returns True if the source can be copied with copy_and_hash() rather
+    than cp, rsync or robocopy. This is done on Linux, or on any system when
+    -copy_workers is used, for a directory source when the destination
+    does not exist yet.
+    '''
+    return (
+        ('linux' in sys.platform or args.copy_workers > 1)
+        and not args.move and not args.system_copy
+        and rootpos != 'y' and os.path.isdir(source)
+        and not os.path.exists(destination_final_path)
+    )
+
+
+def start_pipeline(args, manifest_destination, log_name_source):
+    '''
+    Returns an ififuncs.HashPipeline that hashes destination files as soon
+    as they are copied, or None if -pipeline is not used.
+    '''
+    if not args.pipeline or args.justcopy:
+        return None
+    algorithms = ['md5']
+    if args.sha512:
+        algorithms.append('sha512')
+    chunk_size = None
+    if args.chunks:
+        chunk_size = ififuncs.CHUNK_SIZE
+    journal = ififuncs.open_hash_journal(manifest_destination, 'destination', log_name_source)
+    generate_log(
+        log_name_source,
+        'EVENT = message digest calculation - eventDetail=destination files are hashed as soon as they are copied, module=hashlib'
+    )
+    return ififuncs.HashPipeline(journal, algorithms, chunk_size)
+
+
+def copy_and_hash(source, destination_final_path, manifest_textfile, log_name_source, inventory, chunk_size=None, workers=1, pipeline=None):
+    '''
+    Copies source to destination_final_path and writes the source manifest
+    from the same read of every file, so the source is only read once.
+    If manifest_textfile is None, files are only copied.
+    All folders are created before any file is copied. Existing files are
+    not overwritten, as with cp -n. When all files are copied, they are
+    flushed to disk with one sync and dropped from the page cache, so the
+    destination manifest reads them back from the storage.
+    With more than one worker, files are copied concurrently, which helps
+    with image sequences on network storage where each file has a high
+    latency. The number of files in flight is tuned between 1 and workers
+    by an ififuncs.AdaptiveLimiter.
+    If an ififuncs.HashPipeline is passed, each copied file is flushed and
+    dropped from the page cache on its own before it is added to it.
+    On Linux, hidden and excluded files are copied like cp does, but left
+    out of the manifest. Elsewhere they are not copied at all, like rsync
+    and robocopy.
+    '''
+    if manifest_textfile:
+        manifest_writer = ififuncs.ManifestWriter(manifest_textfile, normalise=False)
+        algorithms = ('md5',)
+    else:
+        algorithms = ()
+        chunk_size = None
+    path_to_remove = os.path.dirname(source)
+    in_inventory = set(entry.path for entry in inventory)
+    chunk_records = {}
+    copy_uninventoried = 'linux' in sys.platform
+    directories = []
+    jobs = []
+    for root, dirnames, filenames in os.walk(source):
+        if not copy_uninventoried:
+            dirnames[:] = [
+                d for d in dirnames
+                if d[0] != '.' and d not in ififuncs.EXCLUDED_DIRECTORIES
+            ]
+        destination_root = os.path.join(
+            destination_final_path, os.path.relpath(root, source)
+        )
+        if not os.path.isdir(destination_root):
+            os.makedirs(destination_root)
+        directories.append((root, destination_root))
+        for dirname in dirnames:
+            # os.walk does not follow links to folders, cp copies the link.
+            if os.path.islink(os.path.join(root, dirname)):
+                if not os.path.lexists(os.path.join(destination_root, dirname)):
+                    shutil.copy2(
+                        os.path.join(root, dirname), os.path.join(destination_root, dirname),
+                        follow_symlinks=False
+                    )
+        for filename in filenames:
+            full_path = os.path.join(root, filename)
+            if full_path not in in_inventory and not copy_uninventoried:
+                continue
+            destination_file = os.path.join(destination_root, filename)
+            copy_to = destination_file
+            if os.path.lexists(destination_file):
+                copy_to = None
+            elif os.path.islink(full_path) or full_path not in in_inventory:
+                # Links are copied as links, and on Linux hidden and excluded
+                # files are copied but left out of the manifest.
+                if os.path.islink(full_path) or os.path.isfile(full_path):
+                    shutil.copy2(full_path, destination_file, follow_symlinks=False)
+                copy_to = None
+            if full_path not in in_inventory or not (copy_to or manifest_textfile):
+                continue
+            jobs.append((full_path, copy_to))
+    progress = ififuncs.Progress(
+        'Copying and generating MD5 manifest' if manifest_textfile else 'Copying',
+        len(jobs), sum(os.path.getsize(full_path) for full_path, _ in jobs)
+    )
+    def copy_file(job):
+        full_path, copy_to = job
+        checksums = ififuncs.hashlib_multi(
+            full_path, algorithms, progress=progress,
+            chunk_size=chunk_size, copy_to=copy_to
+        )
+        progress.file_done()
+        if pipeline is not None and copy_to:
+            ififuncs.evict_copy(copy_to)
+            pipeline.add(copy_to)
+        return full_path, checksums
+    executor = None
+    futures = []
+    if workers > 1:
+        limiter = ififuncs.AdaptiveLimiter(workers, start=min(4, workers))
+        def copy_when_allowed(job):
+            limiter.acquire()
+            try:
+                return copy_file(job)
+            finally:
+                limiter.release(os.path.getsize(job[0]))
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(copy_when_allowed, job) for job in jobs]
+        results = (future.result() for future in futures)
+    else:
+        results = map(copy_file, jobs)
+    try:
+        for full_path, checksums in results:
+            if manifest_textfile:
+                relative_path = ififuncs.get_relative_path(full_path, path_to_remove)
+                manifest_writer.add(checksums['md5'] + '  ' + relative_path)
+                if chunk_size and len(checksums['chunks']) > 1:
+                    chunk_records[unicodedata.normalize('NFC', relative_path)] = ififuncs.make_chunk_record(
+                        os.path.getsize(full_path), checksums['chunks']
+                    )
+    finally:
+        # After an error, files that have not started copying are cancelled.
+        for future in futures:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown()
+    progress.close()
+    if pipeline is None:
+        ififuncs.evict_copies([copy_to for _, copy_to in jobs if copy_to])
+    if workers > 1:
+        generate_log(
+            log_name_source,
+            'EVENT = File Transfer - eventDetail=%s files copied concurrently, adaptive concurrency reached %s and finished at %s of a maximum of %s files at once' % (len(jobs), limiter.peak, limiter.limit, workers)
+        )
+    # Folder timestamps are set last, as copying into a folder changes them.
+    for root, destination_root in reversed(directories):
+        shutil.copymode(root, destination_root)
+        root_stat = os.stat(root)
+        os.utime(destination_root, ns=(root_stat.st_atime_ns, root_stat.st_mtime_ns))
+    if manifest_textfile:
+        files_in_manifest = manifest_writer.close()
+        if chunk_size:
+            ififuncs.write_chunk_sidecar(manifest_textfile, chunk_records, chunk_size)
+        return files_in_manifest
+
+
+def resume_transfer(source, destination_final_path, manifest, manifest_destination, log_name_source, inventory, sha512=False, chunk_size=None):
+    '''
+    Prepares an interrupted transfer to be resumed.
+    Destination files that have the same size as the source file and whose
+    md5 matches the source manifest are kept. Their checksums are added to
+    the journal of the destination manifest, so they are not read again.
+    Partial or damaged files are removed so that they are copied again.
+    Returns the number of files that were kept and removed.
+    '''
+    source_checksums = ififuncs.parse_manifest(manifest)
+    path_to_remove = os.path.dirname(source)
+    algorithms = ['md5']
+    if sha512:
+        algorithms.append('sha512')
+    journal_keys = list(algorithms)
+    if chunk_size:
+        journal_keys.append('chunks')
+    copied = []
+    for entry in inventory:
+        destination_file = os.path.join(
+            destination_final_path, os.path.relpath(entry.path, source)
+        )
+        if os.path.isfile(destination_file) or os.path.islink(destination_file):
+            copied.append((entry, destination_file))
+    journal = ififuncs.open_hash_journal(manifest_destination, 'destination', log_name_source)
+    progress = ififuncs.Progress(
+        'Checking files that were already copied', len(copied),
+        sum(entry.size for entry, _ in copied)
+    )
+    kept = 0
+    removed = 0
+    for entry, destination_file in copied:
+        relative_path = ififuncs.get_relative_path(entry.path, path_to_remove)
+        expected_md5 = source_checksums.get(ififuncs.manifest_key(relative_path), ('', ''))[0]
+        checksums = None
+        if not os.path.islink(destination_file) and expected_md5 and os.path.getsize(destination_file) == entry.size:
+            checksums = journal.lookup(destination_file, journal_keys)
+            if checksums is None:
+                checksums = ififuncs.hashlib_multi(
+                    destination_file, algorithms, progress=progress,
+                    chunk_size=chunk_size
+                )
+                progress.file_done()
+            else:
+                progress.file_done(entry.size, read=False)
+        else:
+            progress.file_done(entry.size, read=False)
+        if checksums is not None and checksums['md5'].lower() == expected_md5.lower():
+            # The copy may have been interrupted before the timestamps were set.
+            shutil.copymode(entry.path, destination_file)
+            os.utime(destination_file, ns=(os.stat(entry.path).st_atime_ns, entry.mtime_ns))
+            journal.record(destination_file, checksums)
+            kept += 1
+        else:
+            os.remove(destination_file)
+            removed += 1
+    progress.close()
+    journal.flush()
+    journal.close(remove=False)
+    print(' - %s files were already copied and verified, %s partial or damaged files will be copied again' % (kept, removed))
+    generate_log(
+        log_name_source,
+        'EVENT = File Transfer Resume - eventDetail=%s files were already copied and their md5 matched the source manifest, %s partial or damaged files were removed to be copied again, %s files had not been copied yet' % (kept, removed, len(inventory) - len(copied))
+    )
+    return kept, removed
+
+
+def is_same_filesystem(source, destination):
+    '''
+    Returns True if source and destination are on the same device, so that
+    a move is a rename and no data is copied. If destination does not
+    exist yet, its closest parent folder is checked.
+    '''
+    destination = os.path.abspath(destination)
+    while not os.path.exists(destination):
+        destination = os.path.dirname(destination)
+    return os.stat(source).st_dev == os.stat(destination).st_dev
+
+
+def carry_checksums(source, destination_final_path, inventory, source_journal, manifest_destination, log_name_source, sha512=False, chunk_size=None):
+    '''
+    After a move within the same filesystem, the source checksums that were
+    calculated by this run are carried across to the journal of the
+    destination manifest, so the moved files are not hashed again.
+    A file is only carried across if it is still the same inode, with the
+    same size and modification time as before the move.
+    Returns the journal of the destination manifest and the number of
+    files that were carried across.
+    '''
+    journal_keys = ['md5']
+    if sha512:
+        journal_keys.append('sha512')
+    if chunk_size:
+        journal_keys.append('chunks')
+    destination_journal = ififuncs.open_hash_journal(manifest_destination, 'destination', log_name_source)
+    destination_journal.reuse_detail = 'that were carried across by a move within the same filesystem'
+    carried = 0
+    for entry in inventory:
+        if entry.path == source:
+            destination_file = destination_final_path
+        else:
+            destination_file = os.path.join(
+                destination_final_path, os.path.relpath(entry.path, source)
+            )
+        journal_entry = source_journal.entries.get(entry.path)
+        if journal_entry is None or (journal_entry['size'], journal_entry['mtime_ns']) != (entry.size, entry.mtime_ns):
+            continue
+        if [key for key in journal_keys if key not in journal_entry['checksums']]:
+            continue
+        try:
+            file_stat = os.stat(destination_file)
+        except OSError:
+            continue
+        if (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns) != (entry.device, entry.inode, entry.size, entry.mtime_ns):
+            continue
+        destination_journal.record(destination_file, journal_entry['checksums'])
+        carried += 1
+    destination_journal.flush()
+    source_journal.close()
+    generate_log(
+        log_name_source,
+        'EVENT = File Transfer - eventDetail=Source and destination are on the same filesystem, so the files were renamed rather than copied. %s of %s files kept the same inode, size and modification time and their source checksums were carried across to the destination manifest. The rest are hashed again.' % (carried, len(inventory))
+    )
+    print(' - Same filesystem move - %s of %s files were verified by inode, size and modification time and will not be hashed again' % (carried, len(inventory)))
+    return destination_journal, carried
+
+
 def diff_report(file1, file2, log_name_source):
     '''
     Analyzes checksum manifests in order to find mismatches.
     '''
     print('Comparing manifests to verify file transfer')
-    try:
-        with open(file1, 'r') as file1_manifest:
-            sourcelist = file1_manifest.readlines()
-    except UnicodeDecodeError:
-        with open(file1, 'r', encoding='cp1252') as file1_manifest:
-            sourcelist = file1_manifest.readlines()
-    try:
-        with open(file2, 'r') as file2_manifest:
-            destlist = file2_manifest.readlines()
-    except UnicodeDecodeError:
-        with open(file2, 'r') as file2_manifest:
-            destlist = file2_manifest.readlines()
-    for i in sourcelist:
-        if i not in destlist:
-            print(('%s was expected, but a different value was found in destination manifest' % i.rstrip()))
-            generate_log(
-                log_name_source,
-                'ERROR = %s was expected, but a different value was found in destination manifest' % i.rstrip())
+    differences = ififuncs.diff_manifests(file1, file2)
+    for path, checksum in differences.missing:
+        print(('%s  %s was expected, but no such file was found in destination manifest' % (checksum, path)))
+        generate_log(
+            log_name_source,
+            'ERROR = %s  %s was expected, but no such file was found in destination manifest' % (checksum, path))
+    for path, source_checksum, destination_checksum in differences.mismatched:
+        print(('%s  %s was expected, but a different value (%s) was found in destination manifest' % (source_checksum, path, destination_checksum)))
+        generate_log(
+            log_name_source,
+            'ERROR = %s  %s was expected, but a different value (%s) was found in destination manifest' % (source_checksum, path, destination_checksum))
+    for source_path, destination_path in differences.encoding_only:
+        print(('%s matches %s, the filenames only differ in text encoding or unicode normalisation' % (source_path, destination_path)))
+        generate_log(
+            log_name_source,
+            'EVENT = Diff report, eventDetail=%s matches %s, the filenames only differ in text encoding or unicode normalisation' % (source_path, destination_path))
     print(' - End of Diff report\n')
+    return differences
 
 
 def check_extra_files(file1, file2, log_name_source):
     '''
     Are there any extra files in the destination directory?
     '''
-    try:
-        with open(file1, 'r') as file1_manifest:
-            sourcelist = file1_manifest.readlines()
-    except UnicodeDecodeError:
-        with open(file1, 'r', encoding='cp1251') as file1_manifest:
-            sourcelist = file1_manifest.readlines()
-    try:
-        with open(file2, 'r') as file2_manifest:
-            destlist = file2_manifest.readlines()
-    except UnicodeDecodeError:
-        with open(file2, 'r') as file2_manifest:
-            destlist = file2_manifest.readlines()
-    destlist_files = []
-    sourcelist_files = []
-    for dest_files in destlist:
-        destlist_files.append(dest_files[32:])
-    for source_files in sourcelist:
-        sourcelist_files.append(source_files[32:])
-    for i in destlist_files:
-        if i not in sourcelist_files:
-            print(('%s is in your destination manifest but is not in the source manifest' % i.rstrip()))
-            generate_log(
-                log_name_source,
-                'ERROR = %s is in your destination manifest but is not in the source manifest' % i.rstrip())
-    print(' - End of extra file report - if source and destination manifests appear visually identical, perhaps one manifest is utf-8 and the other is cp1252')
+    differences = ififuncs.diff_manifests(file1, file2)
+    for path, checksum in differences.extra:
+        print(('%s is in your destination manifest but is not in the source manifest' % path))
+        generate_log(
+            log_name_source,
+            'ERROR = %s is in your destination manifest but is not in the source manifest' % path)
+    if differences.encoding_only:
+        print(' - End of extra file report - %s filenames appear identical but one manifest is utf-8 and the other is cp1252, or they use different unicode normalisation' % len(differences.encoding_only))
+    else:
+        print(' - End of extra file report')
+    return differences
 
 
 def check_overwrite(file2check):
@@ -404,6 +705,11 @@ def setup(args_):
         action='store_true',
         help='Move files instead of copying - much faster!'
     )
+    parser.add_argument(
+        '-move_rehash',
+        action='store_true',
+        help='With -move, hash every file again at the destination, even if it was only renamed within the same filesystem. By default, the source checksums are carried across for files that kept the same inode, size and modification time.'
+    )
     parser.add_argument(
         '-justcopy',
         action='store_true',
@@ -414,9 +720,49 @@ def setup(args_):
         action='store_true',
         help='Answers YES to the question: Not enough free space, would you like to continue?'
     )
+    parser.add_argument(
+        '-sha512',
+        action='store_true',
+        help='Also writes a sha512 destination manifest, calculated in the same pass as the md5 destination manifest'
+    )
+    parser.add_argument(
+        '-chunks',
+        action='store_true',
+        help='Also writes source and destination _chunks.json sidecars with a checksum for every %s MiB chunk of large files. If the copy fails, the damaged byte ranges are logged' % (ififuncs.CHUNK_SIZE // 2**20)
+    )
+    parser.add_argument(
+        '-fixity_cache',
+        choices=ififuncs.FIXITY_CACHE_POLICIES,
+        help='Fixity cache policy. record - store all checksums in the local cache. derived - as record, but the source manifest may reuse cached checksums of unchanged files. The destination is always re-read.'
+    )
+    parser.add_argument(
+        '-system_copy',
+        action='store_true',
+        help='On Linux, copy with cp and then hash the source separately, instead of the built-in engine that hashes the source while copying it'
+    )
+    parser.add_argument(
+        '-pipeline', action='store_true',
+        help='Hash each destination file as soon as it has been copied, while the rest of the copy is running, rather than after the whole copy. Only used with the copy engine that copyit.py uses on Linux or with -copy_workers.'
+    )
+    parser.add_argument(
+        '-resume', action='store_true',
+        help='Resume an interrupted transfer. Files that were already copied are kept if their size and md5 match the source manifest, partial files are copied again and then the remaining files are copied.'
+    )
+    parser.add_argument(
+        '-copy_workers', type=int, default=1,
+        help='Copy up to this many files at the same time. Use this for image sequences and other folders with many small files, especially on network storage. The number of files in flight is adjusted to the throughput of the destination. Default is 1.'
+    )
+    parser.add_argument(
+        '-progress_file',
+        help='Full path of a file that progress is written to as JSON every few seconds, so that the transfer can be monitored remotely.'
+    )
     rootpos = ''
     dircheck = None
     args = parser.parse_args(args_)
+    if args.fixity_cache:
+        ififuncs.set_fixity_cache_policy(args.fixity_cache)
+    if args.progress_file:
+        ififuncs.set_progress_file(args.progress_file)
     if os.path.isdir(args.source):
         dircheck = check_for_sip(args.source)
     if dircheck != None:
@@ -463,6 +809,7 @@ def setup(args_):
     desktop_logs_dir = make_desktop_logs_dir()
     log_name_source = "%s/%s.log" % (desktop_logs_dir, log_name_filename)
     generate_log(log_name_source, 'copyit.py started.')
+    ififuncs.set_progress_log(log_name_source)
     ififuncs.generate_log(
         log_name_source,
         'eventDetail=copyit.py %s' % ififuncs.get_script_version('copyit.py'))
@@ -487,10 +834,13 @@ def setup(args_):
 
 def overwrite_check(
         destination, log_name_source,
-        destination_final_path, manifest_destination
+        destination_final_path, manifest_destination, resume=False
     ):
     '''
     Possibly redundant - this launches other overwrite functions.
+    If resume is True, the user is not asked, as an interrupted transfer
+    into the destination directory will be resumed and its destination
+    manifest overwritten.
     '''
     try:
         test_write_capabilities(destination, log_name_source)
@@ -501,6 +851,11 @@ def overwrite_check(
             'EVENT = I/O Test - Failure - No write access to destination directory.'
         )
         sys.exit()
+    if resume:
+        overwrite_destination_manifest = None
+        if os.path.isfile(manifest_destination):
+            overwrite_destination_manifest = 'Y'
+        return overwrite_destination_manifest, None
     overwrite_destination_manifest = check_overwrite(manifest_destination)
     overwrite_destination_dir = check_overwrite_dir(destination_final_path)
     return overwrite_destination_manifest, overwrite_destination_dir
@@ -551,11 +906,23 @@ def manifest_existence(
 def make_destination_manifest(
         overwrite_destination_manifest, log_name_source,
         rootpos, destination_final_path,
-        manifest_destination, destination
+        manifest_destination, destination, sha512=False, chunk_size=None,
+        journal=None
     ):
     '''
     Um, write destination manifest
+    If sha512 is True, a sha512 manifest is written alongside the md5
+    manifest from the same read of the destination files.
+    chunk_size is passed on to make_manifest().
+    journal is the HashJournal of a HashPipeline that already hashed
+    the destination files while they were copied.
     '''
+    sha512_destination = None
+    reused = collections.Counter()
+    if sha512:
+        sha512_destination = manifest_destination.replace(
+            '_manifest.md5', '_manifest-sha512.txt'
+        )
     if overwrite_destination_manifest not in ('N', 'n'):
         if overwrite_destination_manifest == None:
             generate_log(
@@ -567,10 +934,14 @@ def make_destination_manifest(
                 'EVENT = Destination Manifest Overwrite - Destination manifest already exists - Overwriting.'
             )
         print('Generating destination manifest')
+        if journal is None:
+            journal = ififuncs.open_hash_journal(manifest_destination, 'destination', log_name_source)
         if rootpos == 'y':
             files_in_manifest = make_manifest(
                 destination_final_path,
-                manifest_destination, os.path.dirname(destination)
+                manifest_destination, os.path.dirname(destination),
+                sha512_destination, chunk_size=chunk_size, journal=journal,
+                reused=reused
             )
             generate_log(
                 log_name_source,
@@ -579,12 +950,33 @@ def make_destination_manifest(
         else:
             files_in_manifest = make_manifest(
                 destination_final_path,
-                manifest_destination, destination
+                manifest_destination, destination,
+                sha512_destination, chunk_size=chunk_size, journal=journal,
+                reused=reused
             )
             generate_log(
                 log_name_source,
                 'EVENT = Generating destination manifest: status=completed')
+        journal.close()
+        if sha512_destination:
+            # eg: a same filesystem move carries the source checksums across,
+            # so those were not calculated in this pass.
+            event_detail = 'calculated in the same pass as the md5 manifest'
+            if reused:
+                event_details = []
+                calculated = files_in_manifest - sum(reused.values())
+                if calculated:
+                    event_details.append('%s checksums %s' % (calculated, event_detail))
+                for source, count in sorted(reused.items()):
+                    event_details.append('%s checksums %s' % (count, source))
+                event_detail = ' and '.join(event_details)
+            generate_log(
+                log_name_source,
+                'EVENT = Generating destination sha512 manifest: status=completed, eventType=message digest calculation, module=hashlib, eventDetail=%s, eventOutcome=%s' % (event_detail, sha512_destination)
+            )
     else:
+        if journal is not None:
+            journal.close()
         generate_log(
             log_name_source,
             'EVENT = File Transfer Overwrite - Destination directory already exists - Not Overwriting.'
@@ -593,7 +985,35 @@ def make_destination_manifest(
     return files_in_manifest
 
 
-def verify_copy(manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count):
+def report_damaged_chunks(manifest, manifest_destination, log_name_source):
+    '''
+    If the source and destination manifests both have chunk sidecars,
+    logs the byte ranges of every large file that differ after the copy.
+    '''
+    source_chunks = ififuncs.read_chunk_sidecar(manifest)
+    destination_chunks = ififuncs.read_chunk_sidecar(manifest_destination)
+    if not source_chunks or not destination_chunks:
+        return
+    for path, record in sorted(destination_chunks['files'].items()):
+        # when the contents of a folder are copied, the destination paths
+        # have an extra parent folder.
+        source_record = source_chunks['files'].get(path)
+        if source_record is None:
+            source_record = source_chunks['files'].get(path.split('/', 1)[-1])
+        if source_record is None:
+            continue
+        bad_ranges = ififuncs.compare_chunks(
+            source_record, record['chunks'], record['size'], source_chunks['chunk_size']
+        )
+        for start, end in bad_ranges:
+            print(' - %s differs from the source between bytes %s and %s' % (path, start, end))
+            generate_log(
+                log_name_source,
+                'EVENT = File Transfer Failure Explanation - %s differs from the source between bytes %s and %s' % (path, start, end)
+            )
+
+
+def verify_copy(manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count, chunk_manifest=None):
     unicode_mismatch = False
     try:
         with open(manifest, 'r', encoding='utf-8') as source_manifest_object:
@@ -643,12 +1063,17 @@ def verify_copy(manifest, manifest_destination, log_name_source, overwrite_desti
             ))
             diff_report(manifest, manifest_destination, log_name_source)
             check_extra_files(manifest, manifest_destination, log_name_source)
+            if chunk_manifest:
+                report_damaged_chunks(chunk_manifest, manifest_destination, log_name_source)
             generate_log(log_name_source, 'EVENT = File Transfer Failure Explanation -  %s files in your destination,  %s files at source' % (destination_count, source_count))
         else:
             print((' %s files in your destination \n %s files at source' % (
                 destination_count, source_count)
             ))
-def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, source):
+def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, source, inventory=None, journal=None, journal_algorithms=()):
+    chunk_size = None
+    if args.chunks:
+        chunk_size = ififuncs.CHUNK_SIZE
     if os.path.isfile(manifest_sidecar):
         print('Manifest Sidecar exists - Source manifest Generation will be skipped.')
         generate_log(
@@ -661,13 +1086,20 @@ def control_flow(manifest_sidecar, log_name_source, manifest, rootpos, args, sou
             print('Generating source manifest')
             generate_log(log_name_source, 'EVENT = Generating source manifest: status=started, eventType=message digest calculation, module=hashlib')
             if rootpos == 'y':
+                if os.path.abspath(args.source) != source:
+                    inventory = None
                 make_manifest(
-                    os.path.abspath(args.source), manifest, os.path.abspath(args.source)
+                    os.path.abspath(args.source), manifest, os.path.abspath(args.source),
+                    log_name_source=log_name_source, trust_cache=True,
+                    inventory=inventory, chunk_size=chunk_size
                 )
             else:
                 make_manifest(
                     source, manifest,
-                    os.path.dirname(source)
+                    os.path.dirname(source),
+                    log_name_source=log_name_source, trust_cache=True,
+                    inventory=inventory, chunk_size=chunk_size,
+                    journal=journal, journal_algorithms=journal_algorithms
                 )
             generate_log(log_name_source, 'EVENT = Generating source manifest: status=completed')
         except OSError:
@@ -689,42 +1121,141 @@ def main(args_):
     else:
         source = os.path.abspath(args.source)
         destination = args.destination
+    resume = (
+        args.resume and not args.move and rootpos != 'y'
+        and os.path.isdir(source) and os.path.isdir(destination_final_path)
+    )
     overwrite_destination_manifest, overwrite_destination_dir = overwrite_check(
         destination, log_name_source,
-        destination_final_path, manifest_destination
+        destination_final_path, manifest_destination, resume
     )
     remove_bad_files(
         source, log_name_source
     )
+    # One walk of the source is shared by the file count and source manifest.
+    source_inventory = ififuncs.make_inventory(source, ififuncs.EXCLUDED_DIRECTORIES)
     source_count, file_list = ififuncs.count_stuff(
-        source
+        source, source_inventory
     )
     manifest_existence(
         manifest_root, manifest_sidecar,
         manifest, source_count,
         file_list, log_name_source
     )
-    manifest_sidecar, manifest, rootpos = control_flow(
-        manifest_sidecar, log_name_source, manifest, rootpos, args, source
+    copy_engine = use_copy_engine(args, rootpos, source, destination_final_path)
+    hash_while_copying = copy_engine and not (
+        os.path.isfile(manifest_sidecar) or os.path.isfile(manifest)
+    )
+    # Moves within a filesystem are renames, so the checksums that are
+    # calculated for the source manifest are journaled and carried across.
+    fast_move = (
+        args.move and not args.move_rehash and not args.justcopy
+        and rootpos != 'y' and is_same_filesystem(source, destination)
     )
+    source_journal = None
+    if fast_move:
+        source_journal = ififuncs.open_hash_journal(source, 'move', log_name_source)
+    if not hash_while_copying:
+        journal_algorithms = ()
+        if args.sha512:
+            journal_algorithms = ('sha512',)
+        manifest_sidecar, manifest, rootpos = control_flow(
+            manifest_sidecar, log_name_source, manifest, rootpos, args, source,
+            source_inventory, source_journal, journal_algorithms
+        )
+    pipeline = None
+    destination_journal = None
     if overwrite_destination_dir not in ('N', 'n'):
         if overwrite_destination_dir != None:
             generate_log(
                 log_name_source,
                 'EVENT = File Transfer Overwrite - Destination directory already exists - Overwriting.'
             )
-        if not args.move:
+        if resume:
+            chunk_size = None
+            if args.chunks:
+                chunk_size = ififuncs.CHUNK_SIZE
+            print('Resuming an interrupted transfer to %s' % destination_final_path)
+            generate_log(
+                log_name_source, 'EVENT = File Transfer, status=started, agentName=%s, agentName=copyit.py, eventDetail=resuming an interrupted transfer' % get_os_name()
+            )
+            resume_transfer(
+                source, destination_final_path, manifest, manifest_destination,
+                log_name_source, source_inventory, args.sha512, chunk_size
+            )
+            pipeline = start_pipeline(args, manifest_destination, log_name_source)
+            copy_and_hash(
+                source, destination_final_path, None, log_name_source,
+                source_inventory, workers=args.copy_workers, pipeline=pipeline
+            )
+            generate_log(
+                log_name_source,
+                'EVENT = File Transfer, status=completed'
+            )
+        elif hash_while_copying:
+            chunk_size = None
+            if args.chunks:
+                chunk_size = ififuncs.CHUNK_SIZE
+            print('Generating source manifest while copying')
+            generate_log(log_name_source, 'EVENT = Generating source manifest: status=started, eventType=message digest calculation, module=hashlib')
+            generate_log(
+                log_name_source, 'EVENT = File Transfer, status=started, agentName=%s, agentName=copyit.py, eventDetail=source manifest calculated in the same pass as the copy' % get_os_name()
+            )
+            pipeline = start_pipeline(args, manifest_destination, log_name_source)
+            copy_and_hash(
+                source, destination_final_path, manifest, log_name_source,
+                source_inventory, chunk_size, args.copy_workers, pipeline
+            )
+            generate_log(
+                log_name_source,
+                'EVENT = File Transfer, status=completed'
+            )
+            generate_log(log_name_source, 'EVENT = Generating source manifest: status=completed')
+        elif copy_engine:
+            generate_log(
+                log_name_source, 'EVENT = File Transfer, status=started, agentName=%s, agentName=copyit.py' % get_os_name()
+            )
+            pipeline = start_pipeline(args, manifest_destination, log_name_source)
+            copy_and_hash(
+                source, destination_final_path, None, log_name_source,
+                source_inventory, workers=args.copy_workers, pipeline=pipeline
+            )
+            generate_log(
+                log_name_source,
+                'EVENT = File Transfer, status=completed'
+            )
+        elif not args.move:
             copy_dir(
                 source, destination_final_path,
                 log_name_source, rootpos, destination, dirname, args
             )
         else:
             shutil.move(source, destination_final_path)
+            if fast_move:
+                chunk_size = None
+                if args.chunks:
+                    chunk_size = ififuncs.CHUNK_SIZE
+                destination_journal, _ = carry_checksums(
+                    source, destination_final_path, source_inventory,
+                    source_journal, manifest_destination, log_name_source,
+                    args.sha512, chunk_size
+                )
+                source_journal = None
     else:
         generate_log(
             log_name_source,
             'EVENT = File Transfer Overwrite - Destination directory already exists - Not Overwriting.'
         )
+    if source_journal is not None:
+        source_journal.close()
+    if pipeline is not None:
+        destination_journal = pipeline.journal
+        print('Waiting for the destination files to be hashed')
+        hashed = pipeline.close()
+        generate_log(
+            log_name_source,
+            'EVENT = message digest calculation - eventDetail=%s destination files were hashed while the copy was running' % hashed
+        )
     if args.justcopy:
         generate_log(
             log_name_source,
@@ -733,11 +1264,16 @@ def main(args_):
         print('Exiting without destination manifest or verification due to the use of -justcopy')
         sys.exit()
     else:
+        chunk_size = None
+        chunk_manifest = None
+        if args.chunks:
+            chunk_size = ififuncs.CHUNK_SIZE
+            chunk_manifest = manifest
         files_in_manifest = make_destination_manifest(
             overwrite_destination_manifest, log_name_source,
             rootpos, destination_final_path,
             manifest_destination,
-            destination
+            destination, args.sha512, chunk_size, destination_journal
         )
         destination_count = 0
         # dear god do this better, this is dreadful code!
@@ -757,12 +1293,20 @@ def main(args_):
                 legacy_manifest = manifest
                 manifest = manifest_temp[1]
         verify_copy(
-            manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count
+            manifest, manifest_destination, log_name_source, overwrite_destination_manifest, files_in_manifest, destination_count, source_count,
+            chunk_manifest
         )
         manifest_rename = manifest[:-4] + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.md5'
         if os.path.normpath(os.path.dirname(manifest)) == os.path.normpath(desktop_manifest_dir):
             os.rename(manifest, manifest_rename)
             shutil.move(manifest_rename, os.path.join(desktop_manifest_dir, 'old_manifests'))
+            if chunk_manifest and os.path.isfile(ififuncs.get_chunk_sidecar(chunk_manifest)):
+                shutil.move(
+                    ififuncs.get_chunk_sidecar(chunk_manifest),
+                    os.path.join(desktop_manifest_dir, 'old_manifests', os.path.basename(ififuncs.get_chunk_sidecar(
+                        chunk_manifest[:-4] + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.md5'
+                    )))
+                )
             if rootpos == 'y':
                 legacy_manifest_rename = legacy_manifest[:-4] + time.strftime("_%Y_%m_%dT%H_%M_%S") + '.md5'
                 os.rename(legacy_manifest, legacy_manifest_rename)
@@ -39,25 +39,17 @@ def parse_args(args_):
 
 def remove_from_manifest(manifest, old_oe, new_log_textfile):
     '''
-    Removes a file from a manifest and logs the result in the logfile.
+    Removes a file from a manifest, sorts it and logs the result in the logfile.
     '''
-    updated_lines = []
-    with open(manifest, 'r') as file_object:
-        checksums = file_object.readlines()
-        for line in checksums:
-            if old_oe in line:
-                print(('%s has been removed from the package manifest' % line))
-                ififuncs.generate_log(
-                    new_log_textfile,
-                    'EVENT = eventType=metadata modification,'
-                    ' agentName=deletefiles.py,'
-                    ' eventDetail=%s has been removed from the package manifest' % line)
-                continue
-            else:
-                updated_lines.append(line)
-    with open(manifest, 'w') as updated_manifest:
-        for updated_line in updated_lines:
-            updated_manifest.write(updated_line)
+    package_manifest = ififuncs.Manifest(manifest)
+    for line in package_manifest.remove(old_oe):
+        print(('%s has been removed from the package manifest' % line))
+        ififuncs.generate_log(
+            new_log_textfile,
+            'EVENT = eventType=metadata modification,'
+            ' agentName=deletefiles.py,'
+            ' eventDetail=%s has been removed from the package manifest' % line)
+    package_manifest.save(sort=True)
 
 
 def main(args_):
@@ -138,10 +130,8 @@ def main(args_):
                     % os.path.join(metadata_dir, metadata)
                 )
         remove_from_manifest(sip_manifest, os.path.basename(filename), new_log_textfile)
-        ififuncs.sort_manifest(sip_manifest)
         if args.aip:
             remove_from_manifest(sip_manifest_sha512, os.path.basename(filename), new_log_textfile)
-            ififuncs.sort_manifest(sip_manifest_sha512)
     ififuncs.generate_log(
         new_log_textfile,
         'EVENT = deletefiles.py finished'
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+'''
+Creates a reproducible synthetic corpus for testing and benchmarking.
+Unlike testfiles.py and fakexdcam.py, ffmpeg is not needed - the files have
+realistic names, sizes and headers but the payload is pseudo-random data.
+Usage: fakecorpus.py -o path/to/dir
+Run fakecorpus.py -h for help.
+'''
+import os
+import sys
+import json
+import random
+import struct
+import argparse
+import unicodedata
+
+PROFILES = ('dpx', 'tiff', 'blob', 'mixed')
+# 2K full aperture, 10-bit RGB DPX and 16-bit RGB TIFF image sizes.
+DPX_FRAME_SIZE = 2048 * 1556 * 4
+TIFF_FRAME_SIZE = 2048 * 1556 * 6
+POOL_SIZE = 8 * 2**20
+WRITE_SIZE = 4 * 2**20
+# Names that differ between NFC and NFD, so that normalisation bugs show up.
+UNICODE_NAMES = [
+    'Café', 'naïve', 'Seán Ó Riada', 'Génesis',
+    'Árð Mhacha', 'Straße', 'Ångström', 'Piña'
+]
+DOC_EXTENSIONS = ['.txt', '.xml', '.pdf', '.jpg', '.csv', '.docx']
+
+
+def parse_args(args_):
+    '''
+    Parse command line arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description='Creates a reproducible synthetic corpus of image sequences,'
+        ' large AV files and mixed trees with Unicode filenames.'
+        ' ffmpeg is not required.'
+    )
+    parser.add_argument(
+        '-o', '-output',
+        help='full path of output directory', required=True
+    )
+    parser.add_argument(
+        '-profile', nargs='+', choices=PROFILES, default=list(PROFILES),
+        help='Which parts of the corpus to create. Default is all of them.'
+    )
+    parser.add_argument(
+        '-frames', type=int, default=24,
+        help='Number of frames in each DPX and TIFF sequence. Default is 24.'
+    )
+    parser.add_argument(
+        '-frame_size', type=int,
+        help='Size in bytes of each image in the sequences. Defaults to a 2K 10-bit DPX (%s) and a 2K 16-bit TIFF (%s).' % (DPX_FRAME_SIZE, TIFF_FRAME_SIZE)
+    )
+    parser.add_argument(
+        '-blob_size', type=int, default=1024,
+        help='Size in MiB of the large MKV file. Default is 1024.'
+    )
+    parser.add_argument(
+        '-files', type=int, default=1000,
+        help='Number of small files in the mixed tree. Default is 1000.'
+    )
+    parser.add_argument(
+        '-seed', type=int, default=0,
+        help='Random seed. The same seed and options always create identical files.'
+    )
+    parsed_args = parser.parse_args(args_)
+    return parsed_args
+
+
+def make_pool(seed):
+    '''
+    Returns a block of pseudo-random bytes that file payloads are cut from.
+    '''
+    rng = random.Random(seed)
+    return rng.getrandbits(POOL_SIZE * 8).to_bytes(POOL_SIZE, 'little')
+
+
+def write_file(filename, size, header, pool, index):
+    '''
+    Writes header followed by pool data up to size bytes. The pool offset
+    depends on index so that no two files have the same content.
+    '''
+    header = header[:size]
+    offset = (index * 4099) % POOL_SIZE
+    remaining = size - len(header)
+    with open(filename, 'wb') as file_object:
+        file_object.write(header)
+        while remaining > 0:
+            length = min(remaining, WRITE_SIZE, POOL_SIZE - offset)
+            file_object.write(pool[offset:offset + length])
+            remaining -= length
+            offset = (offset + length) % POOL_SIZE
+    return size
+
+
+def dpx_header(size, frame_number):
+    '''
+    Returns a minimal big-endian DPX file header.
+    '''
+    header = struct.pack('>4sI8sI', b'SDPX', 2048, b'V2.0\x00\x00\x00\x00', size)
+    header += struct.pack('>I', frame_number)
+    return header.ljust(2048, b'\x00')
+
+
+def tiff_header(size, frame_number):
+    '''
+    Returns a minimal little-endian TIFF file header.
+    '''
+    header = struct.pack('<2sHI', b'II', 42, 8)
+    header += struct.pack('<II', size, frame_number)
+    return header.ljust(256, b'\x00')
+
+
+def mkv_header():
+    '''
+    Returns an EBML header that identifies the file as Matroska.
+    '''
+    doctype = b'matroska'
+    return b'\x1a\x45\xdf\xa3\x9f\x42\x82' + bytes([0x80 | len(doctype)]) + doctype
+
+
+def make_sequence(directory, basename, extension, frames, frame_size, header_function, pool, first_index):
+    '''
+    Creates an image sequence of frames files named basename_000000.ext
+    '''
+    os.makedirs(directory)
+    total_size = 0
+    for frame_number in range(frames):
+        filename = os.path.join(directory, '%s_%06d%s' % (basename, frame_number, extension))
+        total_size += write_file(
+            filename, frame_size,
+            header_function(frame_size, frame_number),
+            pool, first_index + frame_number
+        )
+    return frames, total_size
+
+
+def make_blob(directory, size, pool, index):
+    '''
+    Creates a single large Matroska-like file.
+    '''
+    os.makedirs(directory)
+    filename = os.path.join(directory, 'large_blob.mkv')
+    return 1, write_file(filename, size, mkv_header(), pool, index)
+
+
+def make_mixed(directory, files, seed, pool, first_index):
+    '''
+    Creates a nested tree of small documents and sidecars. Half of the
+    Unicode names are stored NFC-normalised and half NFD-normalised.
+    '''
+    rng = random.Random(seed)
+    total_size = 0
+    for index in range(files):
+        name = UNICODE_NAMES[index % len(UNICODE_NAMES)]
+        if index % 2:
+            name = unicodedata.normalize('NFD', name)
+        else:
+            name = unicodedata.normalize('NFC', name)
+        subfolder = os.path.join(
+            directory,
+            'reel%02d' % (index % 10),
+            name if index % 3 == 0 else 'folder%02d' % (index % 7)
+        )
+        if not os.path.isdir(subfolder):
+            os.makedirs(subfolder)
+        extension = DOC_EXTENSIONS[index % len(DOC_EXTENSIONS)]
+        filename = os.path.join(subfolder, '%s_%05d%s' % (name, index, extension))
+        # Mostly small files with a long tail, as in real document collections.
+        size = min(int(rng.paretovariate(1.2) * 4096), 2**20)
+        total_size += write_file(filename, size, b'', pool, first_index + index)
+    return files, total_size
+
+
+def main(args_):
+    '''
+    Creates the corpus in a corpus subdirectory and describes it in a
+    corpus.json file next to it. Returns the path of the corpus directory.
+    '''
+    args = parse_args(args_)
+    output_dir = os.path.abspath(args.o)
+    corpus_dir = os.path.join(output_dir, 'corpus')
+    if os.path.exists(corpus_dir):
+        print('%s already exists, exiting' % corpus_dir)
+        sys.exit()
+    os.makedirs(corpus_dir)
+    pool = make_pool(args.seed)
+    description = {
+        'seed': args.seed,
+        'profile': args.profile,
+        'frames': args.frames,
+        'frame_size': args.frame_size,
+        'blob_size': args.blob_size,
+        'mixed_files': args.files,
+        'parts': {}
+    }
+    index = 0
+    for profile in args.profile:
+        print(' - Creating %s files' % profile)
+        directory = os.path.join(corpus_dir, profile)
+        if profile == 'dpx':
+            file_count, size = make_sequence(
+                directory, 'dpx_sequence', '.dpx', args.frames,
+                args.frame_size or DPX_FRAME_SIZE, dpx_header, pool, index
+            )
+        elif profile == 'tiff':
+            file_count, size = make_sequence(
+                directory, 'tiff_sequence', '.tiff', args.frames,
+                args.frame_size or TIFF_FRAME_SIZE, tiff_header, pool, index
+            )
+        elif profile == 'blob':
+            file_count, size = make_blob(
+                directory, args.blob_size * 2**20, pool, index
+            )
+        else:
+            file_count, size = make_mixed(
+                directory, args.files, args.seed, pool, index
+            )
+        index += file_count
+        description['parts'][profile] = {'files': file_count, 'bytes': size}
+    description['files'] = sum(part['files'] for part in description['parts'].values())
+    description['bytes'] = sum(part['bytes'] for part in description['parts'].values())
+    with open(os.path.join(output_dir, 'corpus.json'), 'w') as fo:
+        json.dump(description, fo, indent=4, sort_keys=True)
+    print('%s files, %s bytes created in %s' % (description['files'], description['bytes'], corpus_dir))
+    return corpus_dir
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
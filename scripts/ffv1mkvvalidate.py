@@ -4,7 +4,6 @@ Runs mediaconch on FFV1/MKV files.
 The process will validate the files against the FFV1/MKV/PCM standards.
 '''
 import os
-import subprocess
 import sys
 import time
 import argparse
@@ -117,7 +116,7 @@ def launch_mediaconch(log_name_source, user, mediaconch_xmlfile, manifest, full_
         log_name_source,
         'eventDetail=ffv1mkvvalidate.py %s' % ififuncs.get_script_version('ffv1mkvvalidate.py')
     )
-    mediaconch_version = subprocess.check_output(['mediaconch', '-v']).rstrip()
+    mediaconch_version = ififuncs.get_tool_version('mediaconch')
     ififuncs.generate_log(
         log_name_source,
         'agentName=mediaconch, agentversion=%s' % mediaconch_version
@@ -22,8 +22,18 @@ import json
 import ctypes
 import platform
 import itertools
+import heapq
+import collections
 import unicodedata
 import shutil
+import atexit
+import contextlib
+import zlib
+import sqlite3
+import threading
+import concurrent.futures
+import mmap
+import queue
 from builtins import input
 import makedfxml
 from glob import glob
@@ -38,6 +48,77 @@ except ImportError:
     print('ERROR - lxml is not installed - try pip install lxml')
     sys.exit()
 
+# Number of files hashed at once by the manifest functions, and the maximum
+# number of those that may be read from the same storage device at once.
+HASH_WORKERS = 4
+HASH_WORKERS_PER_DEVICE = 2
+# Number of mediainfo, exiftool and siegfried processes that
+# get_technical_metadata() runs at once.
+METADATA_WORKERS = int(os.environ.get('IFISCRIPTS_METADATA_WORKERS', min(os.cpu_count() or 1, 8)))
+# Number of long-lived exiftool processes that make_exiftool() keeps open.
+# 0 starts a new exiftool for every file, as older versions did.
+EXIFTOOL_SESSIONS = int(os.environ.get('IFISCRIPTS_EXIFTOOL_SESSIONS', METADATA_WORKERS))
+# Set IFISCRIPTS_SIEGFRIED_BATCH=0 to run sf once per file, see make_siegfried_batch()
+SIEGFRIED_BATCH = os.environ.get('IFISCRIPTS_SIEGFRIED_BATCH', '1') != '0'
+# Number of manifest lines sorted in memory before spilling to a temp file.
+MANIFEST_SORT_RUN_SIZE = 100000
+# Block size and digest of chunk checksum sidecars, see write_chunk_sidecar()
+CHUNK_SIZE = 64 * 2**20
+CHUNK_ALGORITHM = 'md5'
+# Seconds of throughput that AdaptiveLimiter measures before changing its cap.
+ADAPTIVE_WINDOW_SECONDS = 2
+# Seconds between fsyncs of a HashJournal.
+JOURNAL_FLUSH_SECONDS = 10
+# How read_blocks() reads files for hashing, see set_read_options()
+READ_MODES = ('buffered', 'direct', 'mmap')
+READ_OPTIONS = {
+    'block_size': int(os.environ.get('IFISCRIPTS_READ_BLOCK_SIZE', 4 * 2**20)),
+    'read_ahead': os.environ.get('IFISCRIPTS_READ_AHEAD', '1') != '0',
+    'mode': os.environ.get('IFISCRIPTS_READ_MODE', 'buffered'),
+    'drop_cache': os.environ.get('IFISCRIPTS_READ_DROP_CACHE', '0') != '0',
+}
+# Files of fewer blocks than this are read without the read-ahead thread.
+READ_AHEAD_MIN_BLOCKS = 4
+# Seconds between progress reports, and an optional file that a JSON copy of
+# each report is written to, see Progress and set_progress_file()
+PROGRESS_INTERVAL = float(os.environ.get('IFISCRIPTS_PROGRESS_INTERVAL', 2))
+PROGRESS_FILE = os.environ.get('IFISCRIPTS_PROGRESS_FILE')
+PROGRESS_LOG = None
+# Drive system folders that copyit.py leaves out of its copies and manifests,
+# see make_inventory(). Hidden files and folders are always skipped.
+EXCLUDED_DIRECTORIES = ('System Volume Information', '$RECYCLE.BIN', 'Seagate')
+InventoryEntry = collections.namedtuple(
+    'InventoryEntry', ['path', 'size', 'mtime_ns', 'inode', 'device']
+)
+# Semaphores shared by batch worker processes, see set_stage_limits()
+_stage_limits = {}
+# Differences between two manifests, see diff_manifests()
+ManifestDiff = collections.namedtuple(
+    'ManifestDiff', ['missing', 'extra', 'mismatched', 'encoding_only']
+)
+# Opt-in fixity cache policy, see set_fixity_cache_policy()
+FIXITY_CACHE_POLICY = os.environ.get('IFISCRIPTS_FIXITY_CACHE', 'off')
+FIXITY_CACHE_POLICIES = ('off', 'record', 'derived')
+_fixity_cache = {'connection': None, 'uncommitted': 0}
+_fixity_cache_lock = threading.Lock()
+# Version probes of external tools, see get_tool_version(). Each tool has
+# the command that prints its version, a function that tidies the output
+# and a fallback name.
+TOOL_VERSION_COMMANDS = {
+    'mediainfo': (['mediainfo', '--Version'], lambda output: output.rstrip(), 'mediainfo'),
+    'exiftool': (['exiftool', '-ver'], lambda output: output, 'exiftool'),
+    'siegfried': (['sf', '-version'], lambda output: output, 'siegfried'),
+    'ffmpeg': (['ffmpeg', '-version', '-v', '0'], lambda output: output.splitlines()[0], 'ffmpeg'),
+    'rawcooked': (['rawcooked', '--version'], lambda output: output.rstrip(), 'RAWcooked'),
+    'mediaconch': (['mediaconch', '-v'], lambda output: output.rstrip(), 'mediaconch'),
+}
+# Opt-in on-disk cache of tool versions, see set_tool_version_cache()
+TOOL_VERSION_CACHE = os.environ.get('IFISCRIPTS_TOOL_VERSION_CACHE', 'off')
+_tool_versions = {}
+_tool_versions_lock = threading.Lock()
+# Pooled exiftool -stay_open processes, see exiftool_session()
+_exiftool_pool = {'sessions': [], 'idle': queue.Queue(), 'lock': threading.Lock(), 'available': True}
+
 
 def diff_textfiles(source_textfile, other_textfile):
     '''
@@ -73,6 +154,131 @@ def make_mediainfo(xmlfilename, xmlvariable, inputfilename):
         fo.write(xmlvariable)
 
 
+class ExiftoolSession(object):
+    '''
+    A long-lived exiftool process in -stay_open mode, which saves the perl
+    start-up time for every file. Use exiftool_session() to borrow one.
+    '''
+    def __init__(self):
+        self.process = None
+        self.count = 0
+        self.start()
+
+    def start(self):
+        '''
+        Launches exiftool, reading its arguments from stdin.
+        '''
+        self.process = subprocess.Popen(
+            ['exiftool', '-stay_open', 'True', '-@', '-'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        )
+
+    def restart(self):
+        '''
+        Replaces a crashed or unresponsive exiftool process.
+        '''
+        self.process.kill()
+        self.process.wait()
+        self.start()
+
+    def execute(self, inputfilename):
+        '''
+        Runs exiftool -j on a file. Returns the exit status of the command
+        and the json output as bytes.
+        '''
+        self.count += 1
+        ready = b'{ready%d}' % self.count
+        arguments = ['-j', inputfilename, '-echo3', '${status}', '-execute%d' % self.count]
+        self.process.stdin.write(b''.join(os.fsencode(argument) + b'\n' for argument in arguments))
+        self.process.stdin.flush()
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise EOFError('exiftool exited unexpectedly')
+            if line.rstrip(b'\r\n') == ready:
+                break
+            lines.append(line)
+        # -echo3 prints the status after the json output.
+        status = lines.pop().strip() if lines else b''
+        return status, b''.join(lines)
+
+    def close(self):
+        '''
+        Asks exiftool to exit, killing it if it does not.
+        '''
+        try:
+            self.process.stdin.write(b'-stay_open\nFalse\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+@contextlib.contextmanager
+def exiftool_session():
+    '''
+    Lends out an idle ExiftoolSession. A new session is started if fewer than
+    EXIFTOOL_SESSIONS are running, otherwise this waits for one to be free.
+    '''
+    try:
+        session = _exiftool_pool['idle'].get_nowait()
+    except queue.Empty:
+        session = None
+        with _exiftool_pool['lock']:
+            if len(_exiftool_pool['sessions']) < EXIFTOOL_SESSIONS:
+                session = ExiftoolSession()
+                if not _exiftool_pool['sessions']:
+                    atexit.register(close_exiftool_sessions)
+                _exiftool_pool['sessions'].append(session)
+        if session is None:
+            session = _exiftool_pool['idle'].get()
+    try:
+        yield session
+    finally:
+        _exiftool_pool['idle'].put(session)
+
+
+def close_exiftool_sessions():
+    '''
+    Stops all pooled exiftool processes.
+    '''
+    with _exiftool_pool['lock']:
+        for session in _exiftool_pool['sessions']:
+            session.close()
+        _exiftool_pool['sessions'] = []
+        _exiftool_pool['idle'] = queue.Queue()
+
+
+def exiftool_json(inputfilename):
+    '''
+    Returns the exiftool -j output of a file as bytes, using a pooled
+    session. A session that crashes is restarted and the file is tried once
+    more. Returns None if the pool can not be used or exiftool reported an
+    error, so that the caller can run exiftool the usual way.
+    '''
+    if EXIFTOOL_SESSIONS < 1 or not _exiftool_pool['available'] or '\n' in inputfilename:
+        return None
+    try:
+        with exiftool_session() as session:
+            for _ in range(2):
+                try:
+                    status, output = session.execute(inputfilename)
+                    break
+                except (OSError, ValueError, EOFError):
+                    session.restart()
+            else:
+                return None
+    except OSError:
+        # exiftool could not be started at all.
+        _exiftool_pool['available'] = False
+        return None
+    if status != b'0' or not output:
+        return None
+    return output
+
+
 def make_exiftool(xmlfilename, inputfilename):
     '''
     Writes an exiftool json output.
@@ -83,15 +289,19 @@ def make_exiftool(xmlfilename, inputfilename):
         inputfilename
     ]
     with open(xmlfilename, "w", encoding='utf-8') as fo:
-        try:
-            xmlvariable = subprocess.check_output(exiftool_cmd).decode(sys.stdout.encoding)
-        # exiftool has difficulties with unicode support on windows.
-        # instead of exiftool reading the file, the file is loading into memory
-        # and exiftool anaylses that instead.
-        # https://exiftool.org/exiftool_pod.html#WINDOWS-UNICODE-FILE-NAMES
-        except subprocess.CalledProcessError:
-            with open(inputfilename, 'rb') as file_object:
-                xmlvariable = subprocess.check_output(['exiftool', '-j', '-'], stdin=file_object).decode("utf-8")
+        output = exiftool_json(inputfilename)
+        if output is not None:
+            xmlvariable = output.decode(sys.stdout.encoding)
+        else:
+            try:
+                xmlvariable = subprocess.check_output(exiftool_cmd).decode(sys.stdout.encoding)
+            # exiftool has difficulties with unicode support on windows.
+            # instead of exiftool reading the file, the file is loading into memory
+            # and exiftool anaylses that instead.
+            # https://exiftool.org/exiftool_pod.html#WINDOWS-UNICODE-FILE-NAMES
+            except subprocess.CalledProcessError:
+                with open(inputfilename, 'rb') as file_object:
+                    xmlvariable = subprocess.check_output(['exiftool', '-j', '-'], stdin=file_object).decode("utf-8")
         fo.write(xmlvariable)
 
 
@@ -111,6 +321,42 @@ def make_siegfried(xmlfilename, inputfilename):
         fo.write(json.dumps(parsed, indent=4, sort_keys=True))
 
 
+def make_siegfried_batch(directory, xmlfilenames):
+    '''
+    Identifies the files in a directory, but not its subdirectories, with one
+    sf run instead of loading the signature file again for every file.
+    xmlfilenames maps the full path of each file to its sidecar, which gets
+    the same json as make_siegfried() would write. Returns the full paths
+    that have a sidecar, the rest should go through make_siegfried().
+    '''
+    siegfried_cmd = [
+        'sf',
+        '-json',
+        '-nr',
+        directory
+    ]
+    try:
+        xmlvariable = subprocess.check_output(siegfried_cmd).decode(sys.stdout.encoding)
+        parsed = json.loads(xmlvariable)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return set()
+    wanted = {}
+    for full_path in xmlfilenames:
+        wanted[os.path.normcase(os.path.normpath(full_path))] = full_path
+    written = set()
+    for file_entry in parsed.get('files') or []:
+        full_path = wanted.get(os.path.normcase(os.path.normpath(file_entry.get('filename', ''))))
+        if full_path is None or full_path in written:
+            continue
+        # The header is shared, so each sidecar looks like a run on one file.
+        report = dict(parsed)
+        report['files'] = [dict(file_entry, filename=full_path)]
+        with open(xmlfilenames[full_path], "w+") as fo:
+            fo.write(json.dumps(report, indent=4, sort_keys=True))
+        written.add(full_path)
+    return written
+
+
 def make_mediaconch(full_path, mediaconch_xmlfile):
     '''
     Creates a mediaconch implementation check XML report.
@@ -351,167 +597,1525 @@ def generate_txt(user, txt, what2txt):
             fo.write(what2txt + ' \n')
 
 
+def set_fixity_cache_policy(policy):
+    '''
+    Sets how the local fixity cache is used. The policy can also be set with
+    the IFISCRIPTS_FIXITY_CACHE environment variable.
+    off - the cache is not used at all. This is the default.
+    record - every checksum that is calculated is recorded in the cache, but
+    cached values are never trusted. Files are always re-read, so this is safe
+    for fixity judgements.
+    derived - as record, but derived manifests (manifest.py, aipcreator.py,
+    copyit.py source manifests) may reuse cached values for files whose
+    device, inode, size and modification time are unchanged.
+    Fixity judgements (validate.py, copyit.py destination manifests) always
+    re-read files regardless of the policy.
+    '''
+    global FIXITY_CACHE_POLICY
+    if policy not in FIXITY_CACHE_POLICIES:
+        print(' - %s is not a valid fixity cache policy. Choose from %s' % (policy, ', '.join(FIXITY_CACHE_POLICIES)))
+        sys.exit()
+    FIXITY_CACHE_POLICY = policy
+
+
+def get_fixity_cache():
+    '''
+    Returns a connection to the SQLite fixity cache, which lives in the
+    desktop logs directory. The caller must hold _fixity_cache_lock.
+    '''
+    if _fixity_cache['connection'] is None:
+        fixity_cache = os.path.join(make_desktop_logs_dir(), 'fixity_cache.sqlite')
+        connection = sqlite3.connect(fixity_cache, check_same_thread=False)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS fixity ('
+            'device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+            'algorithm TEXT, checksum TEXT, path TEXT, recorded TEXT, '
+            'PRIMARY KEY (device, inode, size, mtime_ns, algorithm))'
+        )
+        connection.commit()
+        _fixity_cache['connection'] = connection
+        atexit.register(commit_fixity_cache)
+    return _fixity_cache['connection']
+
+
+def commit_fixity_cache():
+    '''
+    Writes any pending fixity cache entries to disk.
+    '''
+    with _fixity_cache_lock:
+        if _fixity_cache['connection'] is not None:
+            _fixity_cache['connection'].commit()
+            _fixity_cache['uncommitted'] = 0
+
+
+def get_file_identity(filename):
+    '''
+    Returns the (device, inode, size, mtime_ns) tuple that identifies an
+    unchanged file in the fixity cache.
+    '''
+    file_stat = os.stat(filename)
+    return (file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+
+def fixity_cache_lookup(filename, algorithm):
+    '''
+    Returns a cached checksum for an unchanged file, or None.
+    Only the derived policy allows cached values to be used.
+    '''
+    if FIXITY_CACHE_POLICY != 'derived':
+        return None
+    with _fixity_cache_lock:
+        row = get_fixity_cache().execute(
+            'SELECT checksum FROM fixity WHERE device=? AND inode=? AND size=?'
+            ' AND mtime_ns=? AND algorithm=?',
+            get_file_identity(filename) + (algorithm,)
+        ).fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def fixity_cache_store(file_identity, filename, checksums):
+    '''
+    Records freshly calculated checksums in the fixity cache.
+    '''
+    if FIXITY_CACHE_POLICY == 'off':
+        return
+    with _fixity_cache_lock:
+        connection = get_fixity_cache()
+        for algorithm, checksum in checksums.items():
+            connection.execute(
+                'INSERT OR REPLACE INTO fixity VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                file_identity + (
+                    algorithm, checksum, os.path.abspath(filename),
+                    time.strftime("%Y-%m-%dT%H:%M:%S")
+                )
+            )
+        _fixity_cache['uncommitted'] += 1
+        if _fixity_cache['uncommitted'] >= 100:
+            connection.commit()
+            _fixity_cache['uncommitted'] = 0
+
+
+def set_read_options(block_size=None, read_ahead=None, mode=None, drop_cache=None):
+    '''
+    Changes how read_blocks() reads files for all hashing functions.
+    block_size - number of bytes per read.
+    read_ahead - read the next blocks in a background thread while the
+    current one is being hashed.
+    mode - buffered, direct (O_DIRECT, bypasses the page cache on Linux)
+    or mmap.
+    drop_cache - on Linux, tell the kernel that the pages of a file that has
+    been read will not be needed again (POSIX_FADV_DONTNEED).
+    The same options can be set with the IFISCRIPTS_READ_BLOCK_SIZE,
+    IFISCRIPTS_READ_AHEAD, IFISCRIPTS_READ_MODE and IFISCRIPTS_READ_DROP_CACHE
+    environment variables.
+    '''
+    if mode is not None and mode not in READ_MODES:
+        raise ValueError('read mode must be one of %s' % ', '.join(READ_MODES))
+    for option, value in (
+            ('block_size', block_size), ('read_ahead', read_ahead),
+            ('mode', mode), ('drop_cache', drop_cache)):
+        if value is not None:
+            READ_OPTIONS[option] = value
+
+
+def set_progress_file(progress_file):
+    '''
+    Every Progress report is also written as JSON to progress_file, so that
+    long jobs can be monitored from another machine. The file can also be set
+    with the IFISCRIPTS_PROGRESS_FILE environment variable.
+    '''
+    global PROGRESS_FILE
+    PROGRESS_FILE = progress_file
+
+
+def set_progress_log(log_name):
+    '''
+    Adds the log of the running script to every progress file report, so
+    that the script that launched it, eg: masscopy.py, can find its log.
+    If a progress file is set, it is written straight away.
+    '''
+    global PROGRESS_LOG
+    PROGRESS_LOG = log_name
+    if PROGRESS_FILE:
+        report = {
+            'pid': os.getpid(),
+            'updated': datetime.datetime.now().isoformat(),
+            'log': log_name,
+            'stage': None,
+            'finished': False,
+            'stages': {}
+        }
+        temp_file = PROGRESS_FILE + '.tmp'
+        try:
+            with open(temp_file, 'w') as fo:
+                json.dump(report, fo, indent=4)
+            os.replace(temp_file, PROGRESS_FILE)
+        except OSError as e:
+            print(' - Progress file could not be written: %s' % e)
+
+
+def format_seconds(seconds):
+    '''
+    Returns a number of seconds as H:MM:SS
+    '''
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class Progress(object):
+    '''
+    Rate limited progress reporter shared by the hashing, copying and
+    validation functions. Instead of a line per file or per block, a single
+    line with bytes/s, files/s and an ETA for the current stage is printed at
+    most every PROGRESS_INTERVAL seconds. It is rewritten in place on a
+    terminal and printed on a new line otherwise, eg: when output is logged.
+    update() and file_done() may be called from several threads.
+    Files that are not read, eg: fixity cache hits, are counted with
+    file_done(size, read=False) so that the ETA stays accurate.
+    If summary is True, close() prints the totals of every stage.
+    If a progress file is set, each report is also written there as JSON.
+    '''
+    def __init__(self, stage, total_files=0, total_bytes=0, interval=None, progress_file=None, summary=True):
+        if interval is None:
+            interval = PROGRESS_INTERVAL
+        if progress_file is None:
+            progress_file = PROGRESS_FILE
+        self.interval = interval
+        self.progress_file = progress_file
+        self.summary = summary
+        self.lock = threading.Lock()
+        self.stages = collections.OrderedDict()
+        self.stage = None
+        self.last_report = time.monotonic()
+        self.reported = False
+        self.start_stage(stage, total_files, total_bytes)
+
+    def start_stage(self, stage, total_files=0, total_bytes=0):
+        '''
+        Finishes the current stage and starts counting a new one.
+        '''
+        with self.lock:
+            self.finish_stage()
+            self.stage = {
+                'name': stage, 'files': 0, 'total_files': total_files,
+                'bytes': 0, 'skipped_bytes': 0, 'total_bytes': total_bytes,
+                'started': time.monotonic(), 'seconds': 0
+            }
+            self.stages[stage] = self.stage
+
+    def finish_stage(self):
+        '''
+        Records how long the current stage took. The lock must be held.
+        '''
+        if self.stage is not None:
+            self.stage['seconds'] = time.monotonic() - self.stage['started']
+            self.stage['finished'] = True
+
+    def update(self, nbytes):
+        '''
+        Counts bytes that were read, eg: after every block.
+        '''
+        with self.lock:
+            self.stage['bytes'] += nbytes
+            self.report()
+
+    def file_done(self, nbytes=0, read=True):
+        '''
+        Counts a finished file. nbytes is only needed for files whose blocks
+        were not counted with update(), eg: because they were not read.
+        '''
+        with self.lock:
+            self.stage['files'] += 1
+            if read:
+                self.stage['bytes'] += nbytes
+            else:
+                self.stage['skipped_bytes'] += nbytes
+            self.report()
+
+    def stats(self, stage):
+        '''
+        Returns a dictionary of totals, rates and ETA for a stage.
+        '''
+        if stage.get('finished'):
+            seconds = stage['seconds']
+        else:
+            seconds = time.monotonic() - stage['started']
+        seconds = max(seconds, 0.001)
+        bytes_per_second = stage['bytes'] / seconds
+        eta = None
+        remaining = stage['total_bytes'] - stage['bytes'] - stage['skipped_bytes']
+        if stage['total_bytes'] and bytes_per_second:
+            eta = max(remaining, 0) / bytes_per_second
+        elif stage['total_files'] and stage['files']:
+            eta = (stage['total_files'] - stage['files']) * seconds / stage['files']
+        return {
+            'files': stage['files'], 'total_files': stage['total_files'],
+            'bytes': stage['bytes'] + stage['skipped_bytes'],
+            'total_bytes': stage['total_bytes'],
+            'seconds': round(seconds, 3),
+            'bytes_per_second': round(bytes_per_second),
+            'files_per_second': round(stage['files'] / seconds, 1),
+            'eta_seconds': None if eta is None else round(eta),
+            'finished': bool(stage.get('finished'))
+        }
+
+    def report(self, force=False):
+        '''
+        Prints the current stage and updates the progress file, unless the
+        last report was less than interval seconds ago. The lock must be held.
+        '''
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        self.reported = True
+        stats = self.stats(self.stage)
+        line = '%s: %s' % (self.stage['name'], stats['files'])
+        if stats['total_files']:
+            line += ' of %s' % stats['total_files']
+        line += ' files, %.1f' % (stats['bytes'] / 2**20)
+        if stats['total_bytes']:
+            line += ' of %.1f' % (stats['total_bytes'] / 2**20)
+        line += ' MB, %.1f MB/s, %.1f files/s' % (
+            stats['bytes_per_second'] / 2**20, stats['files_per_second']
+        )
+        if stats['eta_seconds'] is not None:
+            line += ', ETA %s' % format_seconds(stats['eta_seconds'])
+        if sys.stdout.isatty():
+            sys.stdout.write('\r' + line.ljust(79))
+        else:
+            sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+        self.write_progress_file()
+
+    def write_progress_file(self):
+        '''
+        Replaces the progress file with a JSON report of every stage.
+        '''
+        if not self.progress_file:
+            return
+        report = {
+            'pid': os.getpid(),
+            'updated': datetime.datetime.now().isoformat(),
+            'log': PROGRESS_LOG,
+            'stage': self.stage['name'],
+            'finished': bool(self.stage.get('finished')),
+            'stages': collections.OrderedDict(
+                (name, self.stats(stage)) for name, stage in self.stages.items()
+            )
+        }
+        temp_file = self.progress_file + '.tmp'
+        try:
+            with open(temp_file, 'w') as fo:
+                json.dump(report, fo, indent=4)
+            os.replace(temp_file, self.progress_file)
+        except OSError as e:
+            print(' - Progress file could not be written: %s' % e)
+            self.progress_file = None
+
+    def close(self):
+        '''
+        Finishes the last stage and prints the totals of every stage.
+        '''
+        with self.lock:
+            self.finish_stage()
+            if self.reported and sys.stdout.isatty():
+                sys.stdout.write('\n')
+            if self.summary:
+                for name, stage in self.stages.items():
+                    stats = self.stats(stage)
+                    print('%s: %s files, %.1f MB in %s (%.1f MB/s, %.1f files/s)' % (
+                        name, stats['files'], stats['bytes'] / 2**20,
+                        format_seconds(stats['seconds']),
+                        stats['bytes_per_second'] / 2**20, stats['files_per_second']
+                    ))
+            self.write_progress_file()
+
+
+def _fadvise(fd, offset, length, advice):
+    '''
+    Calls posix_fadvise where it is available. The advice is only a hint,
+    so errors are ignored.
+    '''
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def _open_for_reading(filename, mode):
+    '''
+    Opens a file descriptor for read_blocks(). Returns (fd, mode), as
+    direct mode falls back to buffered if O_DIRECT is not supported by the
+    operating system or file system.
+    '''
+    flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+    if mode == 'direct':
+        if hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(str(filename), flags | os.O_DIRECT), mode
+            except OSError:
+                pass
+        mode = 'buffered'
+    return os.open(str(filename), flags), mode
+
+
+def read_blocks(filename, offset=0, block_size=None, read_ahead=None, mode=None):
+    '''
+    Yields the contents of a file as a series of blocks, starting at offset.
+    This is the shared reader for all hashing functions. Options default to
+    READ_OPTIONS, see set_read_options().
+    With read_ahead, a background thread reads the next block while the
+    caller hashes the current one, using a small ring of reusable buffers.
+    Files of fewer than READ_AHEAD_MIN_BLOCKS blocks are read directly.
+    Blocks are memoryviews of those buffers, so a block is only valid until
+    the next one is requested. Use bytes(block) to keep one.
+    '''
+    if block_size is None:
+        block_size = READ_OPTIONS['block_size']
+    if read_ahead is None:
+        read_ahead = READ_OPTIONS['read_ahead']
+    if mode is None:
+        mode = READ_OPTIONS['mode']
+    if mode == 'direct' and (block_size % mmap.PAGESIZE or offset % mmap.PAGESIZE):
+        # O_DIRECT needs aligned reads.
+        mode = 'buffered'
+    fd, mode = _open_for_reading(filename, mode)
+    try:
+        if mode == 'mmap':
+            size = os.fstat(fd).st_size
+            if size <= offset:
+                return
+            mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            try:
+                if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mapped)
+                for position in range(offset, size, block_size):
+                    yield view[position:position + block_size]
+                del view
+            finally:
+                try:
+                    mapped.close()
+                except BufferError:
+                    # the caller still holds the last block, so the map is
+                    # closed when that is garbage collected.
+                    pass
+            return
+        os.lseek(fd, offset, os.SEEK_SET)
+        _fadvise(fd, offset, 0, 'POSIX_FADV_SEQUENTIAL')
+        drop_cache = READ_OPTIONS['drop_cache'] and mode == 'buffered'
+        remaining = os.fstat(fd).st_size - offset
+        buffer_size = block_size
+        if remaining < block_size * READ_AHEAD_MIN_BLOCKS:
+            read_ahead = False
+            # a small file only needs a buffer of its own size, rounded up to
+            # whole pages so that O_DIRECT reads stay aligned.
+            buffer_size = min(block_size, max(remaining // mmap.PAGESIZE + 1, 1) * mmap.PAGESIZE)
+        # anonymous mmaps are page aligned, as O_DIRECT requires.
+        buffers = [mmap.mmap(-1, buffer_size) for _ in range(3 if read_ahead else 1)]
+        def read_block(index, position):
+            '''
+            Reads the next block into a buffer from the ring.
+            '''
+            buf = buffers[index % len(buffers)]
+            if hasattr(os, 'readv'):
+                length = os.readv(fd, [buf])
+            else:
+                data = os.read(fd, len(buf))
+                length = len(data)
+                buf[:length] = data
+            if drop_cache and length:
+                _fadvise(fd, position, length, 'POSIX_FADV_DONTNEED')
+            return memoryview(buf)[:length]
+        if not read_ahead:
+            position = offset
+            while True:
+                block = read_block(0, position)
+                if not block:
+                    break
+                yield block
+                position += len(block)
+            return
+        # With three buffers and a queue of one, the reader thread can fill
+        # one buffer while one waits in the queue and the caller uses the third.
+        blocks = queue.Queue(maxsize=1)
+        stop = threading.Event()
+        def reader():
+            '''
+            Reads blocks ahead of the caller until the end of the file.
+            '''
+            index = 0
+            position = offset
+            try:
+                while not stop.is_set():
+                    block = read_block(index, position)
+                    blocks.put(block)
+                    if not block:
+                        return
+                    index += 1
+                    position += len(block)
+            except Exception as error:
+                blocks.put(error)
+        read_thread = threading.Thread(target=reader)
+        read_thread.daemon = True
+        read_thread.start()
+        try:
+            while True:
+                block = blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                if not block:
+                    break
+                yield block
+        finally:
+            stop.set()
+            # unblock the reader if it is waiting for space in the queue.
+            while read_thread.is_alive():
+                try:
+                    blocks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            read_thread.join()
+    finally:
+        os.close(fd)
+
+
+def copy_blocks(blocks, source_file, destination_file):
+    '''
+    Writes every block from read_blocks() to destination_file as it passes
+    through, so that a file can be copied and hashed with a single read.
+    An existing destination file is never overwritten. The permissions and
+    timestamps of the source are applied when the last block has been
+    written, as with cp --preserve=mode,timestamps
+    The copy is not flushed to disk here, see evict_copy() and evict_copies()
+    '''
+    with open(destination_file, 'xb') as destination_object:
+        try:
+            for buf in blocks:
+                destination_object.write(buf)
+                yield buf
+        finally:
+            blocks.close()
+    source_stat = os.stat(source_file)
+    shutil.copymode(source_file, destination_file)
+    os.utime(destination_file, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+
+def evict_copy(filename, sync=True):
+    '''
+    Drops a copied file from the page cache, so that a later read-back for
+    verification comes from the storage rather than from memory. Only clean
+    pages can be dropped, so the file is flushed to disk first unless sync
+    is False. Nothing is done where posix_fadvise is not available.
+    '''
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        if sync:
+            os.fsync(fd)
+        _fadvise(fd, 0, 0, 'POSIX_FADV_DONTNEED')
+    finally:
+        os.close(fd)
+
+
+def evict_copies(filenames):
+    '''
+    Runs evict_copy() on many files with a single sync of the filesystems
+    instead of one fsync per file, which is much cheaper for trees of small
+    files.
+    '''
+    if not hasattr(os, 'posix_fadvise') or not filenames:
+        return
+    os.sync()
+    for filename in filenames:
+        evict_copy(filename, sync=False)
+
+
+def hashlib_multi(filename, algorithms=('md5',), progress=True, chunk_size=None, copy_to=None):
+    '''
+    Reads a file once and returns a dictionary of checksums for every
+    algorithm requested, eg: {'md5': '...', 'sha512': '...'}
+    Supported algorithms are md5, sha1, sha512 and crc32.
+    progress=True prints rate limited progress for this file, False prints
+    nothing and a shared Progress object is updated after every block.
+    If chunk_size is set, the dictionary also has a 'chunks' list with a
+    CHUNK_ALGORITHM digest of every chunk_size block of the file.
+    If copy_to is set, the file is also copied there in the same pass, see
+    copy_blocks().
+    '''
+    hash_objects = {}
+    crc32 = None
+    chunks = []
+    if chunk_size:
+        chunk_hash = hashlib.new(CHUNK_ALGORITHM)
+        chunk_read = 0
+    for algorithm in algorithms:
+        if algorithm == 'crc32':
+            crc32 = 0
+        else:
+            hash_objects[algorithm] = hashlib.new(algorithm)
+    if FIXITY_CACHE_POLICY != 'off':
+        file_identity = get_file_identity(filename)
+    own_progress = progress is True
+    if own_progress:
+        progress = Progress(
+            os.path.basename(filename), 1, os.path.getsize(filename), summary=False
+        )
+    blocks = read_blocks(filename)
+    if copy_to:
+        blocks = copy_blocks(blocks, filename, copy_to)
+    for buf in blocks:
+        for hash_object in hash_objects.values():
+            hash_object.update(buf)
+        if crc32 is not None:
+            crc32 = zlib.crc32(buf, crc32)
+        if chunk_size:
+            view = buf
+            while view:
+                take = min(len(view), chunk_size - chunk_read)
+                chunk_hash.update(view[:take])
+                chunk_read += take
+                view = view[take:]
+                if chunk_read == chunk_size:
+                    chunks.append(chunk_hash.hexdigest())
+                    chunk_hash = hashlib.new(CHUNK_ALGORITHM)
+                    chunk_read = 0
+        if progress:
+            progress.update(len(buf))
+    if own_progress:
+        progress.file_done()
+        progress.close()
+    checksums = {}
+    for algorithm, hash_object in hash_objects.items():
+        checksums[algorithm] = hash_object.hexdigest()
+    if crc32 is not None:
+        checksums['crc32'] = '%08x' % (crc32 & 0xffffffff)
+    # Files that changed while they were being read are not cached.
+    if FIXITY_CACHE_POLICY != 'off':
+        if get_file_identity(filename) == file_identity:
+            fixity_cache_store(file_identity, filename, checksums)
+    if chunk_size:
+        if chunk_read:
+            chunks.append(chunk_hash.hexdigest())
+        checksums['chunks'] = chunks
+    return checksums
+
+
+def merkle_root(chunks):
+    '''
+    Returns the root of a binary hash tree built from a list of hex chunk
+    digests. Pairs of digests are hashed together, level by level, and an
+    odd digest at the end of a level is carried up unchanged.
+    '''
+    level = [bytes.fromhex(chunk) for chunk in chunks]
+    if not level:
+        return hashlib.new(CHUNK_ALGORITHM).hexdigest()
+    while len(level) > 1:
+        next_level = []
+        for index in range(0, len(level), 2):
+            if index + 1 < len(level):
+                next_level.append(hashlib.new(CHUNK_ALGORITHM, level[index] + level[index + 1]).digest())
+            else:
+                next_level.append(level[index])
+        level = next_level
+    return level[0].hex()
+
+
+def get_chunk_sidecar(manifest_textfile):
+    '''
+    Returns the filename of the chunk checksum sidecar for a manifest,
+    eg: uuid_manifest.md5 -> uuid_manifest_chunks.json
+    '''
+    return os.path.splitext(manifest_textfile)[0] + '_chunks.json'
+
+
+def make_chunk_record(size, chunks):
+    '''
+    Returns the sidecar entry for one file.
+    '''
+    return {'size': size, 'chunks': chunks, 'root': merkle_root(chunks)}
+
+
+def write_chunk_sidecar(manifest_textfile, chunk_records, chunk_size=CHUNK_SIZE):
+    '''
+    Writes a JSON sidecar next to a manifest, listing a digest for every
+    chunk_size block of each file, plus a Merkle root per file.
+    chunk_records is a dictionary of {relative path: make_chunk_record()}.
+    Only files that are bigger than one chunk are worth recording, so
+    nothing is written if there are none, and an old sidecar is removed.
+    Returns the sidecar filename.
+    '''
+    chunk_sidecar = get_chunk_sidecar(manifest_textfile)
+    if not chunk_records:
+        if os.path.isfile(chunk_sidecar):
+            os.remove(chunk_sidecar)
+        return None
+    with open(chunk_sidecar, 'w', encoding='utf-8') as fo:
+        json.dump(
+            {'algorithm': CHUNK_ALGORITHM, 'chunk_size': chunk_size, 'files': chunk_records},
+            fo, indent=4, sort_keys=True
+        )
+    return chunk_sidecar
+
+
+def read_chunk_sidecar(manifest_textfile):
+    '''
+    Returns the contents of the chunk sidecar of a manifest with NFC
+    normalised paths, or None if there is no sidecar.
+    '''
+    chunk_sidecar = get_chunk_sidecar(manifest_textfile)
+    if not os.path.isfile(chunk_sidecar):
+        return None
+    with open(chunk_sidecar, 'r', encoding='utf-8') as fo:
+        chunk_data = json.load(fo)
+    chunk_data['files'] = dict(
+        (unicodedata.normalize('NFC', path), record) for path, record in chunk_data['files'].items()
+    )
+    return chunk_data
+
+
+def compare_chunks(expected_record, chunks, size, chunk_size):
+    '''
+    Compares the chunk digests of a file against its sidecar record.
+    Returns a list of (first byte, last byte) ranges that differ, with
+    neighbouring bad chunks merged into one range.
+    '''
+    expected_chunks = expected_record['chunks']
+    longest = max(size, expected_record['size'])
+    bad_ranges = []
+    for index in range(max(len(chunks), len(expected_chunks))):
+        if index < len(chunks) and index < len(expected_chunks):
+            if chunks[index] == expected_chunks[index]:
+                continue
+        start = index * chunk_size
+        end = min(start + chunk_size, longest) - 1
+        if bad_ranges and bad_ranges[-1][1] == start - 1:
+            bad_ranges[-1] = (bad_ranges[-1][0], end)
+        else:
+            bad_ranges.append((start, end))
+    return bad_ranges
+
+
+def hash_chunks(filename, chunk_size, start_chunk=0, end_chunk=None):
+    '''
+    Yields (chunk index, digest) for every chunk_size block of a file,
+    starting from start_chunk so that interrupted verification can resume
+    part way through a file.
+    '''
+    index = start_chunk
+    chunk_hash = hashlib.new(CHUNK_ALGORITHM)
+    chunk_read = 0
+    blocks = read_blocks(filename, start_chunk * chunk_size)
+    try:
+        for buf in blocks:
+            while buf:
+                take = min(len(buf), chunk_size - chunk_read)
+                chunk_hash.update(buf[:take])
+                chunk_read += take
+                buf = buf[take:]
+                if chunk_read == chunk_size:
+                    yield index, chunk_hash.hexdigest()
+                    index += 1
+                    if end_chunk is not None and index >= end_chunk:
+                        return
+                    chunk_hash = hashlib.new(CHUNK_ALGORITHM)
+                    chunk_read = 0
+        if chunk_read:
+            yield index, chunk_hash.hexdigest()
+    finally:
+        blocks.close()
+
+
+def repair_chunks(good_file, bad_file, bad_ranges):
+    '''
+    Copies only the listed (first byte, last byte) ranges from a good
+    replica over a damaged file, and truncates the damaged file if it has
+    grown. Returns the number of bytes that were copied.
+    '''
+    copied = 0
+    good_size = os.path.getsize(good_file)
+    with open(good_file, 'rb') as good_object, open(bad_file, 'r+b') as bad_object:
+        for start, end in bad_ranges:
+            good_object.seek(start)
+            bad_object.seek(start)
+            remaining = min(end + 1, good_size) - start
+            while remaining > 0:
+                buf = good_object.read(min(2**20, remaining))
+                if not buf:
+                    break
+                bad_object.write(buf)
+                remaining -= len(buf)
+                copied += len(buf)
+        bad_object.truncate(good_size)
+    return copied
+
+
 def hashlib_md5(filename):
     '''
     uses hashlib to return an MD5 checksum of an input filename
     '''
-    read_size = 0
-    last_percent_done = 0
-    m = hashlib.md5()
-    total_size = os.path.getsize(filename)
-    with open(str(filename), 'rb') as f:
-        while True:
-            buf = f.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            m.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    md5_output = m.hexdigest()
-    return md5_output
+    return hashlib_multi(filename, ('md5',))['md5']
 
 
 def hashlib_sha512(filename):
     '''
-    Note, this should eventually merged with the hashlib_md5 function.
     uses hashlib to return an sha512 checksum of an input filename
     '''
-    read_size = 0
-    last_percent_done = 0
-    m = hashlib.sha512()
-    total_size = os.path.getsize(filename)
-    with open(str(filename), 'rb') as f:
-        while True:
-            buf = f.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            m.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    sha512_output = m.hexdigest()
-    return sha512_output
+    return hashlib_multi(filename, ('sha512',))['sha512']
 
 
-def hashlib_manifest(manifest_dir, manifest_textfile, path_to_remove):
+def read_checksum_manifest(manifest):
     '''
-    Creates an MD5 manifest with relative filepaths.
+    Returns a dictionary of relative paths and checksums from a md5 or sha512
+    manifest. Paths are NFC normalised with forward slashes.
+    '''
+    checksums = {}
+    try:
+        with open(manifest, 'r', encoding='utf-8') as manifest_object:
+            manifest_lines = manifest_object.readlines()
+    except UnicodeDecodeError:
+        with open(manifest, 'r', encoding='cp1252') as manifest_object:
+            manifest_lines = manifest_object.readlines()
+    for line in manifest_lines:
+        line = line.rstrip('\r\n')
+        if '  ' not in line:
+            continue
+        checksum, path = line.split('  ', 1)
+        path = unicodedata.normalize('NFC', path).replace('\\', '/')
+        checksums[path] = checksum
+    return checksums
+
+
+def manifest_key(path, repair_cp1252=False):
+    '''
+    Returns the path that is used to match manifest entries: NFC normalised
+    with forward slashes. If repair_cp1252 is True, a UTF-8 path that was
+    decoded as cp1252, eg CafÃ© instead of Café, is decoded again first.
+    '''
+    if repair_cp1252:
+        try:
+            path = path.encode('cp1252').decode('utf-8')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return unicodedata.normalize('NFC', path).replace('\\', '/')
+
+
+def parse_manifest(manifest):
+    '''
+    Returns a dictionary of {manifest_key(path): (checksum, path)}.
+    manifest can be the filename of a md5 or sha512 manifest or a list of
+    manifest lines. Lines without a checksum, eg a list of paths from a
+    storage report, get an empty checksum.
+    '''
+    repair_cp1252 = False
+    if isinstance(manifest, str):
+        try:
+            with open(manifest, 'r', encoding='utf-8') as manifest_object:
+                manifest = manifest_object.read().splitlines()
+        except UnicodeDecodeError:
+            repair_cp1252 = True
+            with open(manifest, 'r', encoding='cp1252') as manifest_object:
+                manifest = manifest_object.read().splitlines()
+    entries = {}
+    for line in manifest:
+        line = line.rstrip('\r\n')
+        if not line:
+            continue
+        if '  ' in line:
+            checksum, path = line.split('  ', 1)
+        else:
+            checksum, path = '', line
+        entries[manifest_key(path, repair_cp1252)] = (checksum, path)
+    return entries
+
+
+def diff_manifests(source_manifest, destination_manifest, compare_checksums=True):
+    '''
+    Compares two manifests in linear time. Each can be a manifest filename
+    or a list of lines, see parse_manifest().
+    Returns a ManifestDiff of sorted lists:
+    missing - (path, checksum) in the source but not the destination.
+    extra - (path, checksum) in the destination but not the source.
+    mismatched - (path, source checksum, destination checksum).
+    encoding_only - (source path, destination path) for files with the same
+    checksum whose paths only differ in Unicode normalisation, slashes or
+    text encoding, eg NFD filenames from OSX or a cp1252 manifest.
+    If compare_checksums is False, only the paths are compared.
+    '''
+    source = parse_manifest(source_manifest)
+    destination = parse_manifest(destination_manifest)
+    missing = []
+    mismatched = []
+    encoding_only = []
+    for key, (source_checksum, source_path) in source.items():
+        if key not in destination:
+            missing.append((source_path, source_checksum))
+            continue
+        destination_checksum, destination_path = destination[key]
+        if compare_checksums and source_checksum.lower() != destination_checksum.lower():
+            mismatched.append((source_path, source_checksum, destination_checksum))
+        elif source_path != destination_path:
+            encoding_only.append((source_path, destination_path))
+    extra = [
+        (path, checksum) for key, (checksum, path) in destination.items()
+        if key not in source
+    ]
+    return ManifestDiff(
+        sorted(missing), sorted(extra), sorted(mismatched), sorted(encoding_only)
+    )
+
+
+def make_inventory(source, excluded_directories=()):
+    '''
+    Walks a directory once with os.scandir and returns a list of
+    InventoryEntry(path, size, mtime_ns, inode, device) tuples for every file.
+    Hidden files and folders are skipped, as are folders with a name in
+    excluded_directories, eg: EXCLUDED_DIRECTORIES when copyit.py ingests
+    a drive.
+    If source is a file, the inventory contains that single file.
+    Counting files, summing sizes and generating manifests should all use the
+    same inventory rather than walking the tree again.
     '''
-    file_count = 0
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            #print(" - Calculating number of files to process in current directory -  %s files        \r "% file_count)
-            print("- Calculating number of files to process in current directory - {0} files ".format(file_count), end="\r")
-            file_count += 1
-    manifest_generator = ''
-    md5_counter = 1
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if f[0] != '.']
-        directories[:] = [d for d in directories if d[0] != '.']
-        for files in filenames:
-            print(' - Generating MD5 for %s - file %d of %d' % (os.path.join(root, files), md5_counter, file_count))
-            md5 = hashlib_md5(os.path.join(root, files))
-            print(md5)
-            md5_counter += 1
-            root2 = os.path.abspath(root).replace(path_to_remove, '')
+    inventory = []
+    if os.path.isfile(source):
+        file_stat = os.stat(source)
+        inventory.append(InventoryEntry(
+            source, file_stat.st_size, file_stat.st_mtime_ns,
+            file_stat.st_ino, file_stat.st_dev
+        ))
+        return inventory
+    directories = [source]
+    while directories:
+        directory = directories.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name[0] == '.':
+                continue
             try:
-                if root2[0] == '/':
-                    root2 = root2[1:]
-                if root2[0] == '\\':
-                    root2 = root2[1:]
-            except: IndexError
-            manifest_generator += md5[:32] + '  ' + os.path.join(root2, files).replace("\\", "/") + '\n'
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "w", encoding='utf-8') as fo:
-        for i in manifest_list:
-            fo.write((unicodedata.normalize('NFC', i) + '\n'))
-
-def sha512_manifest(manifest_dir, manifest_textfile, path_to_remove):
-    '''
-    Note: This should be merged with hashlib_manifest()
-    Creates a sha512 manifest with relative filepaths.
+                if entry.is_dir():
+                    # Like os.walk, symlinked folders are not followed.
+                    if entry.name not in excluded_directories and not entry.is_symlink():
+                        directories.append(entry.path)
+                    continue
+                file_stat = entry.stat()
+            except OSError:
+                continue
+            inventory.append(InventoryEntry(
+                entry.path, file_stat.st_size, file_stat.st_mtime_ns,
+                file_stat.st_ino, file_stat.st_dev
+            ))
+    return inventory
+
+
+class DeviceLimiter(object):
+    '''
+    Caps how many files are read at the same time from any single storage
+    device (st_dev). One limiter can be shared by several hash_files() calls,
+    eg batchvalidate.py validating several packages at once, so that they
+    all stay within one I/O budget.
+    '''
+    def __init__(self, device_workers=None):
+        if device_workers is None:
+            device_workers = HASH_WORKERS_PER_DEVICE
+        self.device_workers = device_workers
+        self.device_locks = {}
+        self.device_locks_lock = threading.Lock()
+
+    def get_lock(self, filename):
+        '''
+        Returns the semaphore for the device that filename is stored on.
+        '''
+        device = os.stat(filename).st_dev
+        with self.device_locks_lock:
+            if device not in self.device_locks:
+                self.device_locks[device] = threading.BoundedSemaphore(self.device_workers)
+            return self.device_locks[device]
+
+
+def set_stage_limits(limits):
+    '''
+    Sets the semaphores that stage() waits on, eg:
+    {'io': [semaphore, ...], 'tools': semaphore}. batchsipcreator.py shares
+    them between its worker processes, so that only a few of them copy or
+    hash on the same drive at the same time, and only a few run metadata
+    tools at the same time. A list, eg: one semaphore for each drive that
+    a job reads or writes, is acquired in order.
+    '''
+    _stage_limits.update(limits)
+
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Waits for a free slot for a named stage of a job: 'io' for copying and
+    hashing, 'tools' for mediainfo, siegfried and exiftool.
+    This does nothing unless a limit was set with set_stage_limits().
+    '''
+    semaphores = _stage_limits.get(name)
+    if semaphores is None:
+        yield
+        return
+    if not isinstance(semaphores, (list, tuple)):
+        semaphores = [semaphores]
+    with contextlib.ExitStack() as stack:
+        for semaphore in semaphores:
+            stack.enter_context(semaphore)
+        yield
+
+
+class AdaptiveLimiter(object):
+    '''
+    Caps how many jobs, eg: file copies, run at the same time and tunes the
+    cap to the throughput that is observed. Every window seconds, the bytes
+    finished in that window are compared with the previous window. The cap
+    keeps moving in the same direction while throughput improves and turns
+    around when it drops, so it settles near the best level of concurrency
+    for the storage, between minimum and maximum.
+    Jobs call acquire() before they start and release(nbytes) when they end.
+    '''
+    def __init__(self, maximum, minimum=1, start=None, window=None):
+        if start is None:
+            start = minimum
+        if window is None:
+            window = ADAPTIVE_WINDOW_SECONDS
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = min(max(start, minimum), self.maximum)
+        self.peak = self.limit
+        self.window = window
+        self.condition = threading.Condition()
+        self.active = 0
+        self.direction = 1
+        self.last_rate = None
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def acquire(self):
+        '''
+        Waits until fewer than limit jobs are running.
+        '''
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, nbytes=0):
+        '''
+        Records a finished job and adjusts the limit at the end of a window.
+        '''
+        with self.condition:
+            self.active -= 1
+            self.window_bytes += nbytes
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                rate = self.window_bytes / (now - self.window_start)
+                if self.last_rate is not None and rate < self.last_rate:
+                    self.direction = -self.direction
+                self.limit = min(max(self.limit + self.direction, self.minimum), self.maximum)
+                self.peak = max(self.peak, self.limit)
+                self.last_rate = rate
+                self.window_start = now
+                self.window_bytes = 0
+            self.condition.notify_all()
+
+
+def hash_files(file_list, algorithms=('md5',), workers=None, device_workers=None, ordered=False, device_limiter=None, chunk_size=None, progress=None):
+    '''
+    Hashes a list of files with a pool of threads and yields
+    (filename, checksums) tuples in the order that they finish, or in the
+    order of file_list if ordered is True.
+    hashlib releases the GIL, so several files can be read and hashed at once.
+    workers is the size of the pool and device_workers caps how many files
+    are read at the same time from any single storage device (st_dev).
+    A DeviceLimiter can be passed instead of device_workers to share the cap
+    with other calls. With one worker, files are hashed in order in the
+    current thread. chunk_size is passed on to hashlib_multi().
+    If a Progress object is passed, it is updated as files are read.
+    '''
+    if workers is None:
+        workers = HASH_WORKERS
+    def hash_file(filename):
+        checksums = hashlib_multi(filename, algorithms, progress=progress or False, chunk_size=chunk_size)
+        if progress:
+            progress.file_done()
+        return filename, checksums
+    if workers <= 1:
+        for filename in file_list:
+            yield hash_file(filename)
+        return
+    if device_limiter is None:
+        device_limiter = DeviceLimiter(device_workers)
+    def hash_on_device(filename):
+        with device_limiter.get_lock(filename):
+            return hash_file(filename)
+    # Only a few jobs are queued ahead of the pool, so memory does not grow
+    # with the number of files. If the caller stops early, eg a fail-fast
+    # validation, the queued jobs are cancelled.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        if ordered:
+            pending = collections.deque()
+        else:
+            pending = set()
+        try:
+            for filename in file_list:
+                future = executor.submit(hash_on_device, filename)
+                if ordered:
+                    pending.append(future)
+                    if len(pending) >= workers * 4:
+                        yield pending.popleft().result()
+                else:
+                    pending.add(future)
+                    if len(pending) >= workers * 4:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            yield future.result()
+            if ordered:
+                while pending:
+                    yield pending.popleft().result()
+            else:
+                for future in concurrent.futures.as_completed(pending):
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class ManifestWriter(object):
+    '''
+    Writes checksum manifest lines sorted by path, with bounded memory.
+    Lines are added in any order with add(). Every run_size lines, the
+    current batch is sorted and spilled to a temporary file. close() merges
+    the sorted runs into manifest_textfile, so the output is identical to
+    sorting every line in memory, but memory does not grow with file count.
+    Lines are NFC normalised on output unless normalise=False.
+    '''
+    def __init__(self, manifest_textfile, mode='w', normalise=True, run_size=None):
+        self.manifest_textfile = manifest_textfile
+        self.mode = mode
+        self.normalise = normalise
+        if run_size is None:
+            run_size = MANIFEST_SORT_RUN_SIZE
+        self.run_size = run_size
+        self.batch = []
+        self.runs = []
+        self.count = 0
+
+    @staticmethod
+    def path_key(line):
+        '''
+        Manifests are sorted by path, which follows the two spaces.
+        http://stackoverflow.com/a/31306961/2188572
+        '''
+        return line.split('  ', 1)[1]
+
+    def add(self, line):
+        '''
+        Adds a checksum + two spaces + path line, without a line ending.
+        '''
+        self.batch.append(line)
+        self.count += 1
+        if len(self.batch) >= self.run_size:
+            self.spill()
+
+    def spill(self):
+        '''
+        Sorts the current batch and writes it to a temporary run file.
+        '''
+        self.batch.sort(key=self.path_key)
+        run = tempfile.mkstemp(suffix='_manifest_run.txt')
+        os.close(run[0])
+        with open(run[1], 'w', encoding='utf-8', newline='\n') as run_object:
+            for line in self.batch:
+                run_object.write(line + '\n')
+        self.runs.append(run[1])
+        self.batch = []
+
+    def close(self):
+        '''
+        Merges all sorted runs into the manifest and removes the runs.
+        Returns the number of lines written.
+        '''
+        self.batch.sort(key=self.path_key)
+        run_objects = []
+        try:
+            for run in self.runs:
+                run_objects.append(open(run, 'r', encoding='utf-8', newline='\n'))
+            sorted_runs = [(line[:-1] for line in run_object) for run_object in run_objects]
+            sorted_runs.append(iter(self.batch))
+            with open(self.manifest_textfile, self.mode, encoding='utf-8') as fo:
+                for line in heapq.merge(*sorted_runs, key=self.path_key):
+                    if self.normalise:
+                        line = unicodedata.normalize('NFC', line)
+                    fo.write(line + '\n')
+        finally:
+            for run_object in run_objects:
+                run_object.close()
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+            self.batch = []
+        return self.count
+
+
+class HashJournal(object):
+    '''
+    A journal of files that have already been hashed during a long run, so
+    that the run can be restarted after a crash, reboot or dropped network
+    share without starting from scratch.
+    Each entry is a JSON line with the path, size, mtime and checksums of a
+    file. Entries are flushed to disk every JOURNAL_FLUSH_SECONDS.
+    If a journal is found for the same target, its entries are loaded and
+    lookup() returns the journaled checksums for files whose size and mtime
+    have not changed since. close() removes the journal once the run is done.
+    '''
+    def __init__(self, target, purpose):
+        journal_dir = os.path.join(make_desktop_logs_dir(), 'journals')
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir)
+        target_id = hashlib.md5(os.path.abspath(target).encode('utf-8')).hexdigest()[:12]
+        self.journal_file = os.path.join(
+            journal_dir, '%s_%s_%s.journal' % (os.path.basename(target), target_id, purpose)
+        )
+        self.entries = {}
+        if os.path.isfile(self.journal_file):
+            with open(self.journal_file, 'r', encoding='utf-8') as fo:
+                for line in fo:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be incomplete if the run was killed.
+                        continue
+                    self.entries[entry['path']] = entry
+        self.resumed = len(self.entries)
+        # How reused checksums are described in manifest summaries.
+        self.reuse_detail = 'from the journal of an interrupted run'
+        self.journal_object = open(self.journal_file, 'a', encoding='utf-8')
+        self.last_flush = time.time()
+
+    def lookup(self, filename, keys):
+        '''
+        Returns the journaled checksums for a file if its size and mtime
+        have not changed and every checksum in keys was recorded.
+        Otherwise returns None and the file should be hashed again.
+        '''
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        file_stat = os.stat(filename)
+        if (file_stat.st_size, file_stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+            return None
+        for key in keys:
+            if key not in entry['checksums']:
+                return None
+        return entry['checksums']
+
+    def record(self, filename, checksums):
+        '''
+        Adds a hashed file to the journal.
+        '''
+        file_stat = os.stat(filename)
+        entry = {
+            'path': filename, 'size': file_stat.st_size,
+            'mtime_ns': file_stat.st_mtime_ns, 'checksums': checksums
+        }
+        self.entries[filename] = entry
+        self.journal_object.write(json.dumps(entry) + '\n')
+        if time.time() - self.last_flush > JOURNAL_FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        '''
+        Forces journaled entries to disk.
+        '''
+        self.journal_object.flush()
+        os.fsync(self.journal_object.fileno())
+        self.last_flush = time.time()
+
+    def close(self, remove=True):
+        '''
+        Closes and removes the journal, as the run has finished.
+        If remove is False, the journal is kept for the next step of the
+        run to pick up, eg: a resumed copy hands it on to the destination
+        manifest.
+        '''
+        self.journal_object.close()
+        if remove:
+            os.remove(self.journal_file)
+
+
+def open_hash_journal(target, purpose, log_name_source=None):
+    '''
+    Opens the HashJournal for a target and logs it if an interrupted run
+    is being resumed.
     '''
-    file_count = 0
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print(" - Calculating number of files to process in current directory -  %s files        \r"% file_count,)
-            file_count += 1
-    manifest_generator = ''
-    md5_counter = 1
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if f[0] != '.']
-        directories[:] = [d for d in directories if d[0] != '.']
-        for files in filenames:
-            print(' - Generating SHA512 for %s - file %d of %d' % (os.path.join(root, files), md5_counter, file_count))
-            sha512 = hashlib_sha512(os.path.join(root, files))
-            print(sha512)
-            md5_counter += 1
-            root2 = os.path.abspath(root).replace(path_to_remove, '')
+    journal = HashJournal(target, purpose)
+    if journal.resumed:
+        print(' - Resuming an interrupted run - %s files were already hashed' % journal.resumed)
+        if log_name_source:
+            generate_log(
+                log_name_source,
+                'EVENT = message digest calculation - eventDetail=Resuming an interrupted run from %s. %s journaled files are only hashed again if their size or modification time has changed' % (journal.journal_file, journal.resumed)
+            )
+    return journal
+
+
+class HashPipeline(object):
+    '''
+    Hashes files in background threads as soon as they are added, eg: each
+    file that copyit.py has finished copying, so that reading back and
+    hashing the destination overlaps with the rest of the copy.
+    Checksums are recorded in a HashJournal, and the manifest is written
+    from the journal once everything has been copied. Files that cannot be
+    hashed here are left out of the journal and hashed with the manifest.
+    '''
+    def __init__(self, journal, algorithms=('md5',), chunk_size=None, workers=1):
+        self.journal = journal
+        if not journal.resumed:
+            journal.reuse_detail = 'that were calculated while copying'
+        self.algorithms = algorithms
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.hashed = 0
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def add(self, filename):
+        '''
+        Queues a file that is complete to be hashed.
+        '''
+        self.queue.put(filename)
+
+    def run(self):
+        '''
+        Hashes queued files until close() is called.
+        '''
+        while True:
+            filename = self.queue.get()
+            if filename is None:
+                return
             try:
-                if root2[0] == '/':
-                    root2 = root2[1:]
-                if root2[0] == '\\':
-                    root2 = root2[1:]
-            except: IndexError
-            manifest_generator += sha512[:128] + '  ' + os.path.join(root2, files).replace("\\", "/") + '\n'
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[130:]))
-    with open(manifest_textfile, "w", encoding='utf-8') as fo:
-        for i in manifest_list:
-            fo.write((unicodedata.normalize('NFC', i) + '\n'))
-
-
-def hashlib_append(manifest_dir, manifest_textfile, path_to_remove):
+                checksums = hashlib_multi(
+                    filename, self.algorithms, progress=False,
+                    chunk_size=self.chunk_size
+                )
+            except OSError as e:
+                print(' - %s could not be hashed while copying, it will be hashed again: %s' % (filename, e))
+                continue
+            with self.lock:
+                self.journal.record(filename, checksums)
+                self.hashed += 1
+
+    def close(self):
+        '''
+        Waits for every queued file to be hashed and returns the number of
+        files that were hashed.
+        '''
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.journal.flush()
+        return self.hashed
+
+
+def get_relative_path(full_path, path_to_remove):
+    '''
+    Returns the manifest style relative path of a file, with forward slashes.
+    '''
+    root, files = os.path.split(full_path)
+    root2 = os.path.abspath(root).replace(path_to_remove, '')
+    try:
+        if root2[0] == '/':
+            root2 = root2[1:]
+        if root2[0] == '\\':
+            root2 = root2[1:]
+    except: IndexError
+    return os.path.join(root2, files).replace("\\", "/")
+
+
+def make_checksum_manifest(
+        manifest_dir, manifest_textfile, path_to_remove,
+        algorithm='md5', mode='w', known_checksums=None, workers=None,
+        log_name_source=None, inventory=None, chunk_size=None, journal=None
+    ):
+    '''
+    Creates an md5 or sha512 manifest with relative filepaths.
+    Files are hashed in parallel via hash_files() and streamed through a
+    ManifestWriter, which sorts by path and NFC normalises, so the output is
+    identical to a serial run.
+    mode='a' appends the sorted entries to an existing manifest.
+    known_checksums is an optional dictionary of relative paths and checksums
+    that were already calculated, eg: by copyit.py at copy time.
+    Files found in this dictionary are not read again.
+    Manifests are derived data, so the fixity cache is consulted if the
+    derived policy is set. Cache hits are recorded in log_name_source.
+    An inventory from make_inventory() can be passed in to avoid another walk.
+    If chunk_size is set, chunk digests of every hashed file that is bigger
+    than one chunk are written to a sidecar via write_chunk_sidecar().
+    If a HashJournal is passed, every hashed file is journaled and files
+    that were journaled by an interrupted run are not read again.
+    '''
+    if known_checksums is None:
+        known_checksums = {}
+    chunk_records = {}
+    if inventory is None:
+        inventory = make_inventory(manifest_dir)
+    file_count = len(inventory)
+    manifest_writer = ManifestWriter(manifest_textfile, mode)
+    progress = Progress(
+        'Generating %s manifest' % algorithm.upper(), file_count,
+        sum(entry.size for entry in inventory)
+    )
+    reused = collections.Counter()
+    journal_keys = [algorithm]
+    if chunk_size:
+        journal_keys.append('chunks')
+    def add_checksums(full_path, checksums):
+        '''
+        Adds a line to the manifest and, if needed, to the chunk sidecar.
+        '''
+        relative_path = get_relative_path(full_path, path_to_remove)
+        manifest_writer.add(checksums[algorithm] + '  ' + relative_path)
+        if chunk_size and len(checksums['chunks']) > 1:
+            chunk_records[unicodedata.normalize('NFC', relative_path)] = make_chunk_record(
+                os.path.getsize(full_path), checksums['chunks']
+            )
+    def files_to_hash():
+        '''
+        Adds known and cached checksums to the manifest and yields the rest.
+        '''
+        for entry in inventory:
+            full_path = entry.path
+            relative_path = get_relative_path(full_path, path_to_remove)
+            if unicodedata.normalize('NFC', relative_path) in known_checksums:
+                checksum = known_checksums[unicodedata.normalize('NFC', relative_path)]
+                manifest_writer.add(checksum + '  ' + relative_path)
+                reused['calculated at copy time'] += 1
+                progress.file_done(entry.size, read=False)
+                continue
+            checksum = fixity_cache_lookup(full_path, algorithm)
+            if checksum is not None:
+                if log_name_source:
+                    generate_log(
+                        log_name_source,
+                        'EVENT = message digest calculation - eventDetail=%s checksum taken from fixity cache, file unchanged since it was last hashed, eventOutcome=%s %s' % (algorithm, checksum, full_path)
+                    )
+                manifest_writer.add(checksum + '  ' + relative_path)
+                reused['from the fixity cache'] += 1
+                progress.file_done(entry.size, read=False)
+                continue
+            if journal is not None:
+                checksums = journal.lookup(full_path, journal_keys)
+                if checksums is not None:
+                    add_checksums(full_path, checksums)
+                    reused['from the journal of an interrupted run'] += 1
+                    progress.file_done(entry.size, read=False)
+                    continue
+            yield full_path
+    for full_path, checksums in hash_files(files_to_hash(), (algorithm,), workers, chunk_size=chunk_size, progress=progress):
+        add_checksums(full_path, checksums)
+        if journal is not None:
+            journal.record(full_path, checksums)
+    progress.close()
+    for source, count in sorted(reused.items()):
+        print(' - Reused %s %s checksums %s' % (count, algorithm.upper(), source))
+    if log_name_source and reused['calculated at copy time']:
+        generate_log(
+            log_name_source,
+            'EVENT = message digest calculation - eventDetail=%s %s checksums calculated at copy time by copyit.py were reused and not recalculated' % (reused['calculated at copy time'], algorithm)
+        )
+    manifest_writer.close()
+    if chunk_size:
+        write_chunk_sidecar(manifest_textfile, chunk_records, chunk_size)
+    return file_count
+
+
+def hashlib_manifest(manifest_dir, manifest_textfile, path_to_remove, workers=None, log_name_source=None, inventory=None, chunk_size=None, journal=None):
+    '''
+    Creates an MD5 manifest with relative filepaths.
+    '''
+    return make_checksum_manifest(
+        manifest_dir, manifest_textfile, path_to_remove, 'md5', workers=workers,
+        log_name_source=log_name_source, inventory=inventory, chunk_size=chunk_size,
+        journal=journal
+    )
+
+
+def sha512_manifest(manifest_dir, manifest_textfile, path_to_remove, known_checksums=None, workers=None, log_name_source=None, inventory=None, chunk_size=None, journal=None):
+    '''
+    Creates a sha512 manifest with relative filepaths.
+    known_checksums is an optional dictionary of relative paths and sha512
+    values that were already calculated, for example by copyit.py at copy time.
+    '''
+    return make_checksum_manifest(
+        manifest_dir, manifest_textfile, path_to_remove, 'sha512',
+        known_checksums=known_checksums, workers=workers,
+        log_name_source=log_name_source, inventory=inventory, chunk_size=chunk_size,
+        journal=journal
+    )
+
+
+def get_objects_sha512(sip_path):
+    '''
+    Returns a dictionary of the sha512 checksums that copyit.py calculated at
+    copy time. sipcreator.py moves these sidecars into the logs folder.
+    Keys are relative to the parent of sip_path, eg: uuid/objects/file.mkv,
+    so the dictionary can be passed to sha512_manifest() as known_checksums.
+    A value is only reused if it can be tied to the current file: the md5
+    that copyit.py calculated in the same pass must match the package
+    manifest, and the file must not have been modified after the sidecar
+    was written. Other files, eg: renamed or edited files, are skipped.
+    '''
+    uuid = os.path.basename(sip_path)
+    logs_dir = os.path.join(sip_path, 'logs')
+    package_manifest = os.path.join(os.path.dirname(sip_path), uuid + '_manifest.md5')
+    known_checksums = {}
+    if not os.path.isdir(logs_dir) or not os.path.isfile(package_manifest):
+        return known_checksums
+    package_md5 = read_checksum_manifest(package_manifest)
+    for filename in sorted(os.listdir(logs_dir)):
+        if not filename.endswith('_manifest-sha512.txt'):
+            continue
+        sha512_sidecar = os.path.join(logs_dir, filename)
+        md5_sidecar = sha512_sidecar.replace('_manifest-sha512.txt', '_manifest.md5')
+        if not os.path.isfile(md5_sidecar):
+            continue
+        sidecar_mtime = os.stat(sha512_sidecar).st_mtime_ns
+        copy_md5 = read_checksum_manifest(md5_sidecar)
+        for path, checksum in read_checksum_manifest(sha512_sidecar).items():
+            package_path = uuid + '/objects/' + path
+            full_path = os.path.join(os.path.dirname(sip_path), package_path)
+            if not os.path.isfile(full_path):
+                continue
+            if copy_md5.get(path) is None or copy_md5[path].lower() != package_md5.get(package_path, '').lower():
+                continue
+            if os.stat(full_path).st_mtime_ns > sidecar_mtime:
+                continue
+            known_checksums[package_path] = checksum
+    return known_checksums
+
+
+def hashlib_append(manifest_dir, manifest_textfile, path_to_remove, workers=None, log_name_source=None, inventory=None):
     '''
     Lazy rehash of hashlib_manifest, except this just adds files to an existing manifest.
     '''
-    file_count = 0
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print(" - Calculating number of files to process in current directory -  %s files        \r"% file_count,)
-            file_count += 1
-    manifest_generator = ''
-    md5_counter = 1
-    for root, directories, filenames in os.walk(manifest_dir):
-        filenames = [f for f in filenames if not f[0] == '.']
-        directories[:] = [d for d in directories if not d[0] == '.']
-        for files in filenames:
-            print(' - Generating MD5 for %s - file %d of %d' % (os.path.join(root, files), md5_counter, file_count))
-            md5 = hashlib_md5(os.path.join(root, files))
-            md5_counter += 1
-            root2 = os.path.abspath(root).replace(path_to_remove, '')
-            try:
-                if root2[0] == '/':
-                    root2 = root2[1:]
-                if root2[0] == '\\':
-                    root2 = root2[1:]
-            except: IndexError
-            manifest_generator += md5[:32] + '  ' + os.path.join(root2, files).replace("\\", "/") + '\n'
-    manifest_list = manifest_generator.splitlines()
-    files_in_manifest = len(manifest_list)
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest_textfile, "a", encoding='utf-8') as fo:
-        for i in manifest_list:
-            fo.write((unicodedata.normalize('NFC', i) + '\n'))
+    return make_checksum_manifest(
+        manifest_dir, manifest_textfile, path_to_remove, 'md5', mode='a', workers=workers,
+        log_name_source=log_name_source, inventory=inventory
+    )
 
 
 def make_manifest(manifest_dir, relative_manifest_path, manifest_textfile):
@@ -1092,73 +2696,229 @@ def ask_yes_no(question):
             return 'N'
 
 
+class Manifest(object):
+    '''
+    A checksum manifest that is read once into a dictionary of
+    {relative path: checksum}, so that a batch of additions, removals,
+    renames and re-hashes can be applied before it is written back once.
+    Files that are added or re-hashed are only hashed when the manifest is
+    saved, so that a log can be added early and still get its final checksum.
+    save() writes to a temporary file in the same folder and renames it over
+    the original, so an interrupted update never leaves a half written manifest.
+    Manifests that are not valid UTF-8 are read as cp1252, as older Windows
+    manifests are, and written back in the same encoding.
+    '''
+    def __init__(self, manifest_textfile, algorithm=None):
+        self.manifest_textfile = manifest_textfile
+        if algorithm is None:
+            if 'sha512' in os.path.basename(manifest_textfile):
+                algorithm = 'sha512'
+            else:
+                algorithm = 'md5'
+        self.algorithm = algorithm
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.encoding = 'utf-8'
+        try:
+            with open(manifest_textfile, 'r', encoding='utf-8') as fo:
+                manifest_lines = fo.readlines()
+        except UnicodeDecodeError:
+            self.encoding = 'cp1252'
+            with open(manifest_textfile, 'r', encoding='cp1252') as fo:
+                manifest_lines = fo.readlines()
+        for line in manifest_lines:
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            if '  ' in line:
+                checksum, path = line.split('  ', 1)
+            else:
+                checksum, path = '', line
+            self.entries[path] = checksum
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def paths(self):
+        '''
+        Returns the relative paths in the manifest.
+        '''
+        return list(self.entries.keys())
+
+    def get_line(self, path):
+        '''
+        Returns the manifest line for a relative path, without a newline.
+        '''
+        return self.entries[path] + '  ' + path
+
+    def add(self, filename, relative_path=None):
+        '''
+        Queues a file to be hashed and added to the manifest on save().
+        By default the relative path starts three folders up from the file,
+        eg uuid/objects/file.mov or uuid/logs/uuid_sip_log.log.
+        An existing entry for the same path is replaced.
+        '''
+        if relative_path is None:
+            path_to_remove = os.path.dirname(os.path.dirname(os.path.dirname(filename)))
+            relative_path = get_relative_path(os.path.abspath(filename), path_to_remove)
+        if relative_path not in self.entries:
+            self.entries[relative_path] = ''
+        self.pending[relative_path] = filename
+        return relative_path
+
+    def rehash(self, filename):
+        '''
+        Queues new checksums for every entry whose path contains the
+        basename of filename, eg a logfile that has been appended to.
+        Returns False if there is no matching entry.
+        '''
+        change = False
+        for path in self.entries:
+            if os.path.basename(filename) in path:
+                self.pending[path] = filename
+                change = True
+        return change
+
+    def remove(self, text):
+        '''
+        Removes every entry whose manifest line contains text.
+        Returns the removed lines.
+        '''
+        removed = []
+        for path in [path for path in self.entries if text in self.get_line(path)]:
+            removed.append(self.get_line(path))
+            del self.entries[path]
+            self.pending.pop(path, None)
+        return removed
+
+    def rename(self, old_path, new_path):
+        '''
+        Replaces old_path with new_path in every path that contains it.
+        Returns the number of entries that changed. Raises ValueError, and
+        changes nothing, if a renamed path would replace another entry.
+        '''
+        renamed = collections.OrderedDict()
+        new_paths = {}
+        for path, checksum in self.entries.items():
+            new = path
+            if old_path in path:
+                new = path.replace(old_path, new_path)
+                new_paths[path] = new
+            if new in renamed:
+                raise ValueError(
+                    'Renaming %s to %s in %s would merge two entries into %s' % (
+                        old_path, new_path, self.manifest_textfile, new
+                    )
+                )
+            renamed[new] = checksum
+        # Rebuilt in one pass, as a new path can be another entry's old path.
+        self.pending = dict(
+            (new_paths.get(path, path), filename)
+            for path, filename in self.pending.items()
+        )
+        self.entries = renamed
+        return len(new_paths)
+
+    def hash_pending(self, workers=None, known_checksums=None):
+        '''
+        Hashes all queued files. known_checksums is an optional
+        {filename: {algorithm: checksum}} dictionary of digests that have
+        already been calculated for these files.
+        '''
+        if known_checksums is None:
+            known_checksums = {}
+        filenames = set(self.pending.values()) - set(known_checksums)
+        progress = Progress(
+            'Hashing', len(filenames),
+            sum(os.path.getsize(filename) for filename in filenames), summary=False
+        )
+        for filename, checksums in hash_files(sorted(filenames), (self.algorithm,), workers, progress=progress):
+            known_checksums[filename] = checksums
+        progress.close()
+        for path, filename in self.pending.items():
+            self.entries[path] = known_checksums[filename][self.algorithm]
+        self.pending = {}
+
+    def save(self, sort=False, normalise=False, workers=None):
+        '''
+        Hashes any queued files and then atomically writes the manifest.
+        With sort=True, lines are sorted by path and with normalise=True,
+        lines are written in Unicode NFC form.
+        '''
+        self.hash_pending(workers)
+        paths = list(self.entries.keys())
+        if sort:
+            paths.sort()
+        manifest_dir = os.path.dirname(os.path.abspath(self.manifest_textfile))
+        file_descriptor, temp_manifest = tempfile.mkstemp(
+            dir=manifest_dir, prefix='.' + os.path.basename(self.manifest_textfile)
+        )
+        try:
+            with os.fdopen(file_descriptor, 'w', encoding=self.encoding) as fo:
+                for path in paths:
+                    line = self.get_line(path)
+                    if normalise:
+                        line = unicodedata.normalize('NFC', line)
+                    fo.write(line + '\n')
+            shutil.copymode(self.manifest_textfile, temp_manifest)
+            os.replace(temp_manifest, self.manifest_textfile)
+        except:
+            if os.path.isfile(temp_manifest):
+                os.remove(temp_manifest)
+            raise
+
+
+def save_manifests(manifests, sort=False, normalise=False, workers=None):
+    '''
+    Saves several Manifest objects, eg the md5 and sha512 manifests of a
+    package, hashing each queued file only once for all of them.
+    '''
+    file_list = set()
+    algorithms = set()
+    for manifest in manifests:
+        file_list.update(manifest.pending.values())
+        algorithms.add(manifest.algorithm)
+    known_checksums = {}
+    progress = Progress(
+        'Hashing', len(file_list),
+        sum(os.path.getsize(filename) for filename in file_list), summary=False
+    )
+    for filename, checksums in hash_files(sorted(file_list), sorted(algorithms), workers, progress=progress):
+        known_checksums[filename] = checksums
+    progress.close()
+    for manifest in manifests:
+        manifest.hash_pending(workers, known_checksums)
+        manifest.save(sort, normalise, workers)
+
+
 def manifest_replace(manifest, to_be_replaced, replaced_with):
     '''
-    Replace strings in a checksum manifest (or any textfile)
-    Ideally, this should never replace the checksum, just a path alteration.
-    Although this could be useful for changing the logs checksum value.
+    Replace strings in the paths of a checksum manifest.
     '''
-    with open(manifest, 'r') as fo:
-        original_lines = fo.readlines()
-    with open(manifest, 'w') as ba:
-        for lines in original_lines:
-            new_lines = lines.replace(to_be_replaced, replaced_with)
-            ba.write(new_lines)
+    package_manifest = Manifest(manifest)
+    package_manifest.rename(to_be_replaced, replaced_with)
+    package_manifest.save()
 
 
 def manifest_update(manifest, path):
     '''
     Adds a new entry to your manifest and sort.
     '''
-    manifest_generator = ''
-    with open(manifest, 'r', encoding='utf-8') as fo:
-        original_lines = fo.readlines()
-        md5 = hashlib_md5(path)
-        path_to_remove = os.path.dirname(os.path.dirname(os.path.dirname(path)))
-        root2 = os.path.abspath(path).replace(path_to_remove, '')
-        try:
-            if root2[0] == '/':
-                root2 = root2[1:]
-            if root2[0] == '\\':
-                root2 = root2[1:]
-        except: IndexError
-        manifest_generator += md5[:32] + '  ' + root2.replace("\\", "/") + '\n'
-        for i in original_lines:
-            manifest_generator += i
-    manifest_list = manifest_generator.splitlines()
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[34:]))
-    with open(manifest, "w", encoding='utf-8') as fo:
-        for i in manifest_list:
-            fo.write((unicodedata.normalize('NFC', i) + '\n'))
+    package_manifest = Manifest(manifest, 'md5')
+    package_manifest.add(path)
+    package_manifest.save(sort=True, normalise=True)
 
 
 def sha512_update(manifest, path):
     '''
     Adds a new entry to your sha512 manifest and sort.
-    Yet another SHA512 script that needs to be merged with the MD5 functions.
-    '''
-    manifest_generator = ''
-    with open(manifest, 'r', encoding='utf-8') as fo:
-        original_lines = fo.readlines()
-        sha512 = hashlib_sha512(path)
-        path_to_remove = os.path.dirname(os.path.dirname(os.path.dirname(path)))
-        root2 = os.path.abspath(path).replace(path_to_remove, '')
-        try:
-            if root2[0] == '/':
-                root2 = root2[1:]
-            if root2[0] == '\\':
-                root2 = root2[1:]
-        except: IndexError
-        manifest_generator += sha512[:128] + '  ' + root2.replace("\\", "/") + '\n'
-        for i in original_lines:
-            manifest_generator += i
-    manifest_list = manifest_generator.splitlines()
-    # http://stackoverflow.com/a/31306961/2188572
-    manifest_list = sorted(manifest_list, key=lambda x: (x[130:]))
-    with open(manifest, "w", encoding='utf-8') as fo:
-        for i in manifest_list:
-            fo.write((unicodedata.normalize('NFC', i) + '\n'))
+    '''
+    package_manifest = Manifest(manifest, 'sha512')
+    package_manifest.add(path)
+    package_manifest.save(sort=True, normalise=True)
 
 
 def check_for_uuid(args):
@@ -1245,25 +3005,9 @@ def checksum_replace(manifest, logname, algorithm):
     Update a value in a checksum manifest.
     Variables just refer to lognames right now, which is the only thing that needs to change at the moment.
     '''
-    change = False
-    updated_manifest = []
-    if algorithm == 'md5':
-        new_checksum = hashlib_md5(logname)
-    elif algorithm == 'sha512':
-        new_checksum = hashlib_sha512(logname)
-    with open(manifest, 'r', encoding='utf-8') as manifesto:
-        manifest_lines = manifesto.readlines()
-        for lines in manifest_lines:
-            if os.path.basename(logname) in lines:
-                change = True
-                if algorithm == 'md5':
-                    lines = lines[31:].replace(lines[31:], new_checksum + lines[32:])
-                elif algorithm == 'sha512':
-                    lines = lines[127:].replace(lines[127:], new_checksum + lines[128:])
-            updated_manifest.append(lines)
-    with open(manifest, 'w', encoding='utf-8') as fo:
-        for lines in updated_manifest:
-            fo.write(lines)
+    package_manifest = Manifest(manifest, algorithm)
+    change = package_manifest.rehash(logname)
+    package_manifest.save()
     if not change:
         return change
 
@@ -1581,19 +3325,16 @@ def check_dependencies(dependencies):
             sys.exit()
 
 
-def get_folder_size(folder):
+def get_folder_size(folder, inventory=None):
     '''
     Get the size fo all files in a folder. Recursive process.
-    https://stackoverflow.com/a/1392549/2188572
+    An inventory from make_inventory() can be passed in to avoid another walk.
     '''
+    if inventory is None:
+        inventory = make_inventory(folder)
     total_size = 0
-    for dirpath, dirnames, filenames in os.walk(folder):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            try:
-                total_size += os.path.getsize(fp)
-            except OSError:
-                continue
+    for entry in inventory:
+        total_size += entry.size
     return total_size
 
 
@@ -1799,19 +3540,81 @@ def diff_framemd5s(fmd5, fmd5ffv1):
     return checksum_mismatches
 
 
+def set_tool_version_cache(setting):
+    '''
+    Turns the on-disk cache of tool versions on or off. It can also be set
+    with the IFISCRIPTS_TOOL_VERSION_CACHE environment variable.
+    off - versions are probed once per process. This is the default.
+    on - versions are also kept in tool_versions.json in the
+    ifiscripts_logs folder and reused by later runs until the tool's
+    binary is replaced, ie its path, size or modification time changes.
+    '''
+    global TOOL_VERSION_CACHE
+    if setting not in ('off', 'on'):
+        raise ValueError('Unknown tool version cache setting: %s' % setting)
+    TOOL_VERSION_CACHE = setting
+
+
+def get_tool_version(tool):
+    '''
+    Returns the version of an external tool in TOOL_VERSION_COMMANDS, eg:
+    get_tool_version('mediainfo'), for agentName and agentVersion values.
+    The tool is only probed once per process. If the version command fails,
+    the second line of its output is returned, and if that is not possible
+    the name of the tool is returned.
+    '''
+    with _tool_versions_lock:
+        if tool in _tool_versions:
+            return _tool_versions[tool]
+        command, tidy, default = TOOL_VERSION_COMMANDS[tool]
+        binary = shutil.which(command[0])
+        cache_key = None
+        cache = {}
+        if TOOL_VERSION_CACHE == 'on' and binary:
+            binary_stat = os.stat(binary)
+            cache_key = '%s|%s|%s|%s' % (tool, binary, binary_stat.st_size, binary_stat.st_mtime_ns)
+            cache_file = os.path.join(make_desktop_logs_dir(), 'tool_versions.json')
+            if os.path.isfile(cache_file):
+                try:
+                    with open(cache_file, 'r', encoding='utf-8') as fo:
+                        cache = json.load(fo)
+                except ValueError:
+                    cache = {}
+            if cache_key in cache:
+                version = cache[cache_key]
+                if isinstance(version, dict):
+                    version = version['bytes'].encode('utf-8', 'surrogateescape')
+                _tool_versions[tool] = version
+                return version
+        version = default
+        try:
+            version = tidy(subprocess.check_output(command))
+        except subprocess.CalledProcessError as grepexc:
+            version = grepexc.output.rstrip().splitlines()[1]
+        _tool_versions[tool] = version
+        if cache_key:
+            # Versions are mostly bytes, which are kept as they would be logged.
+            cached_version = version
+            if isinstance(version, bytes):
+                cached_version = {'bytes': version.decode('utf-8', 'surrogateescape')}
+            cache = dict(
+                (key, value) for key, value in cache.items()
+                if not key.startswith(tool + '|')
+            )
+            cache[cache_key] = cached_version
+            temp_file = cache_file + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as fo:
+                json.dump(cache, fo, indent=4, sort_keys=True)
+            os.replace(temp_file, cache_file)
+        return version
+
+
 def get_mediainfo_version():
     '''
     Returns the version of mediainfo.
     If this is not possible, the string 'mediainfo' is returned.
     '''
-    mediainfo_version = 'mediainfo'
-    try:
-        mediainfo_version = subprocess.check_output([
-            'mediainfo', '--Version'
-        ]).rstrip()
-    except subprocess.CalledProcessError as grepexc:
-        mediainfo_version = grepexc.output.rstrip().splitlines()[1]
-    return mediainfo_version
+    return get_tool_version('mediainfo')
 
 
 def get_rawcooked_version():
@@ -1819,14 +3622,7 @@ def get_rawcooked_version():
     Returns the version of rawcooked.
     If this is not possible, the string 'RAWcooked' is returned.
     '''
-    rawcooked_version = 'RAWcooked'
-    try:
-        rawcooked_version = subprocess.check_output([
-            'rawcooked', '--version'
-        ]).rstrip()
-    except subprocess.CalledProcessError as grepexc:
-        rawcooked_version = grepexc.output.rstrip().splitlines()[1]
-    return rawcooked_version
+    return get_tool_version('rawcooked')
 
 
 def get_ffprobe_dict(source):
@@ -1982,100 +3778,109 @@ def check_av_or_doc(input):
     return format
 
 
-def get_technical_metadata(path, new_log_textfile):
-    '''
-    Recursively create mediainfos and mediatraces for AV files.
+def extract_technical_metadata(task):
+    '''
+    Runs the metadata tools for one file of get_technical_metadata().
+    Returns the messages to print and the EVENT lines to log, in the order
+    of a serial run, as ('print', message) or ('log', message) tuples.
+    siegfried_done is True if make_siegfried_batch() already wrote the
+    Siegfried sidecar.
+    '''
+    metadata_dir, full_path, file_type, siegfried_done = task
+    basename = os.path.basename(full_path)
+    messages = []
+    if file_type == 'av':
+        inputxml = "%s/%s_mediainfo.xml" % (metadata_dir, basename)
+        inputtracexml = "%s/%s_mediatrace.xml" % (metadata_dir, basename)
+        messages.append(('print', ' - Generating mediainfo xml of input file and saving it in %s' % inputxml))
+        make_mediainfo(inputxml, 'mediaxmlinput', full_path)
+        messages.append(('log', 'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputxml, get_tool_version('mediainfo'))))
+        messages.append(('print', ' - Generating mediatrace xml of input file and saving it in %s' % inputtracexml))
+        make_mediatrace(inputtracexml, 'mediatracexmlinput', full_path)
+        with open(inputtracexml, 'r', encoding='utf-8') as fo:
+            none_test = fo.read()
+        if none_test == 'None':
+            os.remove(inputtracexml)
+            messages.append(('log', 'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventDetail=Failure, mediatrace could not be created due to characters not compatible with UTF-8 and cp1252. mediatrace XML not included in package as a result, agentName=%s'))
+        else:
+            messages.append(('log', 'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputtracexml, get_tool_version('mediainfo'))))
+    else:
+        if not basename.lower().endswith(('.txt', '.csv')):
+            inputxml = "%s/%s_exiftool.json" % (metadata_dir, basename)
+            messages.append(('log', 'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via exiftool, eventOutcome=%s, agentName=%s' % (inputxml, get_tool_version('exiftool'))))
+            messages.append(('print', ' - Generating exiftool json of input file and saving it in %s' % inputxml))
+            make_exiftool(inputxml, full_path)
+        inputtracexml = "%s/%s_siegfried.json" % (metadata_dir, basename)
+        messages.append(('print', ' - Generating Siegfried json of input file and saving it in %s' % inputtracexml))
+        if not siegfried_done:
+            make_siegfried(inputtracexml, full_path)
+        messages.append(('log', 'EVENT = Format identification - eventType=format identification, eventDetail=Format identification via PRONOM signatures using Siegfried, eventOutcome=%s, agentName=%s' % (inputtracexml, get_tool_version('siegfried'))))
+    return messages
+
 
+def get_technical_metadata(path, new_log_textfile, workers=None):
     '''
-    mediainfo_version = 'mediainfo'
-    try:
-        mediainfo_version = subprocess.check_output([
-            'mediainfo', '--Version'
-        ]).rstrip()
-    except subprocess.CalledProcessError as grepexc:
-        mediainfo_version = grepexc.output.rstrip().splitlines()[1]
+    Recursively create mediainfos and mediatraces for AV files.
+    Up to workers files, by default METADATA_WORKERS, are processed at
+    once. Messages and EVENT lines are still printed and logged in the
+    order of the folder walk, so logs are the same as a serial run.
+    Folders that are mostly documents are identified with one Siegfried
+    run each, see make_siegfried_batch().
+    '''
+    if workers is None:
+        workers = METADATA_WORKERS
+    metadata_dir = os.path.join(path, 'metadata')
+    tasks = []
+    siegfried_batches = []
     for root, directories, filenames in os.walk(path):
+        # logs holds the package's own logs and copy time manifests.
         directories[:] = [
-            d for d in directories if d != 'metadata'
+            d for d in directories if d not in ('metadata', 'logs')
         ]
+        xmlfilenames = {}
         for av_file in filenames:
-            if check_av_or_doc(av_file.lower()) == 'av':
-                if av_file[0] != '.':
-                    inputxml = "%s/%s_mediainfo.xml" % (
-                        os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                    inputtracexml = "%s/%s_mediatrace.xml" % (
-                        os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                    print(' - Generating mediainfo xml of input file and saving it in %s' % inputxml)
-                    make_mediainfo(
-                        inputxml, 'mediaxmlinput', os.path.join(root, av_file)
-                    )
-                    generate_log(
-                        new_log_textfile,
-                        'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputxml, mediainfo_version)
-                    )
-                    print(' - Generating mediatrace xml of input file and saving it in %s' % inputtracexml)
-                    make_mediatrace(
-                        inputtracexml,
-                        'mediatracexmlinput',
-                        os.path.join(root, av_file)
-                    )
-                    with open(inputtracexml, 'r', encoding='utf-8') as fo:
-                        none_test = fo.read()
-                    if none_test == 'None':
-                        os.remove(inputtracexml)
-                        generate_log(
-                            new_log_textfile,
-                            'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventDetail=Failure, mediatrace could not be created due to characters not compatible with UTF-8 and cp1252. mediatrace XML not included in package as a result, agentName=%s'
-                        )
-                    else:
-                        generate_log(
-                            new_log_textfile,
-                            'EVENT = Metadata extraction - eventDetail=Mediatrace technical metadata extraction via mediainfo, eventOutcome=%s, agentName=%s' % (inputtracexml, mediainfo_version)
-                        )
-            elif check_av_or_doc(av_file.lower()) == 'doc':
-                if av_file[0] != '.':
-                    if not av_file.lower().endswith(('.txt', '.csv')):
-                        exiftool_version = 'exiftool'
-                        try:
-                            exiftool_version = subprocess.check_output([
-                                'exiftool', '-ver'
-                            ])
-                        except subprocess.CalledProcessError as grepexc:
-                            exiftool_version = grepexc.output.rstrip().splitlines()[1]
-                        inputxml = "%s/%s_exiftool.json" % (
-                            os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                        generate_log(
-                            new_log_textfile,
-                            'EVENT = Metadata extraction - eventDetail=Technical metadata extraction via exiftool, eventOutcome=%s, agentName=%s' % (inputxml, exiftool_version)
-                        )
-                        print(' - Generating exiftool json of input file and saving it in %s' % inputxml)
-                        make_exiftool(
-                            inputxml,
-                            os.path.join(root, av_file)
-                        )
-                    siegfried_version = 'siegfried'
-                    try:
-                        siegfried_version = subprocess.check_output([
-                            'sf', '-version'
-                        ])
-                    except subprocess.CalledProcessError as grepexc:
-                        siegfried_version = grepexc.output.rstrip().splitlines()[1]
-                    inputtracexml = "%s/%s_siegfried.json" % (
-                        os.path.join(path, 'metadata'), os.path.basename(av_file)
-                        )
-                    print(' - Generating Siegfried json of input file and saving it in %s' % inputtracexml)
-                    make_siegfried(
-                        inputtracexml,
-                        os.path.join(root, av_file)
-                    )
-                    generate_log(
-                        new_log_textfile,
-                        'EVENT = Format identification - eventType=format identification, eventDetail=Format identification via PRONOM signatures using Siegfried, eventOutcome=%s, agentName=%s' % (inputtracexml, siegfried_version)
-                    )
-                    
+            if av_file[0] == '.':
+                continue
+            file_type = check_av_or_doc(av_file.lower())
+            if file_type in ('av', 'doc'):
+                tasks.append((metadata_dir, os.path.join(root, av_file), file_type))
+            if file_type == 'doc':
+                xmlfilenames[os.path.join(root, av_file)] = "%s/%s_siegfried.json" % (metadata_dir, av_file)
+        # sf reads every file in the folder, so only batch when most of them
+        # need identifying anyway.
+        if SIEGFRIED_BATCH and len(xmlfilenames) > 1 and len(xmlfilenames) * 2 >= len(filenames):
+            siegfried_batches.append((root, xmlfilenames))
+    futures = []
+    if workers > 1 and len(tasks) > 1:
+        # The work is done by the tools, so threads are enough to keep
+        # up to workers tool processes running.
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        def mapper(function, items):
+            submitted = [executor.submit(function, item) for item in items]
+            futures.extend(submitted)
+            return (future.result() for future in submitted)
+    else:
+        executor = None
+        mapper = map
+    try:
+        siegfried_done = set()
+        for written in mapper(lambda batch: make_siegfried_batch(*batch), siegfried_batches):
+            siegfried_done.update(written)
+        tasks = [task + (task[1] in siegfried_done,) for task in tasks]
+        results = mapper(extract_technical_metadata, tasks)
+        for messages in results:
+            for message_type, message in messages:
+                if message_type == 'print':
+                    print(message)
+                else:
+                    generate_log(new_log_textfile, message)
+    finally:
+        # After an error, files that have not started are cancelled.
+        for future in futures:
+            future.cancel()
+        if executor is not None:
+            executor.shutdown()
+
 
 def check_if_manifest(manifest):
     '''
@@ -2089,23 +3894,19 @@ def check_if_manifest(manifest):
                     return True
 
 
-def count_stuff(source):
+def count_stuff(source, inventory=None):
     '''
     Counts total files to be processed.
+    An inventory from make_inventory() can be passed in to avoid another walk.
     '''
-    source_count = 0
+    if inventory is None:
+        inventory = make_inventory(source)
     file_list = []
-    for root, directories, filenames in os.walk(source):
-        filenames = [f for f in filenames if f[0] != '.']
-        directories[:] = [d for d in directories if d[0] != '.']
-        for files in filenames:
-            source_count += 1
-            relative_path = unicodedata.normalize('NFC', os.path.join(root, files).replace(os.path.dirname(source), ''))[1:]
-            file_list.append(relative_path.replace("\\", "/"))
-    print(file_list)
-    if os.path.isfile(source):
-        if len(file_list) == 0:
-            source_count = 1
+    for entry in inventory:
+        relative_path = unicodedata.normalize('NFC', entry.path.replace(os.path.dirname(source), ''))[1:]
+        file_list.append(relative_path.replace("\\", "/"))
+    source_count = len(file_list)
+    print(' - %s files found in %s' % (source_count, source))
     return source_count, file_list
 
 
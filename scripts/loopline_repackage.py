@@ -12,6 +12,7 @@ import sys
 import shutil
 import os
 import time
+import collections
 import ififuncs
 
 def parse_args(args_):
@@ -69,22 +70,23 @@ def update_manifest(manifest, old_oe, uuid):
     Updates the existing checksum manifest by replacing OE numbers with
     UUIDs where appropriate. Anything logfiles or metadata relating to the
     original v210.mov will be left alone.
+    The updated manifest is returned so that it can be saved in its new location.
     '''
-    updated_lines = []
-    with open(manifest, 'r') as file_object:
-        checksums = file_object.readlines()
-        for line in checksums:
-            if old_oe in line:
-                if 'source' in line:
-                    # if source (v210) logs or metadata exist, leave filename
-                    # alone, just change the path.
-                    line = line[:40].replace(old_oe, uuid) + line[40:]
-                elif '.mov_log.log' in line:
-                    line = line.replace(old_oe, uuid).replace('.mov_log', '_sip_log')
-                else:
-                    line = line.replace(old_oe, uuid)
-                updated_lines.append(line)
-    return updated_lines
+    package_manifest = ififuncs.Manifest(manifest, 'md5')
+    updated_entries = collections.OrderedDict()
+    for path, checksum in package_manifest.entries.items():
+        if old_oe in path:
+            if 'source' in path:
+                # if source (v210) logs or metadata exist, leave filename
+                # alone, just change the path.
+                path = path[:6].replace(old_oe, uuid) + path[6:]
+            elif '.mov_log.log' in path:
+                path = path.replace(old_oe, uuid).replace('.mov_log', '_sip_log')
+            else:
+                path = path.replace(old_oe, uuid)
+            updated_entries[path] = checksum
+    package_manifest.entries = updated_entries
+    return package_manifest
 
 def rename_files(new_uuid_path, old_oe, uuid, manifest, logname):
     '''
@@ -260,12 +262,11 @@ def main(args_):
                 new_oe_path, new_uuid_path = move_files(
                     root, new_object_entry, old_oe_path, old_uuid_path, uuid
                 )
-                updated_lines = update_manifest(manifest, old_oe, uuid)
+                package_manifest = update_manifest(manifest, old_oe, uuid)
                 new_manifest = os.path.join(new_oe_path, uuid) + '_manifest.md5'
                 shutil.move(manifest, new_manifest)
-                with open(new_manifest, 'w') as fo:
-                    for lines in updated_lines:
-                        fo.write(lines)
+                package_manifest.manifest_textfile = new_manifest
+                package_manifest.save()
                 new_logs_path = os.path.join(new_uuid_path, 'logs')
                 for files in os.listdir(new_logs_path):
                     if '.mov_log.log' in files:
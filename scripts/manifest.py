@@ -34,10 +34,26 @@ def remove_bad_files(root_dir, log_name_source):
                         os.remove(path)
                     except OSError:
                         print('can\'t delete as source is read-only')
-def main(args_):
+
+
+def log_chunk_sidecar(manifest, log_name_source):
+    '''
+    Logs the chunk checksum sidecar if one was written.
+    '''
+    chunk_sidecar = ififuncs.get_chunk_sidecar(manifest)
+    if os.path.isfile(chunk_sidecar):
+        generate_log(
+            log_name_source,
+            'EVENT = message digest calculation - eventDetail=%s checksums of every %s byte chunk of large files calculated in the same pass as the manifest, eventOutcome=%s' % (ififuncs.CHUNK_ALGORITHM, ififuncs.CHUNK_SIZE, chunk_sidecar)
+        )
+
+
+def main(args_, known_checksums=None):
     '''
     Overly long main function that makes a sidecar manifest.
     This needs to get broken up into smaller functions.
+    known_checksums is an optional dictionary of sha512 values that were
+    already calculated, eg: by copyit.py, which will not be recalculated.
     '''
     parser = argparse.ArgumentParser(description='Generate manifest with'
                                      ' checksums for a directory'
@@ -61,7 +77,32 @@ def main(args_):
         action='store_true',
         help='Generates sha512 checksums instead of md5'
     )
+    parser.add_argument(
+        '-workers', type=int, default=ififuncs.HASH_WORKERS,
+        help='Number of files to hash at the same time. Default is %s. Use 1 to hash one file at a time.' % ififuncs.HASH_WORKERS
+    )
+    parser.add_argument(
+        '-chunks',
+        action='store_true',
+        help='Also writes a _chunks.json sidecar with a checksum for every %s MiB chunk of large files, so that validate.py can find which byte ranges are damaged' % (ififuncs.CHUNK_SIZE // 2**20)
+    )
+    parser.add_argument(
+        '-fixity_cache',
+        choices=ififuncs.FIXITY_CACHE_POLICIES,
+        help='Fixity cache policy. record - store all checksums in the local cache. derived - as record, but reuse cached checksums of unchanged files.'
+    )
+    parser.add_argument(
+        '-progress_file',
+        help='Full path of a file that progress is written to as JSON every few seconds, so that the job can be monitored remotely.'
+    )
     args = parser.parse_args(args_)
+    if args.fixity_cache:
+        ififuncs.set_fixity_cache_policy(args.fixity_cache)
+    if args.progress_file:
+        ififuncs.set_progress_file(args.progress_file)
+    chunk_size = None
+    if args.chunks:
+        chunk_size = ififuncs.CHUNK_SIZE
     source = args.source
     source_parent_dir = os.path.dirname(source)
     normpath = os.path.normpath(source)
@@ -125,11 +166,9 @@ def main(args_):
         generate_log(log_name_source, 'manifest.py exit')
         sys.exit()
     remove_bad_files(source, log_name_source)
-    source_count = 0
-    for _, _, filenames in os.walk(source):
-        # There has to be a better way to count the files..
-        for _ in filenames:
-            source_count += 1 #works in windows at least
+    # One walk of the source is shared by the file count and the manifest.
+    inventory = ififuncs.make_inventory(source)
+    source_count = len(inventory)
     if os.path.isfile(manifest):
         count_in_manifest = manifest_file_count(manifest)
         if source_count != count_in_manifest:
@@ -140,17 +179,22 @@ def main(args_):
         try:
             print('Generating source manifest')
             generate_log(log_name_source, 'EVENT = Generating source manifest')
+            journal = ififuncs.open_hash_journal(manifest, 'manifest', log_name_source)
             if args.f:
                 if args.sha512:
-                    ififuncs.sha512_manifest(source, manifest, source)
+                    ififuncs.sha512_manifest(source, manifest, source, known_checksums, args.workers, log_name_source, inventory, chunk_size, journal)
                 else:
-                    hashlib_manifest(source, manifest, source)
+                    hashlib_manifest(source, manifest, source, args.workers, log_name_source, inventory, chunk_size, journal)
+                log_chunk_sidecar(manifest, log_name_source)
+                journal.close()
                 shutil.move(log_name_source, source)
             else:
                 if args.sha512:
-                    ififuncs.sha512_manifest(source, manifest, source_parent_dir)
+                    ififuncs.sha512_manifest(source, manifest, source_parent_dir, known_checksums, args.workers, log_name_source, inventory, chunk_size, journal)
                 else:
-                    hashlib_manifest(source, manifest, source_parent_dir)
+                    hashlib_manifest(source, manifest, source_parent_dir, args.workers, log_name_source, inventory, chunk_size, journal)
+                log_chunk_sidecar(manifest, log_name_source)
+                journal.close()
         except OSError as e:
             print('You do not have access to this directory. Perhaps it is read only, or the wrong file system\n')
             print(e)
@@ -3,9 +3,15 @@
 Launches copyit.py for subfolders that have md5 anifests.
 '''
 import os
+import sys
+import json
 import argparse
 import time
+import shutil
+import tempfile
+import subprocess
 import copyit
+import ififuncs
 from ififuncs import make_desktop_logs_dir
 
 
@@ -49,10 +55,29 @@ def parse_args():
         action='store_true',
         help='Answers YES to the question: Not enough free space, would you like to continue?'
     )
+    add_job_args(parser)
     args = parser.parse_args()
     return args
 
 
+def add_job_args(parser):
+    '''
+    Adds the concurrency options that are shared with multicopy.py
+    '''
+    parser.add_argument(
+        '-jobs', type=int, default=1,
+        help='Run up to this many copyit.py jobs at the same time. Default is 1, which runs the jobs one after another.'
+    )
+    parser.add_argument(
+        '-source_jobs', type=int, default=1,
+        help='When -jobs is used, the maximum number of jobs that read from the same source drive at the same time. Default is 1.'
+    )
+    parser.add_argument(
+        '-destination_jobs', type=int, default=2,
+        help='When -jobs is used, the maximum number of jobs that write to the same destination drive at the same time. Default is 2.'
+    )
+
+
 def find_manifest(args):
     '''
     This function tries to find a manifest.
@@ -91,6 +116,149 @@ def find_manifest(args):
     return dirlist # the dirlist is sent back out to the rest of the script.
 
 
+def get_device(path):
+    '''
+    Returns the device (st_dev) of path, or of its closest parent folder
+    that exists, so that a destination that has not been created yet is
+    matched to the drive that it will be written to.
+    '''
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    return os.stat(path).st_dev
+
+
+def find_log(job, desktop_logs_dir):
+    '''
+    Returns the copyit.py log of a job that ran in another process. copyit.py
+    names its log in the progress file. If it did not get that far, the log
+    name that the job would have used is returned so that analyze_reports()
+    can look for it again.
+    '''
+    try:
+        with open(job['progress_file'], 'r') as fo:
+            log_name = json.load(fo).get('log')
+    except (OSError, ValueError):
+        log_name = None
+    if log_name:
+        return log_name
+    return os.path.join(
+        desktop_logs_dir,
+        job['name'] + time.strftime("_%Y_%m_%dT%H_%M_%S", time.localtime(job['started'])) + '.log'
+    )
+
+
+def job_status(job):
+    '''
+    Returns a one line status of a running copyit.py job from its progress
+    file.
+    '''
+    try:
+        with open(job['progress_file'], 'r') as fo:
+            report = json.load(fo)
+    except (OSError, ValueError):
+        return 'starting'
+    if not report.get('stage'):
+        return 'starting'
+    stats = report['stages'][report['stage']]
+    status = '%s: %s/%s files, %.1f MB/s' % (
+        report['stage'], stats['files'], stats['total_files'],
+        stats['bytes_per_second'] / 1000000.0
+    )
+    if stats['eta_seconds'] is not None and not stats['finished']:
+        status += ', ETA %s' % ififuncs.format_seconds(stats['eta_seconds'])
+    return status
+
+
+def run_jobs(sources, destination, copyit_options, desktop_logs_dir, jobs, source_jobs, destination_jobs):
+    '''
+    Runs copyit.py for each source in its own process, with up to jobs
+    running at the same time. No more than source_jobs read from any one
+    source drive and no more than destination_jobs write to any one
+    destination drive, so that a shelf of shuttle drives is copied in
+    parallel while a single drive is not thrashed by competing jobs.
+    Jobs start in the order of sources whenever their drives are free.
+    A status line for each running job is printed every
+    ififuncs.PROGRESS_INTERVAL seconds.
+    Jobs have no terminal to ask questions on, so -y is always passed to
+    copyit.py. Sources that already exist at the destination, which
+    copyit.py would ask about overwriting, are skipped, as are sources with
+    the same folder name as an earlier source.
+    Returns the copyit.py log names in the order of sources.
+    '''
+    if '-y' not in copyit_options:
+        copyit_options = copyit_options + ['-y']
+    temp_dir = tempfile.mkdtemp(prefix='masscopy_')
+    destination_device = get_device(destination)
+    pending = []
+    for index, source in enumerate(sources):
+        name = os.path.basename(os.path.normpath(source))
+        destination_dir = os.path.join(destination, name)
+        if name in [job['name'] for job in pending]:
+            print(' - %s has the same folder name as an earlier source, skipping. Run without -jobs to choose whether to overwrite it.' % source)
+            continue
+        if os.path.isfile(os.path.join(destination, name + '_manifest.md5')) or (
+                os.path.isdir(destination_dir) and len(os.listdir(destination_dir)) > 1):
+            print(' - %s already exists at the destination, skipping. Run without -jobs to choose whether to overwrite it.' % name)
+            continue
+        pending.append({
+            'index': index,
+            'source': source,
+            'name': name,
+            'source_device': get_device(source),
+            'destination_device': destination_device,
+            'progress_file': os.path.join(temp_dir, '%s.json' % index),
+            'output_file': os.path.join(temp_dir, '%s.txt' % index)
+        })
+    running = []
+    log_names = [None] * len(sources)
+    last_report = time.monotonic()
+    while pending or running:
+        for job in list(pending):
+            if len(running) >= jobs:
+                break
+            source_count = len([i for i in running if i['source_device'] == job['source_device']])
+            destination_count = len([i for i in running if i['destination_device'] == job['destination_device']])
+            if source_count >= source_jobs or destination_count >= destination_jobs:
+                continue
+            pending.remove(job)
+            job['started'] = time.time()
+            job['output'] = open(job['output_file'], 'w')
+            job['process'] = subprocess.Popen(
+                [sys.executable, copyit.__file__, job['source'], destination]
+                + copyit_options + ['-progress_file', job['progress_file']],
+                stdin=subprocess.DEVNULL, stdout=job['output'],
+                stderr=subprocess.STDOUT
+            )
+            running.append(job)
+            print(' - Started copying %s' % job['source'])
+        for job in list(running):
+            returncode = job['process'].poll()
+            if returncode is None:
+                continue
+            running.remove(job)
+            job['output'].close()
+            log_names[job['index']] = find_log(job, desktop_logs_dir)
+            outcome = ''
+            if os.path.isfile(log_names[job['index']]):
+                outcome = analyze_log(log_names[job['index']])
+            print(' - Finished copying %s in %s: %s' % (
+                job['source'], ififuncs.format_seconds(time.time() - job['started']),
+                outcome or 'exit code %s' % returncode
+            ))
+            if outcome != 'success':
+                with open(job['output_file'], 'r') as fo:
+                    for line in fo.readlines()[-10:]:
+                        print('   %s' % line.rstrip())
+        if running and time.monotonic() - last_report >= ififuncs.PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            for job in running:
+                print(' - %-*s : %s' % (30, job['name'][:30], job_status(job)))
+        time.sleep(0.2)
+    shutil.rmtree(temp_dir)
+    return [log_name for log_name in log_names if log_name]
+
+
 def analyze_reports(log_names, desktop_logs_dir):
     '''
     Tries to locate copyit.py logs on the desktop and analyzes them.
@@ -111,6 +279,18 @@ def analyze_reports(log_names, desktop_logs_dir):
                         print(" - %-*s   : %s" % (50, os.path.basename(logs)[:-24], analyze_log(os.path.join(desktop_logs_dir, logs))))
 
 
+def get_copyit_options(args):
+    '''
+    Returns the copyit.py options that are passed on to every job.
+    '''
+    copyit_options = []
+    if args.l:
+        copyit_options.append('-l')
+    elif args.y:
+        copyit_options.append('-y')
+    return copyit_options
+
+
 def main():
     '''
     Launches the other functions wihch attempt to run multiple copyit.py
@@ -129,17 +309,26 @@ def main():
         else:
             print(' - %s will be copied' % i)
     time.sleep(2)
+    if args.jobs > 1:
+        desktop_logs_dir = make_desktop_logs_dir()
+        sources = [
+            os.path.join(args.input, i) for i in all_files
+            if not os.path.isdir(os.path.join(args.o, os.path.basename(i)))
+        ]
+        log_names = run_jobs(
+            sources, args.o, get_copyit_options(args), desktop_logs_dir,
+            args.jobs, args.source_jobs, args.destination_jobs
+        )
+        print(' - ********\nWARNING - Please check the ifiscripts_logs directory on your Desktop to verify if ALL of your transfers were successful')
+        analyze_reports(log_names, desktop_logs_dir)
+        return
     for i in all_files:
         absolute_path = os.path.join(args.o, os.path.basename(i))
         if os.path.isdir(absolute_path):
             print(' - %s already exists, skipping' % absolute_path)
         else:
             desktop_logs_dir = make_desktop_logs_dir()
-            copyit_cmd = [os.path.join(args.input, i), args.o]
-            if args.l:
-                copyit_cmd.append('-l')
-            elif args.y:
-                copyit_cmd.append('-y')
+            copyit_cmd = [os.path.join(args.input, i), args.o] + get_copyit_options(args)
             log_name = copyit.main(copyit_cmd)
             log_names.append(log_name)
             processed_dirs.append(os.path.basename(os.path.join(args.input, i)))
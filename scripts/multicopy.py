@@ -39,6 +39,7 @@ def parse_args():
         action='store_true',
         help='Answers YES to the question: Not enough free space, would you like to continue?'
     )
+    masscopy.add_job_args(parser)
     args = parser.parse_args()
     return args
 
@@ -50,13 +51,15 @@ def main():
     log_names = []
     args = parse_args()
     desktop_logs_dir = ififuncs.make_desktop_logs_dir()
-    for i in args.i:
-        copyit_cmd = [i, args.o]
-        if args.l:
-            copyit_cmd.append('-l')
-        elif args.y:
-            copyit_cmd.append('-y')
-        log_names.append(copyit.main(copyit_cmd))
+    if args.jobs > 1:
+        log_names = masscopy.run_jobs(
+            args.i, args.o, masscopy.get_copyit_options(args), desktop_logs_dir,
+            args.jobs, args.source_jobs, args.destination_jobs
+        )
+    else:
+        for i in args.i:
+            copyit_cmd = [i, args.o] + masscopy.get_copyit_options(args)
+            log_names.append(copyit.main(copyit_cmd))
     print('********\nWARNING - Please check the ifiscripts_logs directory on your Desktop to verify if ALL of your transfers were successful')
     masscopy.analyze_reports(log_names, desktop_logs_dir)
 
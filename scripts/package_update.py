@@ -52,27 +52,17 @@ def update_manifest(manifest, old_path, new_path, new_log_textfile):
     '''
     Updates the path in a checksum manifest to reflect the new location.
     '''
-    updated_lines = []
-    with open(manifest, 'r') as file_object:
-        checksums = file_object.readlines()
-        change = False
-        for line in checksums:
-            if old_path in line:
-                line = line.replace(old_path, new_path)
-                print(('the following path: %s has been updated with %s in the package manifest %s' % (old_path, new_path, manifest)))
-                ififuncs.generate_log(
-                    new_log_textfile,
-                    'EVENT = eventType=metadata modification,'
-                    ' agentName=package_update.py,'
-                    ' eventDetail=the following path: %s has been updated with %s in the package manifest %s' % (old_path, new_path, manifest)
-                )
-                updated_lines.append(line)
-                change = True
-            else:
-                updated_lines.append(line)
-    with open(manifest, 'w') as updated_manifest:
-        for updated_line in updated_lines:
-            updated_manifest.write(updated_line)
+    package_manifest = ififuncs.Manifest(manifest)
+    change = package_manifest.rename(old_path, new_path) > 0
+    if change:
+        package_manifest.save()
+        print(('the following path: %s has been updated with %s in the package manifest %s' % (old_path, new_path, manifest)))
+        ififuncs.generate_log(
+            new_log_textfile,
+            'EVENT = eventType=metadata modification,'
+            ' agentName=package_update.py,'
+            ' eventDetail=the following path: %s has been updated with %s in the package manifest %s' % (old_path, new_path, manifest)
+        )
     return change
 
 
@@ -157,11 +147,11 @@ def main(args_):
             ififuncs.sort_manifest(sip_manifest)
             if args.aip:
                 new_filename = os.path.join(sip_path, relative_new_path, os.path.basename(filenames))
-                ifchange_manifest_sha512_file = ififuncs.sha512_update(sip_manifest_sha512, new_filename)
-                ifchange_dict['sha512_copy_file'] = ifchange_manifest_sha512_file
-                ifchange_manifest_sha512_log = ififuncs.sha512_update(sip_manifest_sha512, log_manifest)
-                ifchange_dict['sha512_copy_log'] = ifchange_manifest_sha512_log
-                ififuncs.sort_manifest(sip_manifest_sha512)
+                # both new entries are hashed and written in a single update.
+                package_manifest_sha512 = ififuncs.Manifest(sip_manifest_sha512, 'sha512')
+                package_manifest_sha512.add(new_filename)
+                package_manifest_sha512.add(log_manifest)
+                package_manifest_sha512.save(sort=True, normalise=True)
         else:
             # add test to see if it actually deleted - what if read only?
             shutil.move(filenames, args.new_folder)
@@ -114,6 +114,24 @@ def consolidate_manifests(path, directory, new_log_textfile):
     return new_manifest_textfile
 
 
+def move_sha512_manifests(path, new_log_textfile):
+    '''
+    Moves the sha512 manifests that copyit.py leaves in the objects folder
+    into logs, so that aipcreator.py can reuse them instead of rehashing.
+    This is done before metadata extraction, so they are not treated as objects.
+    '''
+    objects_dir = os.path.join(path, 'objects')
+    for manifest in os.listdir(objects_dir):
+        if manifest.endswith('_manifest-sha512.txt'):
+            shutil.move(
+                objects_dir + '/' +  manifest, os.path.join(path, 'logs')
+            )
+            ififuncs.generate_log(
+                new_log_textfile,
+                'EVENT = Manifest movement - Manifest from %s to %s' % (objects_dir + '/' +  manifest, os.path.join(path, 'logs'))
+            )
+
+
 def consolidate_logs(lognames, path):
     '''
     Finds moveit.py logs on the desktop
@@ -138,9 +156,11 @@ def move_files(inputs, sip_path, args, user):
     item_no = len(inputs)
     item_index = 1
     for item in inputs:        
-        cmd = [item, os.path.join(sip_path, 'objects')]
+        cmd = [item, os.path.join(sip_path, 'objects'), '-sha512']
         if args.move:
             cmd.append('-move')
+            if args.move_rehash:
+                cmd.append('-move_rehash')
         if args.l:
             cmd.append('-l')
         log_name = copyit.main(cmd)
@@ -241,6 +261,10 @@ def parse_args(args_):
         '-move', action='store_true',
         help='invokes the -move argument in copyit.py - moves instead of copy.'
     )
+    parser.add_argument(
+        '-move_rehash', action='store_true',
+        help='invokes the -move_rehash argument in copyit.py - with -move, hashes moved files again even if they were renamed within the same filesystem.'
+    )
     parser.add_argument(
         '-l', action='store_true',
         help='invokes the -lto argument in copyit.py - uses gcp instead of rsync.'
@@ -305,22 +329,25 @@ def normalise_objects_manifest(sip_path):
     uuid directory, not the objects directory. This will move it
     into the objects directory.
     '''
-    objects_manifest = os.path.join(sip_path, 'objects_manifest.md5')
-    if os.path.isfile(objects_manifest):
-        updated_manifest_lines = []
-        with open(objects_manifest, 'r') as fo:
-            manifest_lines = fo.readlines()
-            for i in manifest_lines:
-                # This is what appends the new path to existing paths.
-                replacement = i.replace('  objects/', '  ')
-                updated_manifest_lines.append(replacement)
-        with open(objects_manifest, 'w') as fo:
-            for x in updated_manifest_lines:
-                fo.write(x)
-        # Cut and paste old manifests into the log directory
-        shutil.move(
-            objects_manifest, os.path.join(sip_path, 'objects')
-        )
+    for objects_manifest in (
+            os.path.join(sip_path, 'objects_manifest.md5'),
+            os.path.join(sip_path, 'objects_manifest-sha512.txt')
+        ):
+        if os.path.isfile(objects_manifest):
+            updated_manifest_lines = []
+            with open(objects_manifest, 'r') as fo:
+                manifest_lines = fo.readlines()
+                for i in manifest_lines:
+                    # This is what appends the new path to existing paths.
+                    replacement = i.replace('  objects/', '  ')
+                    updated_manifest_lines.append(replacement)
+            with open(objects_manifest, 'w') as fo:
+                for x in updated_manifest_lines:
+                    fo.write(x)
+            # Cut and paste old manifests into the log directory
+            shutil.move(
+                objects_manifest, os.path.join(sip_path, 'objects')
+            )
 def get_object_entry(args):
     '''
     Figures out which OE number to use and performs some basic validation.
@@ -518,7 +545,8 @@ def main(args_):
         acquisition_type = ififuncs.get_acquisition_type('')
         donation_date = ififuncs.ask_question('When was the donation date in DD/MM/YYYY format? Eg. 31/12/1999 - Unfortunately this is NOT using ISO 8601.')
     if args.zip:
-        inputxml, inputtracexml, dfxml = ififuncs.generate_mediainfo_xmls(inputs[0], args.o, uuid, new_log_textfile)
+        with ififuncs.stage('tools'):
+            inputxml, inputtracexml, dfxml = ififuncs.generate_mediainfo_xmls(inputs[0], args.o, uuid, new_log_textfile)
         if args.manifest:
             shutil.copy(args.manifest, args.manifest.replace('_manifest.md5', '_manifest-md5.txt'))
             source_manifest = args.manifest.replace('_manifest.md5', '_manifest-md5.txt')
@@ -531,7 +559,8 @@ def main(args_):
                 new_log_textfile,
                 'EVENT = message digest calculation, status=started, eventType=messageDigestCalculation, agentName=hashlib, eventDetail=MD5 checksum of source files within ZIP'
             )
-            ififuncs.hashlib_manifest(args.i[0], source_manifest, os.path.dirname(args.i[0]))
+            with ififuncs.stage('io'):
+                ififuncs.hashlib_manifest(args.i[0], source_manifest, os.path.dirname(args.i[0]))
             ififuncs.generate_log(
                 new_log_textfile,
                 'EVENT = message digest calculation, status=finished, eventType=messageDigestCalculation, agentName=hashlib, eventDetail=MD5 checksum of source files within ZIP'
@@ -540,7 +569,8 @@ def main(args_):
             new_log_textfile,
             'EVENT = packing, status=started, eventType=packing, agentName=makezip.py, eventDetail=Source object to be packed=%s' % inputs[0]
         )
-        makezip_judgement, zip_file = makezip.main(['-i', inputs[0], '-o', os.path.join(sip_path, 'objects'), '-basename', uuid + '.zip'])
+        with ififuncs.stage('io'):
+            makezip_judgement, zip_file = makezip.main(['-i', inputs[0], '-o', os.path.join(sip_path, 'objects'), '-basename', uuid + '.zip'])
         ififuncs.generate_log(
             new_log_textfile,
             'EVENT = packing, status=finished, eventType=packing, agentName=makezip.py, eventDetail=Source object packed into=%s' % zip_file
@@ -558,13 +588,16 @@ def main(args_):
             'EVENT = losslessness verification, status=finished, eventType=messageDigestCalculation, agentName=makezip.py, eventDetail=embedded crc32 checksum validation, eventOutcome=%s' % judgement
         )
     else:
-        log_names = move_files(inputs, sip_path, args, user)
-    ififuncs.get_technical_metadata(sip_path, new_log_textfile)
+        with ififuncs.stage('io'):
+            log_names = move_files(inputs, sip_path, args, user)
+    if args.sc:
+        normalise_objects_manifest(sip_path)
+    move_sha512_manifests(sip_path, new_log_textfile)
+    with ififuncs.stage('tools'):
+        ififuncs.get_technical_metadata(sip_path, new_log_textfile)
     ififuncs.hashlib_manifest(
         metadata_dir, metadata_dir + '/metadata_manifest.md5', metadata_dir
     )
-    if args.sc:
-        normalise_objects_manifest(sip_path)
     new_manifest_textfile = consolidate_manifests(sip_path, 'objects', new_log_textfile)
     if args.zip:
         if zip_file.endswith('.001'):
@@ -572,7 +605,8 @@ def main(args_):
                 ififuncs.generate_log(
                     new_log_textfile, 'EVENT = Message Digest Calculation, status=started, eventType=message digest calculation, eventDetail=%s module=hashlib' % split_archive
                 )
-                ififuncs.manifest_update(new_manifest_textfile, os.path.join(os.path.dirname(zip_file), split_archive))
+                with ififuncs.stage('io'):
+                    ififuncs.manifest_update(new_manifest_textfile, os.path.join(os.path.dirname(zip_file), split_archive))
                 ififuncs.generate_log(
                     new_log_textfile, 'EVENT = Message Digest Calculation, status=finished, eventType=message digest calculation, eventDetail=%s module=hashlib' % split_archive
                 )
@@ -580,7 +614,8 @@ def main(args_):
             ififuncs.generate_log(
                 new_log_textfile, 'EVENT = Message Digest Calculation, status=started, eventType=message digest calculation, eventDetail=%s module=hashlib' % zip_file
             )
-            ififuncs.manifest_update(new_manifest_textfile, zip_file)
+            with ififuncs.stage('io'):
+                ififuncs.manifest_update(new_manifest_textfile, zip_file)
             ififuncs.generate_log(
                 new_log_textfile, 'EVENT = Message Digest Calculation, status=finished, eventType=message digest calculation, eventDetail=%s module=hashlib' % zip_file
             )
@@ -599,13 +634,18 @@ def main(args_):
         package_update.main(supplement_cmd)
     if args.sc:
         print('Generating Digital Forensics XML')
-        dfxml = aipcreator.make_dfxml(args, sip_path, uuid)
+        with ififuncs.stage('io'):
+            dfxml = aipcreator.make_dfxml(args, sip_path, uuid)
         ififuncs.generate_log(
             new_log_textfile,
             'EVENT = Metadata extraction - eventDetail=File system metadata extraction using Digital Forensics XML, eventOutcome=%s, agentName=makedfxml' % (dfxml)
         )
         ififuncs.manifest_update(new_manifest_textfile, dfxml)
-        sha512_log = manifest.main([sip_path, '-sha512', '-s'])
+        with ififuncs.stage('io'):
+            sha512_log = manifest.main(
+                [sip_path, '-sha512', '-s'],
+                ififuncs.get_objects_sha512(sip_path)
+            )
         sha512_manifest = os.path.join(
             os.path.dirname(sip_path), uuid + '_manifest-sha512.txt'
         )
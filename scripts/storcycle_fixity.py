@@ -34,39 +34,20 @@ def parse_args(args_):
 
 def diff_manifests(manifest, storcycle_list, txt_name_source):
     '''
-    Compare the list of storcycle hashes to the original AIP manifest.
+    Compare the list of storcycle files to the original AIP manifest.
     '''
     print('Analysing %s\n' % manifest)
     # Add error flag
     error_type = 0
     white_list = ['manifest-sha512.txt', 'manifest.md5']
-    with open(manifest, 'r', encoding='utf-8') as original_manifest:
-        aip_manifest = original_manifest.read().splitlines()
-        ### checksum type not consisent, hold off for agreement
-        aip_manifest_temp = []
-        for line in aip_manifest:
-            line = line[34:]
-            aip_manifest_temp.append(line)
-        # aip_manifest = original_manifest.read().splitlines()
-        ### checksum type not consisent, hold off for agreement
-    # A list of items through storcycle, that are different in local aip md5 manifest
-    storcycle_check = [item for item in storcycle_list if item not in aip_manifest_temp]
-    # A list of manifest.md5 and manifest.md5 through storcycle, that are exception for diff
-    storcycle_except = list(filter(lambda file: any([item in file for item in white_list]), storcycle_check))
-    # A list of remaning items through the storcycle, that are the items need to be diff'ed
-    storcycle_remain = list(set(storcycle_check).difference(set(storcycle_except)))
-    new_manifest = []
-    # A list of items in the local AIP manifest, that are different from the storcycle list
-    aip_check =  [item for item in aip_manifest_temp if item not in storcycle_list]
-    # Remove md5 value
-    for i in aip_check:
-        j = aip_check.index(i)
-        aip_check[j] = i[32:]
-    intsec = list(set(storcycle_remain).intersection(set(aip_check)))
-    if intsec != 0:
-        print('ERROR for dev: strongbox system remain func return value: intsec\nintsec = list(set(storcycle_remain).intersection(set(aip_check)))')
-        sys.exit()
-    # Check if the files are stuck in the delayed action
+    ### checksum type not consisent, hold off for agreement
+    differences = ififuncs.diff_manifests(manifest, storcycle_list, compare_checksums=False)
+    # manifest.md5 and manifest-sha512.txt through storcycle are exceptions for the diff
+    storcycle_except = [item[0] for item in differences.extra if any([white in item[0] for white in white_list])]
+    # The remaining items through storcycle that are not in the local AIP manifest
+    storcycle_remain = [item[0] for item in differences.extra if item[0] not in storcycle_except]
+    # Items in the local AIP manifest that are not in the storcycle list
+    aip_check = [item[0] for item in differences.missing]
     # Check if the files are actually in the storcycle
     if len(storcycle_list) == 0:
         print('ERROR *************************************** ERROR\nThe files are not in storcycle!!')
@@ -76,7 +57,7 @@ def diff_manifests(manifest, storcycle_list, txt_name_source):
             'Target AIP fixity = FAIL - items are NOT in the storcycle')
         error_type = 1
     # Check if everything in the storcycle list is in the local aip manifest.
-    elif len(storcycle_check) == 2 and len(storcycle_except) == 2 and len(storcycle_remain) == 0:
+    elif len(storcycle_except) == 2 and len(storcycle_remain) == 0:
         print('All files in the storcycle manifest are present in your local AIP manifest') # and the hashes validate')
         ififuncs.generate_txt(
             '',
@@ -46,24 +46,18 @@ def diff_manifests(manifest, strongbox_list, txt_name_source):
     # Add error flag
     error_type = 0
     white_list = ['manifest-sha512.txt', 'manifest.md5']
-    with open(manifest, 'r', encoding='utf-8') as original_manifest:
-        aip_manifest = original_manifest.read().splitlines()
-    # A list of items in strongbox, that are different in local aip sha512 manifest
-    strongbox_check = [item for item in strongbox_list if item not in aip_manifest]
-    # A list of manifest-sha512.txt and manifest.md5 in strongbox, that are exception for diff
-    strongbox_except = list(filter(lambda file: any([item in file for item in white_list]), strongbox_check))
-    # A list of remaning items in the strongbox_check, that are the items need to be diff'ed
-    strongbox_remain = list(set(strongbox_check).difference(set(strongbox_except)))
-    new_manifest = []
-    # A list of items in the local AIP manifest, that are different in the strongbox manifest
-    aip_check =  [item for item in aip_manifest if item not in strongbox_list]
-    # Remove sha512 value
-    for i in aip_check:
-        j = aip_check.index(i)
-        aip_check[j] = i[128:]
-    intsec = list(set(strongbox_remain).intersection(set(aip_check)))
+    differences = ififuncs.diff_manifests(manifest, strongbox_list)
+    # Files in strongbox that have no hash yet are stuck in the delayed action
+    strongbox_stuck = [item[0] for item in differences.mismatched if not item[2]]
+    strongbox_mismatched = [item for item in differences.mismatched if item[2]]
+    # manifest-sha512.txt and manifest.md5 in strongbox are exceptions for the diff
+    strongbox_except = [item[0] for item in differences.extra if any([white in item[0] for white in white_list])]
+    # The remaining items in strongbox that are not in the local AIP manifest
+    strongbox_remain = [item[0] for item in differences.extra if item[0] not in strongbox_except]
+    # Items in the local AIP manifest that are not in strongbox
+    aip_check = [item[0] for item in differences.missing]
     # Check if the files are stuck in the delayed action
-    if len(intsec) == 0:
+    if len(strongbox_stuck) == 0:
         # Check if the files are actually in the strongbox
         if len(strongbox_list) == 0:
             print('ERROR ***************************************')
@@ -74,7 +68,7 @@ def diff_manifests(manifest, strongbox_list, txt_name_source):
                 'Target AIP fixity = FAIL - items are NOT in the strongbox')
             error_type = 1
         # Check if everything in the strongbox list is in the local aip manifest.
-        elif len(strongbox_check) == 2 and len(strongbox_except) == 2 and len(strongbox_remain) == 0:
+        elif len(strongbox_except) == 2 and len(strongbox_remain) == 0 and len(strongbox_mismatched) == 0:
             print('All files in the strongbox manifest are present in your local AIP manifest and the hashes validate')
             ififuncs.generate_txt(
                 '',
@@ -87,9 +81,15 @@ def diff_manifests(manifest, strongbox_list, txt_name_source):
                 '',
                 txt_name_source,
                 'Target AIP fixity = FAIL - %s is in the strongbox but NOT in the local AIP manifest' % i)
+            for i, aip_hash, strongbox_hash in strongbox_mismatched:
+                print('%s has a different hash in the strongbox (%s) and the local AIP manifest (%s)' % (i, strongbox_hash, aip_hash))
+                ififuncs.generate_txt(
+                '',
+                txt_name_source,
+                'Target AIP fixity = FAIL - %s has a different hash in the strongbox (%s) and the local AIP manifest (%s)' % (i, strongbox_hash, aip_hash))
             error_type = 1
         # Check if everything in the local aip manifest list is in the strongbox.
-        if len(aip_check) == 0 and len(intsec) == 0:
+        if len(aip_check) == 0:
             print('All files in the local AIP manifest are present in your strongbox manifest and the hashes validate')
             ififuncs.generate_txt(
                 '',
@@ -104,7 +104,7 @@ def diff_manifests(manifest, strongbox_list, txt_name_source):
                     'Target AIP fixity = FAIL - %s is in the local AIP manifest but NOT in the Strongbox manifest' % i)
             error_type = 1
     else:
-        for i in intsec:
+        for i in strongbox_stuck:
             print('%s is moved to strongbox but IS NOT WRITTEN TO TAPES' % i)
             ififuncs.generate_txt(
                 '',
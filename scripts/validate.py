@@ -6,10 +6,18 @@ import sys
 import os
 import argparse
 import time
+import csv
+import json
+import math
+import random
+import sqlite3
 import unicodedata
 import ififuncs
 from ififuncs import make_desktop_logs_dir
 
+AUDIT_SAMPLE_PERCENT = 10
+AUDIT_SCHEDULE_DAYS = 180
+
 
 def get_input(manifest):
     '''
@@ -43,7 +51,7 @@ def parse_manifest(manifest, log_name_source, args):
     manifest_dict = {}
     paths = []
     proceed = 'Y'
-    os.chdir(os.path.dirname(manifest))
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
     with open(manifest, 'r', encoding='utf-8') as manifest_object:
         try:
             manifest_list = manifest_object.readlines()
@@ -57,16 +65,16 @@ def parse_manifest(manifest, log_name_source, args):
             else:
                 path = entries[34:].replace('\r', '').replace('\n', '')
             path = unicodedata.normalize('NFC', path).replace('\\', '/')
-            if not os.path.isfile(path):
+            if not os.path.isfile(os.path.join(manifest_directory, path)):
                 path = unicodedata.normalize('NFD', path)
-            if not os.path.isfile(path):
+            if not os.path.isfile(os.path.join(manifest_directory, path)):
                 ififuncs.generate_log(
                     log_name_source,
                     '%s is missing' % path
                 )
                 print(('%s is missing' % path))
                 missing_files_list.append(path)
-            elif os.path.isfile(path):
+            else:
                 manifest_dict[path] = checksum
                 paths.append(path)
     manifest_file_count = len(manifest_list)
@@ -96,34 +104,114 @@ def parse_manifest(manifest, log_name_source, args):
             )
     return manifest_dict, missing_files_list
 
-def validate(manifest_dict, manifest, log_name_source, missing_files_list):
+def validate(manifest_dict, manifest, log_name_source, missing_files_list, workers=1, fail_fast=False, device_limiter=None, results=None, journal=None):
     '''
     Validates the files listed in the checksum manifest.
+    With more than one worker, several files are hashed at the same time,
+    but the results are still reported in manifest order.
+    With fail_fast, validation stops at the first missing or mismatched file.
+    If a results list is passed, a dictionary for each file is appended to it.
+    If a HashJournal is passed, every hashed file is journaled and files that
+    were journaled by an interrupted run are not read again.
     '''
     ififuncs.generate_log(
         log_name_source,
         'Validating %s ' % manifest
     )
     error_counter = 0
-    manifest_directory = os.path.dirname(manifest)
-    os.chdir(manifest_directory)
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
+    if 'manifest-sha512.txt' in manifest:
+        algorithm = 'sha512'
+    else:
+        algorithm = 'md5'
+    if results is None:
+        results = []
     error_list = []
-    for i in sorted(manifest_dict.keys()):
-        print(('Validating %s' % i))
-        if 'manifest-sha512.txt' in manifest:
-            current_hash = ififuncs.hashlib_sha512(i)
-        else:
-            current_hash = ififuncs.hashlib_md5(i)
-        if current_hash == manifest_dict[i]:
-            print(('%s has validated' % i))
-        else:
-            print(('%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash)))
-            ififuncs.generate_log(
-                log_name_source,
-                '%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash)
-            )
-            error_list.append('%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash))
-            error_counter += 1
+    validated = set()
+    if fail_fast and len(missing_files_list) > 0:
+        print('Not validating checksums as files are missing and -fail_fast was used')
+        ififuncs.generate_log(
+            log_name_source,
+            'Checksums were not validated as files are missing and -fail_fast was used'
+        )
+    else:
+        # If the manifest has a chunk sidecar, chunk digests are calculated in
+        # the same pass so that damaged byte ranges can be reported.
+        chunk_data = ififuncs.read_chunk_sidecar(manifest)
+        chunk_size = None
+        journal_keys = [algorithm]
+        if chunk_data:
+            chunk_size = chunk_data['chunk_size']
+            journal_keys.append('chunks')
+        journaled = {}
+        if journal is not None:
+            for i in manifest_dict:
+                checksums = journal.lookup(os.path.join(manifest_directory, i), journal_keys)
+                if checksums is not None:
+                    journaled[i] = checksums
+        file_list = [os.path.join(manifest_directory, i) for i in manifest_dict if i not in journaled]
+        progress = ififuncs.Progress(
+            'Validating', len(manifest_dict),
+            sum(os.path.getsize(os.path.join(manifest_directory, i)) for i in manifest_dict)
+        )
+        hashes = ififuncs.hash_files(
+            file_list, (algorithm,), workers,
+            ordered=True, device_limiter=device_limiter, chunk_size=chunk_size,
+            progress=progress
+        )
+        try:
+            for i in manifest_dict:
+                if i in journaled:
+                    checksums = journaled[i]
+                    progress.file_done(
+                        os.path.getsize(os.path.join(manifest_directory, i)), read=False
+                    )
+                else:
+                    full_path, checksums = next(hashes)
+                    if journal is not None:
+                        journal.record(full_path, checksums)
+                current_hash = checksums[algorithm]
+                validated.add(i)
+                if current_hash == manifest_dict[i]:
+                    results.append({'path': i, 'status': 'validated', 'expected': manifest_dict[i], 'hashed': current_hash})
+                else:
+                    print(('%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash)))
+                    ififuncs.generate_log(
+                        log_name_source,
+                        '%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash)
+                    )
+                    error_list.append('%s has mismatched checksum - %s expected - %s hashed' % (i, manifest_dict[i], current_hash))
+                    result = {'path': i, 'status': 'mismatch', 'expected': manifest_dict[i], 'hashed': current_hash}
+                    if chunk_data and unicodedata.normalize('NFC', i) in chunk_data['files']:
+                        result['bad_ranges'] = ififuncs.compare_chunks(
+                            chunk_data['files'][unicodedata.normalize('NFC', i)], checksums['chunks'],
+                            os.path.getsize(os.path.join(manifest_directory, i)), chunk_size
+                        )
+                        for start, end in result['bad_ranges']:
+                            print('%s is damaged between bytes %s and %s' % (i, start, end))
+                            ififuncs.generate_log(
+                                log_name_source,
+                                '%s is damaged between bytes %s and %s' % (i, start, end)
+                            )
+                    results.append(result)
+                    error_counter += 1
+                    if fail_fast:
+                        print('Stopping at the first mismatched checksum as -fail_fast was used')
+                        ififuncs.generate_log(
+                            log_name_source,
+                            'Validation stopped at the first mismatched checksum as -fail_fast was used'
+                        )
+                        break
+        finally:
+            hashes.close()
+            progress.close()
+        if journaled:
+            print(' - Reused %s checksums from the journal of an interrupted run' % len(journaled))
+    for i in manifest_dict:
+        if i not in validated:
+            results.append({'path': i, 'status': 'not validated', 'expected': manifest_dict[i], 'hashed': ''})
+    for i in missing_files_list:
+        results.append({'path': i, 'status': 'missing', 'expected': '', 'hashed': ''})
     if error_counter > 0:
         print(('\n\n*****ERRORS***********!!!!\n***********\nThe number of mismatched checksums is: %s\n***********\n' % error_counter))
         ififuncs.generate_log(
@@ -150,6 +238,278 @@ def validate(manifest_dict, manifest, log_name_source, missing_files_list):
     return error_counter + len(missing_files_list)
 
 
+def write_results(results, results_file, manifest, log_name_source):
+    '''
+    Writes the per file validation results as JSON, or as CSV if
+    results_file ends with .csv, so that other tools can read them.
+    '''
+    if results_file.lower().endswith('.csv'):
+        with open(results_file, 'w', encoding='utf-8', newline='') as fo:
+            writer = csv.writer(fo)
+            writer.writerow(['path', 'status', 'expected', 'hashed'])
+            for result in results:
+                writer.writerow([result['path'], result['status'], result['expected'], result['hashed']])
+    else:
+        with open(results_file, 'w', encoding='utf-8') as fo:
+            json.dump(
+                {'manifest': os.path.abspath(manifest), 'files': results},
+                fo, indent=4
+            )
+    print('Validation results have been written to %s' % results_file)
+    ififuncs.generate_log(
+        log_name_source,
+        'Validation results have been written to %s' % results_file
+    )
+
+
+def repair_files(results, manifest, repair_from, log_name_source):
+    '''
+    Repairs mismatched files by copying only their damaged chunks from a
+    good replica of the package. repair_from is the folder of the replica
+    that matches the folder of the manifest. The replica chunks are checked
+    against the chunk sidecar before they are copied and the repaired file
+    is fully hashed again. Returns the number of files that were repaired.
+    '''
+    chunk_data = ififuncs.read_chunk_sidecar(manifest)
+    if not chunk_data:
+        return 0
+    chunk_size = chunk_data['chunk_size']
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
+    if 'manifest-sha512.txt' in manifest:
+        algorithm = 'sha512'
+    else:
+        algorithm = 'md5'
+    repaired = 0
+    for result in results:
+        if result['status'] != 'mismatch' or 'bad_ranges' not in result:
+            continue
+        damaged_file = os.path.join(manifest_directory, result['path'])
+        good_file = os.path.join(repair_from, result['path'])
+        if not os.path.isfile(good_file):
+            print('%s is not in the replica, so it can not be repaired' % result['path'])
+            continue
+        record = chunk_data['files'][unicodedata.normalize('NFC', result['path'])]
+        replica_ok = True
+        for start, end in result['bad_ranges']:
+            for index, digest in ififuncs.hash_chunks(good_file, chunk_size, start // chunk_size, (end // chunk_size) + 1):
+                if index >= len(record['chunks']) or digest != record['chunks'][index]:
+                    replica_ok = False
+        if not replica_ok:
+            print('The replica of %s is also damaged, so it can not be used for repair' % result['path'])
+            ififuncs.generate_log(
+                log_name_source,
+                'The replica %s does not match the chunk checksums of %s and was not used for repair' % (good_file, result['path'])
+            )
+            continue
+        copied = ififuncs.repair_chunks(good_file, damaged_file, result['bad_ranges'])
+        current_hash = ififuncs.hashlib_multi(damaged_file, (algorithm,))[algorithm]
+        if current_hash == result['expected']:
+            result['status'] = 'repaired'
+            result['hashed'] = current_hash
+            repaired += 1
+            print('%s has been repaired from %s' % (result['path'], good_file))
+            ififuncs.generate_log(
+                log_name_source,
+                'EVENT = eventType=fixity repair, eventDetail=%s bytes in %s damaged ranges copied from %s, eventOutcome=%s has validated after repair, agentName=validate.py' % (
+                    copied, len(result['bad_ranges']), good_file, result['path']
+                )
+            )
+        else:
+            print('%s still has a mismatched checksum after repair' % result['path'])
+            ififuncs.generate_log(
+                log_name_source,
+                'EVENT = eventType=fixity repair, eventDetail=%s bytes copied from %s, eventOutcome=%s still has a mismatched checksum - %s expected - %s hashed, agentName=validate.py' % (
+                    copied, good_file, result['path'], result['expected'], current_hash
+                )
+            )
+    return repaired
+
+
+def get_audit_db():
+    '''
+    Returns a connection to the SQLite database that records when every
+    file in an audited manifest was last seen and last fully hashed.
+    It lives in the desktop logs directory.
+    '''
+    audit_db = os.path.join(make_desktop_logs_dir(), 'fixity_audit.sqlite')
+    connection = sqlite3.connect(audit_db, timeout=60)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS audit ('
+        'manifest TEXT, path TEXT, size INTEGER, mtime_ns INTEGER, '
+        'first_seen REAL, last_hashed REAL, outcome TEXT, '
+        'PRIMARY KEY (manifest, path))'
+    )
+    connection.commit()
+    return connection
+
+
+def get_audit_records(connection, manifest):
+    '''
+    Returns a dictionary of
+    {path: (size, mtime_ns, first_seen, last_hashed, outcome)}
+    for every file in a manifest that has been audited before.
+    '''
+    audit_records = {}
+    for path, size, mtime_ns, first_seen, last_hashed, outcome in connection.execute(
+            'SELECT path, size, mtime_ns, first_seen, last_hashed, outcome FROM audit WHERE manifest = ?',
+            (os.path.abspath(manifest),)):
+        audit_records[path] = (size, mtime_ns, first_seen, last_hashed, outcome)
+    return audit_records
+
+
+def stat_pass(manifest_dict, manifest, log_name_source, audit_records):
+    '''
+    Metadata only audit. The size and modification time of every file is
+    compared against the values that were recorded when it was last audited.
+    Files that are seen for the first time get a baseline instead.
+    Files whose last full hash was a mismatch count as changed until a
+    later hash passes.
+    Returns a dictionary of the current {path: (size, mtime_ns)} and a list
+    of files that have changed.
+    '''
+    manifest_directory = os.path.dirname(os.path.abspath(manifest))
+    current_stats = {}
+    changed_files = []
+    for path in manifest_dict:
+        file_stat = os.stat(os.path.join(manifest_directory, path))
+        current_stats[path] = (file_stat.st_size, file_stat.st_mtime_ns)
+        if path in audit_records:
+            if audit_records[path][:2] != current_stats[path]:
+                print('%s has changed size or modification time since it was last audited' % path)
+                ififuncs.generate_log(
+                    log_name_source,
+                    '%s has changed size or modification time since it was last audited - %s bytes/%s mtime_ns expected - %s bytes/%s mtime_ns found' % (
+                        (path,) + audit_records[path][:2] + current_stats[path]
+                    )
+                )
+                changed_files.append(path)
+            elif audit_records[path][4] == 'mismatch':
+                print('%s did not match its checksum when it was last hashed' % path)
+                ififuncs.generate_log(
+                    log_name_source,
+                    '%s did not match its checksum when it was last hashed' % path
+                )
+                changed_files.append(path)
+    new_files = len([path for path in manifest_dict if path not in audit_records])
+    ififuncs.generate_log(
+        log_name_source,
+        'Metadata audit of %s files - %s changed - %s recorded for the first time' % (
+            len(manifest_dict), len(changed_files), new_files
+        )
+    )
+    return current_stats, changed_files
+
+
+def choose_sample(manifest_dict, audit_records, changed_files, sample, sample_mode, schedule_days):
+    '''
+    Chooses which files will be fully hashed in a sampled audit.
+    Files that have changed, files whose last hash was a mismatch, and
+    files that have not been hashed within schedule_days, are always chosen. The sample is then topped up to
+    sample percent of the manifest, either at random or by rotating
+    through the files that were hashed longest ago.
+    Returns the chosen paths in manifest order.
+    '''
+    deadline = time.time() - (schedule_days * 86400)
+    chosen = set(changed_files)
+    for path in manifest_dict:
+        if path in audit_records:
+            _, _, first_seen, last_hashed, outcome = audit_records[path]
+            if outcome == 'mismatch' or (last_hashed or first_seen) < deadline:
+                chosen.add(path)
+    sample_size = int(math.ceil(len(manifest_dict) * sample / 100.0))
+    remaining = [path for path in manifest_dict if path not in chosen]
+    top_up = min(max(sample_size - len(chosen), 0), len(remaining))
+    if sample_mode == 'random':
+        chosen.update(random.sample(remaining, top_up))
+    else:
+        # files that have never been hashed come first, then the oldest.
+        remaining.sort(key=lambda path: audit_records.get(path, (0, 0, 0, 0, None))[3] or 0)
+        chosen.update(remaining[:top_up])
+    return [path for path in manifest_dict if path in chosen]
+
+
+def update_audit_records(connection, manifest, current_stats, results):
+    '''
+    Records the metadata of every audited file and the time and outcome of
+    every file that was fully hashed.
+    '''
+    now = time.time()
+    manifest = os.path.abspath(manifest)
+    hashed = dict((result['path'], result['status']) for result in results if result['status'] in ('validated', 'mismatch'))
+    for path, (size, mtime_ns) in current_stats.items():
+        connection.execute(
+            'INSERT OR IGNORE INTO audit (manifest, path, first_seen) VALUES (?, ?, ?)',
+            (manifest, path, now)
+        )
+        if path in hashed:
+            connection.execute(
+                'UPDATE audit SET size = ?, mtime_ns = ?, last_hashed = ?, outcome = ? WHERE manifest = ? AND path = ?',
+                (size, mtime_ns, now, hashed[path], manifest, path)
+            )
+        else:
+            # the metadata baseline is only set here for files that have not
+            # been seen before, so that a change is reported until it is hashed.
+            connection.execute(
+                'UPDATE audit SET size = ?, mtime_ns = ? WHERE manifest = ? AND path = ? AND size IS NULL',
+                (size, mtime_ns, manifest, path)
+            )
+    connection.commit()
+
+
+def audit(args, manifest, manifest_dict, missing_files_list, log_name_source, device_limiter, results, journal=None):
+    '''
+    Runs a tiered fixity audit. Every tier starts with a metadata only pass.
+    The stat tier stops there, the sample tier fully hashes a sample of
+    files and the full tier hashes everything.
+    The outcome for every file is stored in the audit database.
+    '''
+    connection = get_audit_db()
+    audit_records = get_audit_records(connection, manifest)
+    current_stats, changed_files = stat_pass(manifest_dict, manifest, log_name_source, audit_records)
+    if args.tier == 'stat':
+        chosen = []
+    elif args.tier == 'sample':
+        chosen = choose_sample(
+            manifest_dict, audit_records, changed_files,
+            args.sample, args.sample_mode, args.schedule_days
+        )
+    else:
+        chosen = list(manifest_dict)
+    ififuncs.generate_log(
+        log_name_source,
+        'Fixity audit tier=%s - %s of %s files will be fully hashed' % (args.tier, len(chosen), len(manifest_dict))
+    )
+    print('Fixity audit tier=%s - %s of %s files will be fully hashed' % (args.tier, len(chosen), len(manifest_dict)))
+    if args.tier == 'stat':
+        error_counter = len(changed_files) + len(missing_files_list)
+        if error_counter == 0:
+            print('All files are present and unchanged')
+            ififuncs.generate_log(
+                log_name_source,
+                'All files are present and unchanged'
+            )
+    else:
+        error_counter = validate(
+            dict((path, manifest_dict[path]) for path in chosen), manifest, log_name_source,
+            missing_files_list, args.workers, args.fail_fast, device_limiter, results,
+            journal
+        )
+    chosen = set(chosen)
+    for path in manifest_dict:
+        if path not in chosen:
+            if path in changed_files:
+                status = 'metadata changed'
+            else:
+                status = 'metadata unchanged'
+            results.append({'path': path, 'status': status, 'expected': manifest_dict[path], 'hashed': ''})
+    if args.tier == 'stat':
+        for path in missing_files_list:
+            results.append({'path': path, 'status': 'missing', 'expected': '', 'hashed': ''})
+    update_audit_records(connection, manifest, current_stats, results)
+    connection.close()
+    return error_counter
+
+
 def make_parser(args_):
     '''
     Creates command line arguments and help.
@@ -159,17 +519,73 @@ def make_parser(args_):
     parser.add_argument('input', help='file path of md5 checksum file')
     parser.add_argument('-update_log', help='updates the package log file with the fixity check information', action='store_true')
     parser.add_argument('-y', help='answer Y to user input questions regarding manifest issues', action='store_true')
+    parser.add_argument(
+        '-workers', type=int, default=ififuncs.HASH_WORKERS,
+        help='Number of files to hash at the same time. Default is %s. Use 1 to hash one file at a time.' % ififuncs.HASH_WORKERS
+    )
+    parser.add_argument(
+        '-device_workers', type=int, default=ififuncs.HASH_WORKERS_PER_DEVICE,
+        help='Maximum number of files that are read at the same time from any one storage device. Default is %s.' % ififuncs.HASH_WORKERS_PER_DEVICE
+    )
+    parser.add_argument('-fail_fast', help='stop validating at the first missing file or mismatched checksum', action='store_true')
+    parser.add_argument('-results', help='full path of a JSON file, or a CSV file if the filename ends with .csv, that will list the outcome for every file in the manifest')
+    parser.add_argument(
+        '-repair_from',
+        help='full path of the folder of a good replica of the package, at the same level as the manifest. Damaged chunks of mismatched files are copied from the replica. This needs a _chunks.json sidecar from manifest.py -chunks or copyit.py -chunks'
+    )
+    parser.add_argument(
+        '-tier', choices=['stat', 'sample', 'full'],
+        help='Run a tiered fixity audit and record the outcome in a database in the desktop logs directory. '
+        'stat only checks that files exist and that their size and modification time have not changed. '
+        'sample also fully hashes the -sample percentage of files, plus any changed files and any file that has not been hashed within -schedule_days. '
+        'full hashes every file.'
+    )
+    parser.add_argument(
+        '-sample', type=float, default=AUDIT_SAMPLE_PERCENT,
+        help='Percentage of files to fully hash with -tier sample. Default is %s.' % AUDIT_SAMPLE_PERCENT
+    )
+    parser.add_argument(
+        '-sample_mode', choices=['rotating', 'random'], default='rotating',
+        help='rotating hashes the files that were hashed longest ago, random picks files at random. Default is rotating.'
+    )
+    parser.add_argument(
+        '-schedule_days', type=int, default=AUDIT_SCHEDULE_DAYS,
+        help='With -tier sample, every file is fully hashed at least once within this many days. Default is %s.' % AUDIT_SCHEDULE_DAYS
+    )
+    parser.add_argument('-fixity_cache', choices=ififuncs.FIXITY_CACHE_POLICIES, help='Fixity cache policy. Files are always re-read for validation, but any policy other than off records the fresh checksums in the local cache.')
+    parser.add_argument(
+        '-progress_file',
+        help='Full path of a file that progress is written to as JSON every few seconds, so that the validation can be monitored remotely.'
+    )
     parsed_args = parser.parse_args(args_)
     return parsed_args
 
 
-def check_manifest(args, log_name_source):
+def check_manifest(args, log_name_source, device_limiter=None):
     '''
     Launches other functions.
     '''
     manifest = get_input(args.input)
     manifest_dict, missing_files_list = parse_manifest(manifest, log_name_source, args)
-    error_counter = validate(manifest_dict, manifest, log_name_source, missing_files_list)
+    if device_limiter is None:
+        device_limiter = ififuncs.DeviceLimiter(args.device_workers)
+    results = []
+    journal = ififuncs.open_hash_journal(manifest, 'validation', log_name_source)
+    if args.tier:
+        error_counter = audit(
+            args, manifest, manifest_dict, missing_files_list,
+            log_name_source, device_limiter, results, journal
+        )
+    else:
+        error_counter = validate(
+            manifest_dict, manifest, log_name_source, missing_files_list,
+            args.workers, args.fail_fast, device_limiter, results, journal
+        )
+    journal.close()
+    if args.repair_from:
+        error_counter -= repair_files(results, manifest, args.repair_from, log_name_source)
+    if args.results:
+        write_results(results, args.results, manifest, log_name_source)
     return manifest, error_counter
 
 
@@ -178,7 +594,6 @@ def log_results(manifest, log, args):
     If a sipcreator type log is found,validate will update the log with the
     results.
     '''
-    updated_manifest = []
     if 'manifest-sha512.txt' in manifest:
         basename = os.path.basename(manifest).replace('_manifest-sha512.txt', '')
     else:
@@ -196,27 +611,25 @@ def log_results(manifest, log, args):
             for lines in validate_log:
                 ba.write(lines)
         for possible_manifest in possible_manifests:
+            possible_manifest = os.path.join(os.path.dirname(os.path.abspath(manifest)), possible_manifest)
             if os.path.isfile(possible_manifest):
-                with open(possible_manifest, 'r') as manifesto:
-                    manifest_lines = manifesto.readlines()
-                    for lines in manifest_lines:
-                        if logname in lines:
-                            if 'manifest-sha512.txt' in possible_manifest:
-                                lines = lines[:127].replace(lines[:127], ififuncs.hashlib_sha512(logfile)) + lines[128:]
-                            elif '_manifest.md5' in possible_manifest:
-                                lines = lines[:31].replace(lines[:31], ififuncs.hashlib_md5(logfile)) + lines[32:]
-                        updated_manifest.append(lines)
-                with open(possible_manifest, 'w') as fo:
-                    for lines in updated_manifest:
-                        fo.write(lines)
-                updated_manifest = []
-
-
-def main(args_):
+                if 'manifest-sha512.txt' in possible_manifest:
+                    ififuncs.checksum_replace(possible_manifest, logfile, 'sha512')
+                elif '_manifest.md5' in possible_manifest:
+                    ififuncs.checksum_replace(possible_manifest, logfile, 'md5')
+
+
+def main(args_, device_limiter=None):
     '''
     Launches all other functions when called from the command line.
+    A shared ififuncs.DeviceLimiter can be passed in by scripts such as
+    batchvalidate.py that validate several packages at the same time.
     '''
     args = make_parser(args_)
+    if args.fixity_cache:
+        ififuncs.set_fixity_cache_policy(args.fixity_cache)
+    if args.progress_file:
+        ififuncs.set_progress_file(args.progress_file)
     desktop_logs_dir = make_desktop_logs_dir()
     log_name_source_ = os.path.basename(args.input) + time.strftime("_%Y_%m_%dT%H_%M_%S")
     log_name_source = "%s/%s_fixity_validation.log" % (desktop_logs_dir, log_name_source_)
@@ -232,7 +645,7 @@ def main(args_):
         log_name_source,
         'Command line arguments: %s' % args
     )
-    manifest, error_counter = check_manifest(args, log_name_source)
+    manifest, error_counter = check_manifest(args, log_name_source, device_limiter)
     if args.update_log:
         log_results(manifest, log_name_source, args)
     return error_counter
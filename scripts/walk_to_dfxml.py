@@ -26,6 +26,7 @@ import sys
 _logger = logging.getLogger(os.path.basename(__file__))
 
 import Objects
+import ififuncs
 
 def filepath_to_fileobject(filepath, args):
     fobj = Objects.FileObject()
@@ -73,30 +74,23 @@ def filepath_to_fileobject(filepath, args):
         #Add hashes for regular files.
         if fobj.name_type == "r":
             try:
-                with open(filepath, "rb") as in_fh:
-                    chunk_size = 2**22
-                    md5obj = hashlib.md5()
-                    sha512obj = hashlib.sha512()
-                    any_error = False
-                    while True:
-                        buf = b""
-                        try:
-                            buf = in_fh.read(chunk_size)
-                        except Exception as e:
-                            any_error = True
-                            fobj.error = "".join(traceback.format_stack())
-                            if e.args:
-                                fobj.error += "\n" + str(e.args)
-                            buf = b""
-                        if buf == b"":
-                            break
-
+                chunk_size = 2**22
+                md5obj = hashlib.md5()
+                sha512obj = hashlib.sha512()
+                any_error = False
+                try:
+                    for buf in ififuncs.read_blocks(filepath, block_size=chunk_size):
                         md5obj.update(buf)
                         sha512obj.update(buf)
-
-                    if not any_error:
-                        fobj.md5 = md5obj.hexdigest()
-                        fobj.sha512 = sha512obj.hexdigest()
+                except Exception as e:
+                    any_error = True
+                    fobj.error = "".join(traceback.format_stack())
+                    if e.args:
+                        fobj.error += "\n" + str(e.args)
+
+                if not any_error:
+                    fobj.md5 = md5obj.hexdigest()
+                    fobj.sha512 = sha512obj.hexdigest()
             except Exception as e:
                 if fobj.error is None:
                     fobj.error = ""
@@ -34,6 +34,7 @@ NOTE: Objects.py has been copied from https://github.com/simsong/dfxml. walk_to_
         'scripts/batchsc_validate.py',
         'scripts/batchsipcreator.py',
         'scripts/batchvalidate.py',
+        'scripts/benchmark.py',
         'scripts/bitc.py',
         'scripts/check_register.py',
         'scripts/concat.py',
@@ -44,6 +45,7 @@ NOTE: Objects.py has been copied from https://github.com/simsong/dfxml. walk_to_
         'scripts/deletefiles.py',
         'scripts/dfxml.py',
         'scripts/durationcheck.py',
+        'scripts/fakecorpus.py',
         'scripts/ffv1mkvvalidate.py',
         'scripts/framemd5.py',
         'scripts/get_ps_list.py',